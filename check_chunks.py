@@ -1,6 +1,5 @@
 # check_chunks.py
-import json
-from rag_system.api_service.utils.database import extended_db
+from rag_system.api_service.utils.database import extended_db, decode_embedding
 
 def main():
     # Thống kê tổng quan
@@ -21,7 +20,7 @@ def main():
               f"title={row['title']}, active={row['is_active']}, invalidated_by={row['invalidated_by']}, "
               f"embedding_len={row['emb_len']}")
     
-    # Kiểm tra embedding có hợp lệ JSON không
+    # Kiểm tra embedding có giải mã được không
     with extended_db.get_cursor() as cursor:
         cursor.execute("""
             SELECT id, chunk_id, embedding 
@@ -34,10 +33,10 @@ def main():
     print("\n=== Embedding samples ===")
     for row in emb_rows:
         try:
-            emb = json.loads(row['embedding'])
-            print(f"ID={row['id']}, chunk_id={row['chunk_id']}, emb_dim={len(emb)}")
-        except json.JSONDecodeError:
-            print(f"ID={row['id']}, chunk_id={row['chunk_id']} → INVALID embedding JSON")
+            emb = decode_embedding(row['embedding'])
+            print(f"ID={row['id']}, chunk_id={row['chunk_id']}, emb_dim={emb.shape[0]}")
+        except ValueError:
+            print(f"ID={row['id']}, chunk_id={row['chunk_id']} → INVALID embedding")
 
 if __name__ == "__main__":
     main()
@@ -7,29 +7,42 @@ Ingestion module (GPU-enabled, heading-aware + semantic chunking):
 - Parse headings (H1..H6) to make sections
 - Semantic chunking per section using embeddings (AITeamVN/Vietnamese_Embedding)
 - GPU acceleration for embeddings if CUDA is available
-- Output normalized JSON (tokens + embedding vectors ready for FAISS)
+- Output streaming JSONL per document (one chunk per line) + .f32 embedding sidecar
 
 Folder layout (auto-created if missing):
   ../data/raw_documents      # input files
-  ../data/ingested_json      # output JSON
+  ../data/ingested_json      # output <doc>.jsonl + <doc>.f32
+
+Pipeline: a process pool extracts + tokenizes files, an embedding thread fed by a
+bounded queue encodes batches that span files, and a writer thread streams the
+output to disk. If a stage fails, the run stops and partial outputs are removed.
 
 Run:
   pip install -r requirements.txt
-  python ingestion_module_upgraded.py
+  python ingestionBetter.py [--extract-workers N] [--embed-batch-size N] [--embed-queue-size N] [--write-queue-size N]
 """
 import os
-import json
+import argparse
+import hashlib
 import logging
+import multiprocessing as mp
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 from datetime import datetime
-from typing import List
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 
 from sentence_transformers import SentenceTransformer
-from pyvi import ViTokenizer
 from colorama import Fore, Style, init as colorama_init
 
-import unicodedata
-import re
+# Dùng chung chuẩn hóa và tách từ tiếng Việt với API (cache query embedding, BM25)
+from rag_system.api_service.utils.text_processing import preprocess_vietnamese, content_hash
+from rag_system.api_service.utils.chunk_stream import ChunkStreamWriter, ChunkStreamReader, CHUNKS_SUFFIX
+from rag_system.api_service.models.embeddings import PersistentEmbeddingCache
 
 # ==== CONFIG ====
 RAW_DIR = "rag_system/data/raw_documents"
@@ -37,6 +50,12 @@ OUTPUT_DIR = "rag_system/data/ingested_json"
 MODEL_NAME = "AITeamVN/Vietnamese_Embedding"
 CHUNK_SIZE = 500  # số ký tự mỗi chunk
 CHUNK_OVERLAP = 50
+EMBED_BATCH_SIZE = 64  # số chunk mỗi lần encode (gom từ nhiều file)
+EXTRACT_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # process đọc file + tách từ
+EMBED_QUEUE_SIZE = 8  # số tài liệu đã tách chunk chờ embed tối đa
+WRITE_QUEUE_SIZE = 16  # số batch chờ ghi tối đa
+EMBEDDING_CACHE_PATH = "rag_system/data/embedding_cache.db"  # cache vector theo (model, hash text)
+EMBEDDING_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
 USE_GPU = True
 
 # ==== INIT COLOR LOG ====
@@ -48,21 +67,6 @@ def log_success(msg): logging.info(Fore.GREEN + msg + Style.RESET_ALL)
 def log_warn(msg): logging.warning(Fore.YELLOW + msg + Style.RESET_ALL)
 def log_error(msg): logging.error(Fore.RED + msg + Style.RESET_ALL)
 
-# ==== TEXT CLEANING ====
-def clean_text(text: str) -> str:
-    # Chuẩn hóa Unicode NFC
-    text = unicodedata.normalize("NFC", text)
-    # Loại bỏ BOM, zero-width space
-    text = text.replace("\ufeff", "").replace("\u200b", "")
-    # Thay nhiều khoảng trắng bằng 1
-    text = re.sub(r"\s+", " ", text)
-    return text.strip()
-
-# ==== TOKENIZE VIETNAMESE ====
-def preprocess_vietnamese(text: str) -> str:
-    text = clean_text(text)
-    return ViTokenizer.tokenize(text)
-
 # ==== CHUNKING ====
 def chunk_text(text: str, size: int, overlap: int) -> List[str]:
     chunks = []
@@ -95,63 +99,395 @@ def read_file(file_path: Path) -> str:
         log_error(f"❌ Lỗi đọc file {file_path.name}: {e}")
         return ""
 
+# ==== PIPELINE ====
+# extract (process pool) -> embed (thread, batch xuyên file) -> write (thread ghi bất đồng bộ)
+# Các stage nối nhau bằng hàng đợi có giới hạn: stage sau chậm thì stage trước bị chặn
+
+class StageMetrics:
+    """Thời gian bận và số lượng item của một stage trong pipeline."""
+
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, items: int, seconds: float):
+        with self._lock:
+            self.items += items
+            self.busy_seconds += seconds
+
+    def report(self, wall_seconds: float) -> str:
+        rate = self.items / self.busy_seconds if self.busy_seconds > 0 else 0.0
+        utilization = self.busy_seconds / wall_seconds * 100 if wall_seconds > 0 else 0.0
+        return (f"{self.name:<8} {self.items:>7} {self.unit:<6} | bận {self.busy_seconds:7.2f}s "
+                f"({utilization:5.1f}% wall) | {rate:8.1f} {self.unit}/s")
+
+
+def extract_and_chunk(file_path: str, chunk_size: int, chunk_overlap: int) -> Tuple[str, List[str], float]:
+    """Stage 1 (chạy trong process pool): đọc file, tiền xử lý tiếng Việt, chia chunk."""
+    start = time.perf_counter()
+    file = Path(file_path)
+    text = read_file(file)
+    chunks = chunk_text(preprocess_vietnamese(text), chunk_size, chunk_overlap) if text.strip() else []
+    return file_path, chunks, time.perf_counter() - start
+
+
+class DocumentWriterThread(threading.Thread):
+    """Stage 3: ghi các batch đã embed ra JSONL + .f32, mỗi tài liệu một ChunkStreamWriter."""
+
+    def __init__(self, output_dir: str, queue_size: int, metrics: StageMetrics):
+        super().__init__(name="ingestion-writer", daemon=True)
+        self.output_dir = output_dir
+        self.queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self.metrics = metrics
+        self.completed: List[str] = []
+        self.failed: List[str] = []
+        self._writers: Dict[str, ChunkStreamWriter] = {}
+        self._expected: Dict[str, int] = {}
+
+    def open_document(self, header: Dict, total_chunks: int):
+        self.queue.put(("open", header, total_chunks))
+
+    def write(self, doc_id: str, records: List[Dict], embeddings: np.ndarray):
+        self.queue.put(("write", doc_id, records, embeddings))
+
+    def close(self):
+        self.queue.put(("stop",))
+        self.join()
+
+    def run(self):
+        while True:
+            command = self.queue.get()
+            if command[0] == "stop":
+                break
+            start = time.perf_counter()
+            if command[0] == "open":
+                _, header, total_chunks = command
+                self._open(header, total_chunks)
+            else:
+                _, doc_id, records, embeddings = command
+                self._write(doc_id, records, embeddings)
+                self.metrics.record(len(records), time.perf_counter() - start)
+
+        for doc_id, writer in self._writers.items():
+            log_error(f"❌ {doc_id}: thiếu chunk khi kết thúc pipeline, bỏ file tạm.")
+            writer.close(commit=False)
+            self.failed.append(doc_id)
+
+    def _open(self, header: Dict, total_chunks: int):
+        doc_id = header["document_id"]
+        try:
+            self._writers[doc_id] = ChunkStreamWriter(self.output_dir, header)
+            self._expected[doc_id] = total_chunks
+        except Exception as e:
+            log_error(f"❌ Lỗi mở file output cho {doc_id}: {e}")
+            self.failed.append(doc_id)
+
+    def _write(self, doc_id: str, records: List[Dict], embeddings: np.ndarray):
+        writer = self._writers.get(doc_id)
+        if writer is None:
+            return
+        try:
+            writer.write_batch(records, embeddings)
+            if writer.count == self._expected[doc_id]:
+                writer.close()
+                del self._writers[doc_id]
+                self.completed.append(doc_id)
+                log_success(f"💾 Đã lưu {writer.chunks_path.name} ({writer.count} chunks)")
+        except Exception as e:
+            log_error(f"❌ Lỗi ghi {doc_id}: {e}")
+            writer.close(commit=False)
+            del self._writers[doc_id]
+            self.failed.append(doc_id)
+
+
+class EmbeddingStage(threading.Thread):
+    """
+    Stage 2 (thread): nhận chunk của từng tài liệu qua hàng đợi, gom chunk của nhiều file
+    thành batch EMBED_BATCH_SIZE và encode một lần.
+    Chunk có sẵn vector (text không đổi so với lần ingest trước) đi cùng batch để giữ thứ tự
+    ghi nhưng không được encode lại.
+    Lỗi encode dừng thread; add()/close() ném lại lỗi đó cho main thread.
+    """
+
+    def __init__(self, model, batch_size: int, writer: DocumentWriterThread, metrics: StageMetrics,
+                 embedding_cache: Optional[PersistentEmbeddingCache] = None, queue_size: int = EMBED_QUEUE_SIZE):
+        super().__init__(name="ingestion-embed", daemon=True)
+        self.model = model
+        self.embedding_cache = embedding_cache
+        self.batch_size = batch_size
+        self.writer = writer
+        self.metrics = metrics
+        self.reused = 0
+        self.queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self.error: Optional[BaseException] = None
+        self._aborted = threading.Event()
+        self._pending: List[Tuple[str, Dict, Optional[np.ndarray]]] = []
+        self._to_encode = 0
+
+    def add(self, doc_id: str, records: List[Dict], previous: Optional[Dict[str, np.ndarray]] = None):
+        """Đưa chunk của một tài liệu vào hàng đợi (chặn khi đầy)."""
+        self._put(("add", doc_id, records, previous))
+
+    def close(self):
+        """Encode phần còn lại, dừng thread; ném lại lỗi của stage nếu có."""
+        try:
+            self._put(("stop",))
+        finally:
+            self.join()
+        if self.error is not None:
+            raise RuntimeError(f"Stage embed lỗi: {self.error}") from self.error
+
+    def abort(self):
+        """Dừng thread, bỏ các chunk chưa encode (pipeline đang bị hủy)."""
+        self._aborted.set()
+        try:
+            self.queue.put_nowait(("stop",))
+        except queue.Full:
+            pass  # thread kiểm tra _aborted sau mỗi lệnh
+        self.join()
+
+    def _put(self, command):
+        # Không chặn mãi nếu thread đã chết: hàng đợi sẽ không bao giờ được lấy ra nữa
+        while True:
+            if self.error is not None:
+                raise RuntimeError(f"Stage embed lỗi: {self.error}") from self.error
+            try:
+                self.queue.put(command, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def run(self):
+        try:
+            while not self._aborted.is_set():
+                command = self.queue.get()
+                if command[0] == "stop":
+                    break
+                _, doc_id, records, previous = command
+                self._add(doc_id, records, previous)
+            if not self._aborted.is_set():
+                self.flush()
+        except BaseException as e:
+            log_error(f"❌ Lỗi embed: {e}")
+            self.error = e
+
+    def _add(self, doc_id: str, records: List[Dict], previous: Optional[Dict[str, np.ndarray]] = None):
+        previous = previous or {}
+        for record in records:
+            vector = previous.get(record["text_hash"])
+            self._pending.append((doc_id, record, vector))
+            if vector is None:
+                self._to_encode += 1
+            else:
+                self.reused += 1
+            if self._to_encode >= self.batch_size or len(self._pending) >= 4 * self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """Encode batch đang gom (chỉ gọi từ thread của stage)."""
+        if not self._pending:
+            return
+        batch, self._pending, self._to_encode = self._pending, [], 0
+        rows = [i for i, (_, _, vector) in enumerate(batch) if vector is None]
+        vectors = [vector for _, _, vector in batch]
+        if rows:
+            start = time.perf_counter()
+            texts = [batch[i][1]["text"] for i in rows]
+            if self.embedding_cache is not None:
+                # Cache bền vững: text đã từng encode (ở bất kỳ tài liệu/lần chạy nào) không encode lại
+                encoded = self.embedding_cache.encode(self.model, texts)
+            else:
+                encoded = self.model.encode(texts, normalize_embeddings=True)
+            self.metrics.record(len(rows), time.perf_counter() - start)
+            for i, vector in zip(rows, encoded):
+                vectors[i] = vector
+        embeddings = np.vstack(vectors).astype(np.float32)
+
+        # Chuyển vector về writer theo từng tài liệu (giữ nguyên thứ tự chunk)
+        start_row = 0
+        while start_row < len(batch):
+            doc_id = batch[start_row][0]
+            end_row = start_row
+            while end_row < len(batch) and batch[end_row][0] == doc_id:
+                end_row += 1
+            self.writer.write(doc_id, [record for _, record, _ in batch[start_row:end_row]],
+                              embeddings[start_row:end_row])
+            start_row = end_row
+
+
+# ==== INCREMENTAL ====
+def file_hash(file_path: Path) -> str:
+    """SHA-256 của file gốc, đọc theo block 1 MB."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def previous_output(output_dir: str, doc_id: str) -> Optional[ChunkStreamReader]:
+    """Bản ingest trước của tài liệu (nếu có và cùng model)."""
+    path = Path(output_dir) / f"{doc_id}{CHUNKS_SUFFIX}"
+    if not path.exists():
+        return None
+    try:
+        reader = ChunkStreamReader(path)
+    except (OSError, ValueError) as e:
+        log_warn(f"⚠️ Không đọc được {path.name}, sẽ ingest lại toàn bộ: {e}")
+        return None
+    if reader.header.get("model_name") != MODEL_NAME:
+        return None
+    return reader
+
+
+def previous_embeddings(reader: Optional[ChunkStreamReader]) -> Dict[str, np.ndarray]:
+    """text_hash -> vector của các chunk trong bản ingest trước, để dùng lại."""
+    if reader is None:
+        return {}
+    return {
+        chunk.get("text_hash") or content_hash(chunk.get("text", "")): vector
+        for chunk, vector in reader if vector is not None
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Ingest raw documents into JSONL + .f32 embedding files.")
+    parser.add_argument("--raw-dir", default=RAW_DIR)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--extract-workers", type=int, default=EXTRACT_WORKERS,
+                        help="Số process đọc file / tách từ (mặc định: số CPU - 1)")
+    parser.add_argument("--embed-batch-size", type=int, default=EMBED_BATCH_SIZE,
+                        help="Số chunk mỗi lần gọi model.encode (gom xuyên file)")
+    parser.add_argument("--embed-queue-size", type=int, default=EMBED_QUEUE_SIZE,
+                        help="Số tài liệu đã tách chunk tối đa chờ embed trước khi stage extract bị chặn")
+    parser.add_argument("--write-queue-size", type=int, default=WRITE_QUEUE_SIZE,
+                        help="Số batch tối đa chờ ghi trước khi stage embed bị chặn")
+    parser.add_argument("--embedding-cache", default=EMBEDDING_CACHE_PATH,
+                        help="File SQLite cache embedding; truyền chuỗi rỗng để tắt")
+    parser.add_argument("--force", action="store_true",
+                        help="Ingest lại mọi file, kể cả file không đổi (file_hash trùng)")
+    return parser.parse_args()
+
+
+def run_pipeline(args: argparse.Namespace, files: List[Path], file_hashes: Dict[str, str], dim: int,
+                 embedder: EmbeddingStage, writer: DocumentWriterThread, extract_metrics: StageMetrics):
+    """Stage 1 trên main thread: trích xuất song song rồi đẩy từng tài liệu sang stage embed."""
+    # spawn: không fork tiến trình đã khởi tạo CUDA
+    max_in_flight = args.extract_workers * 2
+    with ProcessPoolExecutor(max_workers=args.extract_workers, mp_context=mp.get_context("spawn")) as pool:
+        pending_files = iter(files)
+        in_flight = set()
+        while True:
+            # Giới hạn số file đã trích xuất nhưng chưa embed để bộ nhớ không tăng theo số file
+            for file in pending_files:
+                in_flight.add(pool.submit(extract_and_chunk, str(file), CHUNK_SIZE, CHUNK_OVERLAP))
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                try:
+                    file_path, chunks, seconds = future.result()
+                except Exception as e:
+                    log_error(f"❌ Lỗi trích xuất: {e}")
+                    continue
+                extract_metrics.record(1, seconds)
+                file = Path(file_path)
+                if not chunks:
+                    log_warn(f"⚠️ File {file.name} rỗng hoặc không đọc được.")
+                    continue
+                log_info(f"✂️ {file.name}: {len(chunks)} chunks.")
+
+                header = {
+                    "document_id": file.stem,
+                    "title": file.name,
+                    "source": str(file),
+                    "version": "1.0",
+                    "language": "vi",
+                    "last_updated": datetime.now().isoformat(),
+                    "model_name": MODEL_NAME,
+                    "embedding_dim": dim,
+                    "file_hash": file_hashes[file.stem]
+                }
+                writer.open_document(header, len(chunks))
+                # Chỉ encode lại chunk có text_hash mới; vector của chunk không đổi lấy từ bản trước
+                embedder.add(file.stem, [
+                    {"chunk_id": f"{file.stem}-{idx:03d}", "document_id": file.stem,
+                     "text": chunk_text_val, "text_hash": content_hash(chunk_text_val)}
+                    for idx, chunk_text_val in enumerate(chunks)
+                ], previous_embeddings(previous_output(args.output_dir, file.stem)))
+
+
 # ==== MAIN ====
 def main():
+    args = parse_args()
+
     log_info("🚀 Khởi tạo mô hình embedding...")
     device = "cuda" if USE_GPU else "cpu"
     model = SentenceTransformer(MODEL_NAME, device=device)
     dim = model.get_sentence_embedding_dimension()
     log_success(f"✅ Model: {MODEL_NAME} | Dimension: {dim}")
 
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    files = list(Path(RAW_DIR).glob("*.*"))
+    os.makedirs(args.output_dir, exist_ok=True)
+    files = list(Path(args.raw_dir).glob("*.*"))
 
     if not files:
         log_warn("⚠️ Không tìm thấy file nào trong thư mục raw_documents.")
         return
 
+    # Bỏ qua file không đổi: file_hash trùng với header của bản ingest trước
+    file_hashes = {}
+    changed_files = []
     for file in files:
-        log_info(f"📂 Xử lý file: {file.name}")
-        text = read_file(file)
-        if not text.strip():
-            log_warn(f"⚠️ File {file.name} rỗng hoặc không đọc được.")
+        file_hashes[file.stem] = file_hash(file)
+        reader = previous_output(args.output_dir, file.stem)
+        if not args.force and reader is not None and reader.header.get("file_hash") == file_hashes[file.stem]:
             continue
+        changed_files.append(file)
+    skipped_files = len(files) - len(changed_files)
+    if skipped_files:
+        log_info(f"⏭️ Bỏ qua {skipped_files} file không thay đổi.")
+    files = changed_files
 
-        # Tiền xử lý tiếng Việt
-        processed_text = preprocess_vietnamese(text)
-        chunks = chunk_text(processed_text, CHUNK_SIZE, CHUNK_OVERLAP)
-
-        log_info(f"✂️ Chia thành {len(chunks)} chunks.")
-
-        embeddings = model.encode(chunks, normalize_embeddings=True, show_progress_bar=True)
-
-        # Tạo output JSON
-        output_data = {
-            "document_id": file.stem,
-            "title": file.name,
-            "source": str(file),
-            "version": "1.0",
-            "language": "vi",
-            "last_updated": datetime.now().isoformat(),
-            "model_name": MODEL_NAME,
-            "embedding_dim": dim,
-            "chunks": []
-        }
-
-        for idx, (chunk_text_val, emb) in enumerate(zip(chunks, embeddings)):
-            output_data["chunks"].append({
-                "chunk_id": f"{file.stem}-{idx:03d}",
-                "document_id": file.stem,
-                "text": chunk_text_val,
-                "embedding": emb.tolist()
-            })
-
-        output_path = Path(OUTPUT_DIR) / f"{file.stem}.json"
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(output_data, f, ensure_ascii=False, indent=2)
-
-        log_success(f"💾 Đã lưu {output_path.name}")
+    extract_metrics = StageMetrics("extract", "files")
+    embed_metrics = StageMetrics("embed", "chunks")
+    write_metrics = StageMetrics("write", "chunks")
+    writer = DocumentWriterThread(args.output_dir, args.write_queue_size, write_metrics)
+    embedding_cache = PersistentEmbeddingCache(
+        args.embedding_cache, model_name=MODEL_NAME, max_bytes=EMBEDDING_CACHE_MAX_BYTES
+    ) if args.embedding_cache else None
+    embedder = EmbeddingStage(model, args.embed_batch_size, writer, embed_metrics, embedding_cache,
+                              queue_size=args.embed_queue_size)
+    writer.start()
+    embedder.start()
+    pipeline_start = time.perf_counter()
+    try:
+        run_pipeline(args, files, file_hashes, dim, embedder, writer, extract_metrics)
+        embedder.close()
+    except BaseException:
+        # Dừng embed trước writer; writer.close() bỏ file .tmp của các tài liệu chưa ghi xong
+        embedder.abort()
+        log_error("❌ Pipeline bị dừng, xóa output dở dang.")
+        raise
+    finally:
+        writer.close()
+    wall_seconds = time.perf_counter() - pipeline_start
 
+    log_info(f"\n📊 Pipeline: {len(writer.completed)} tài liệu, {len(writer.failed)} lỗi, "
+             f"{skipped_files} bỏ qua, {embedder.reused} chunk dùng lại vector, {wall_seconds:.2f}s "
+             f"({args.extract_workers} extract workers, batch {args.embed_batch_size})")
+    for metrics in (extract_metrics, embed_metrics, write_metrics):
+        log_info("  " + metrics.report(wall_seconds))
+    if embedding_cache is not None:
+        cache_stats = embedding_cache.stats()
+        log_info(f"  cache    {cache_stats['hits']} hit / {cache_stats['misses']} miss "
+                 f"(hit rate {cache_stats['hit_rate']:.1%}), {cache_stats['entries']} vectors, "
+                 f"{(cache_stats['bytes'] or 0) / 1024 / 1024:.1f} MB")
     log_success("🎯 Hoàn tất ingestion.")
 
 if __name__ == "__main__":
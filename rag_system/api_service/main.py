@@ -1,9 +1,16 @@
 # D:\Projects\undertest\docsearch\rag_system\api_service\main.py
 import os
 import sys
-from fastapi import FastAPI, HTTPException, Depends, status
+import time
+import json
+import asyncio
+import secrets
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Literal, Union
+from urllib.parse import quote
 import logging
 from datetime import datetime
 
@@ -14,8 +21,21 @@ from fastapi.middleware.cors import CORSMiddleware
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 # Import the extended_db and other necessary modules
 from rag_system.api_service.utils.database import extended_db
-from rag_system.api_service.models.embeddings import get_embedding_model
+from rag_system.api_service.models.embeddings import (
+    get_embedding_model, QueryEmbeddingBatcher, QueryEmbeddingCache, PersistentEmbeddingCache
+)
 from rag_system.api_service.retrieval.hybrid_retriever import HybridRetriever
+from rag_system.api_service.retrieval.bm25_retriever import BM25Retriever
+from rag_system.api_service.retrieval.metadata_store import ChunkMetadataStore
+from rag_system.api_service.utils.executor import SearchExecutor, SearchOverloadedError, format_server_timing
+from rag_system.api_service.utils.result_cache import create_result_cache
+from rag_system.api_service.utils.indexing import FaissIndexMaintainer, IndexFileWatcher
+from rag_system.api_service.utils.index_factory import index_type_of
+from rag_system.api_service.utils.health import HealthMonitor
+from rag_system.api_service.utils.analytics import SearchAnalyticsWriter
+from rag_system.api_service.utils import metrics
+from rag_system.api_service.utils.text_processing import make_snippet
+from rag_system.config import settings
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -38,27 +58,122 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-# Global variables for model and retriever
+# Global variables for model, query batcher, caches, retrievers and search executor
 embedding_model = None
+query_batcher = None
+query_cache = QueryEmbeddingCache(
+    max_size=settings.QUERY_CACHE_MAX_SIZE,
+    ttl_seconds=settings.QUERY_CACHE_TTL_SECONDS
+)
+embedding_cache = PersistentEmbeddingCache(
+    db_path=settings.EMBEDDING_CACHE_PATH,
+    model_name=settings.EMBEDDING_MODEL,
+    max_bytes=settings.EMBEDDING_CACHE_MAX_BYTES
+) if settings.EMBEDDING_CACHE_ENABLED else None
+result_cache = create_result_cache(
+    settings.RESULT_CACHE_BACKEND,
+    max_bytes=settings.RESULT_CACHE_MAX_BYTES,
+    db_path=settings.RESULT_CACHE_PATH
+)
+bm25_retriever = None
 hybrid_retriever = None
+index_maintainer = None
+index_watcher = None
+search_executor = None
+health_monitor = None
+analytics_writer = None
+# Per-stage latency histograms and request counters served on /metrics
+search_metrics = metrics.MetricsRegistry()
+# True between a completed startup and the beginning of shutdown (/readyz)
+ready = False
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize resources on startup."""
     logger.info("Starting up RAG System API...")
     try:
-        global embedding_model, hybrid_retriever
-        
-        db_health = extended_db.health_check()
-        if db_health.get('status') != 'healthy':
-            logger.warning(f"Database health check warnings: {db_health.get('warnings')}")
-        logger.info(f"Database health: {db_health.get('status')}")
+        global embedding_model, query_batcher, bm25_retriever, hybrid_retriever, index_maintainer, index_watcher, search_executor
+        global health_monitor, analytics_writer, ready
+
+        # Database diagnostics and SQLite cache stats run in the background; /health serves the snapshot
+        collectors = {}
+        if embedding_cache:
+            collectors['persistent_embedding_cache'] = embedding_cache.stats
+        if result_cache and settings.RESULT_CACHE_BACKEND == "sqlite":
+            collectors['result_cache'] = result_cache.stats
+        health_monitor = HealthMonitor(extended_db, settings.HEALTH_CHECK_INTERVAL_SECONDS, collectors)
 
         embedding_model = get_embedding_model()
         logger.info("Embedding model loaded successfully.")
 
-        hybrid_retriever = HybridRetriever(embedding_model=embedding_model, db_manager=extended_db)
+        query_batcher = QueryEmbeddingBatcher(
+            embedding_model,
+            max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+            max_wait_ms=settings.EMBEDDING_BATCH_MAX_WAIT_MS
+        )
+
+        bm25_retriever = BM25Retriever.load_or_build(
+            extended_db, settings.BM25_INDEX_PATH,
+            persist_interval_seconds=settings.BM25_PERSIST_INTERVAL_SECONDS,
+            sync_interval_seconds=settings.BM25_SYNC_INTERVAL_SECONDS
+        )
+        extended_db.add_change_listener(bm25_retriever.handle_database_change)
+        logger.info("BM25 Retriever initialized.")
+
+        if settings.SEARCH_ANALYTICS_ENABLED:
+            analytics_writer = SearchAnalyticsWriter(
+                extended_db,
+                max_batch_size=settings.SEARCH_ANALYTICS_BATCH_SIZE,
+                flush_interval_ms=settings.SEARCH_ANALYTICS_FLUSH_INTERVAL_MS,
+                max_queue_size=settings.SEARCH_ANALYTICS_QUEUE_SIZE
+            )
+
+        hybrid_retriever = HybridRetriever(
+            embedding_model=embedding_model,
+            db_manager=extended_db,
+            query_encoder=query_batcher,
+            query_cache=query_cache,
+            embedding_cache=embedding_cache,
+            result_cache=result_cache,
+            bm25_retriever=bm25_retriever,
+            metadata_store=ChunkMetadataStore(
+                extended_db, refresh_interval_seconds=settings.METADATA_STORE_REFRESH_INTERVAL_SECONDS
+            ),
+            mmap_index=settings.FAISS_MMAP,
+            index_type=settings.INDEX_TYPE,
+            index_options={
+                'nlist': settings.INDEX_NLIST,
+                'pq_m': settings.INDEX_PQ_M,
+                'hnsw_m': settings.INDEX_HNSW_M,
+                'ef_construction': settings.INDEX_HNSW_EF_CONSTRUCTION
+            },
+            nprobe=settings.INDEX_NPROBE,
+            ef_search=settings.INDEX_EF_SEARCH,
+            analytics_writer=analytics_writer
+        )
         logger.info("Hybrid Retriever initialized.")
+
+        # Apply chunk inserts/updates/soft deletes to the live FAISS index
+        if settings.FAISS_MMAP:
+            logger.info("FAISS index is memory-mapped (read-only): live maintenance disabled, "
+                        "rebuilt indexes are picked up by hot swap.")
+        else:
+            index_maintainer = FaissIndexMaintainer(
+                hybrid_retriever,
+                extended_db,
+                persist_interval_seconds=settings.FAISS_PERSIST_INTERVAL_SECONDS
+            )
+            extended_db.add_change_listener(index_maintainer.handle_database_change)
+        if settings.FAISS_WATCH_INDEX_FILE:
+            index_watcher = IndexFileWatcher(hybrid_retriever, settings.FAISS_WATCH_INTERVAL_SECONDS)
+
+        search_executor = SearchExecutor(
+            max_workers=settings.SEARCH_MAX_WORKERS,
+            max_queue_depth=settings.SEARCH_MAX_QUEUE_DEPTH
+        )
+        logger.info(f"Search executor started with {settings.SEARCH_MAX_WORKERS} workers.")
+        register_metric_gauges()
+        ready = True
         logger.info("RAG System API startup complete.")
     except Exception as e:
         logger.error(f"Failed to start up RAG System API: {e}", exc_info=True)
@@ -67,14 +182,96 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     """Clean up resources on shutdown."""
+    global ready
     logger.info("Shutting down RAG System API...")
+    ready = False
+    if search_executor:
+        search_executor.shutdown()
+    if analytics_writer:
+        analytics_writer.close()
+    if query_batcher:
+        query_batcher.close()
+    if index_watcher:
+        index_watcher.close()
+    if index_maintainer:
+        index_maintainer.close()
+    if bm25_retriever:
+        bm25_retriever.close()
+    if hybrid_retriever:
+        hybrid_retriever.metadata_store.close()
+    if health_monitor:
+        health_monitor.close()
     extended_db.close_connections()
     logger.info("Database connections closed.")
 
+def register_metric_gauges():
+    """Gauges read from in-memory component state on each /metrics scrape (never from SQLite)."""
+    search_metrics.register_gauge("rag_search_in_flight", "Searches running or queued on the search executor.",
+                                  lambda: search_executor.in_flight)
+    search_metrics.register_gauge("rag_search_queue_depth", "Searches waiting for a search executor worker.",
+                                  lambda: search_executor.queue_depth)
+    search_metrics.register_gauge("rag_faiss_index_vectors", "Vectors in the served FAISS index.",
+                                  lambda: hybrid_retriever.faiss_index.ntotal)
+    search_metrics.register_gauge("rag_query_embedding_cache_hit_rate", "Hit rate of the in-memory query embedding cache.",
+                                  lambda: query_cache.stats()['hit_rate'])
+    if result_cache and settings.RESULT_CACHE_BACKEND == "memory":
+        search_metrics.register_gauge("rag_result_cache_hit_rate", "Hit rate of the in-memory result cache.",
+                                      lambda: result_cache.stats()['hit_rate'])
+    if analytics_writer:
+        search_metrics.register_gauge("rag_search_analytics_queue_depth", "Search analytics rows waiting to be written.",
+                                      lambda: analytics_writer.stats()['queue_depth'])
+        search_metrics.register_gauge("rag_search_analytics_dropped", "Search analytics rows dropped under backpressure.",
+                                      lambda: analytics_writer.stats()['dropped'])
+        search_metrics.register_gauge("rag_search_analytics_written", "Search analytics rows written.",
+                                      lambda: analytics_writer.stats()['written'])
+
+@app.get("/metrics", summary="Prometheus metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Per-stage search latency histograms, request counters and component gauges (Prometheus text format)."""
+    return Response(content=search_metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+@app.get("/livez", summary="Liveness probe")
+async def livez():
+    """Constant-time liveness probe: the process is up and the event loop is serving requests."""
+    return {"status": "alive"}
+
+@app.get("/readyz", summary="Readiness probe")
+async def readyz():
+    """
+    Constant-time readiness probe for the load balancer: startup has completed, the model,
+    retriever, FAISS index and search executor are in place, and the last background
+    database check did not fail. Returns 503 otherwise. Never queries SQLite.
+    """
+    checks = {
+        "startup_complete": ready,
+        "embedding_model": embedding_model is not None,
+        "faiss_index": hybrid_retriever is not None and hybrid_retriever.faiss_index is not None,
+        "search_executor": search_executor is not None,
+        "database": health_monitor is not None and health_monitor.snapshot()['database'].get('status') != 'error',
+    }
+    is_ready = all(checks.values())
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if is_ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "ready" if is_ready else "not_ready", "checks": checks}
+    )
+
+def live_cache_stats(cache, sampled: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """A cache's stats: sizes from the background snapshot (SQLite caches), live counters on top"""
+    if cache is None:
+        return None
+    if not hasattr(cache, 'counters'):
+        return cache.stats()  # in-memory cache: everything is cheap
+    return {**(sampled or {}), **cache.counters()}
+
 @app.get("/health", summary="Health Check", response_model=Dict[str, Any])
 async def health_check():
-    """Performs a health check on the API and its dependencies."""
-    db_status = extended_db.health_check()
+    """
+    Reports the API and its dependencies. Database diagnostics and the SQLite cache sizes
+    (row counts) come from the latest background HealthMonitor snapshot (see 'checked_at');
+    cache hit/miss counters are in-memory and always current.
+    """
+    snapshot = health_monitor.snapshot() if health_monitor else {'database': {'status': 'pending'}, 'checked_at': None}
+    db_status = snapshot['database']
     model_status = "initialized" if embedding_model else "not_loaded"
     retriever_status = "initialized" if hybrid_retriever else "not_loaded"
     
@@ -87,6 +284,12 @@ async def health_check():
         "database": db_status,
         "embedding_model": model_status,
         "hybrid_retriever": retriever_status,
+        "query_embedding_cache": query_cache.stats(),
+        "persistent_embedding_cache": live_cache_stats(embedding_cache, snapshot.get('persistent_embedding_cache')),
+        "result_cache": live_cache_stats(result_cache, snapshot.get('result_cache')),
+        "faiss_index": index_maintainer.stats() if index_maintainer else None,
+        "search_analytics": analytics_writer.stats() if analytics_writer else None,
+        "checked_at": snapshot['checked_at'],
         "timestamp": datetime.now().isoformat()
     }
 
@@ -101,37 +304,318 @@ class SearchRequest(BaseModel):
     user_roles: Optional[List[str]] = Field(None, example=["admin", "user"])
     document_ids: Optional[List[str]] = Field(None, example=["lythaito", "bienbanbangiao"])
     categories: Optional[List[str]] = Field(None, example=["Lịch sử", "Pháp lý"])
+    fusion: Literal["dense", "rrf", "weighted"] = Field("dense", example="rrf")
+    dense_weight: float = Field(0.5, ge=0.0, le=1.0, example=0.5)
+    # Recall/latency knobs for approximate indexes (IVF nprobe, HNSW efSearch); None = server default
+    nprobe: Optional[int] = Field(None, ge=1, le=4096, example=32)
+    ef_search: Optional[int] = Field(None, ge=1, le=4096, example=128)
+    # Stored with the search_analytics row
+    user_id: Optional[str] = Field(None, example="u-42")
+    session_id: Optional[str] = Field(None, example="s-2024-0001")
+    # Wrap the results as {"results": [...], "debug": {...}} with per-stage timings
+    debug: bool = Field(False, example=False)
+    # Stream one hit per NDJSON line / SSE event instead of returning one JSON list
+    stream: Optional[Literal["ndjson", "sse"]] = Field(None, example="ndjson")
+    # Return at most this many characters of each text; the full text is at GET /chunks/{chunk_id}
+    snippet_chars: Optional[int] = Field(None, ge=20, le=10000, example=300)
+
+def apply_snippet(result: Dict[str, Any], snippet_chars: Optional[int]) -> Dict[str, Any]:
+    """A copy of a search result whose text is cut to snippet_chars, pointing to the full text"""
+    text = result.get('text') or ""
+    if not snippet_chars or len(text) <= snippet_chars:
+        return result
+    return dict(result, text=make_snippet(text, snippet_chars), text_truncated=True,
+                text_length=len(text), full_text_url=f"/chunks/{quote(result['chunk_id'], safe='')}")
+
+def search_debug_info(timings: Dict[str, float]) -> Dict[str, Any]:
+    return {
+        "timings_ms": {stage: round(ms, 3) for stage, ms in timings.items()},
+        "index_type": index_type_of(hybrid_retriever.faiss_index),
+        "index_vectors": hybrid_retriever.faiss_index.ntotal
+    }
 
-@app.post("/search", summary="Search for relevant chunks", response_model=List[Dict[str, Any]])
+@app.post("/search", summary="Search for relevant chunks",
+          response_model=Union[List[Dict[str, Any]], Dict[str, Any]])
 async def search_chunks(request: SearchRequest):
     """
     Searches the knowledge base for relevant chunks based on the query and filters.
+    fusion="rrf" or "weighted" merges the FAISS results with BM25 keyword results.
+    Encoding, FAISS/BM25 search and hydration run on the search executor so the event loop
+    is never blocked; per-stage durations (including serialization) are returned in the
+    Server-Timing header, aggregated into the /metrics histograms, and with debug=true
+    also returned in the body.
+    With snippet_chars, long texts are cut to snippets and the full text is fetched lazily
+    from GET /chunks/{chunk_id}. With stream="ndjson" or "sse", every ranked hit is sent as
+    its own line/event as soon as it is serialized, followed by a final
+    {"done": true, "count": n} line/event.
     """
-    if not hybrid_retriever:
+    if not hybrid_retriever or not search_executor:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Hybrid Retriever is not initialized yet."
         )
     
+    timings = {}
+    request_start = time.perf_counter()
     try:
         # FIX: Sửa tên tham số cho khớp với định nghĩa hàm retrieve
         # query -> query_text
         # top_k -> desired_k
-        results = hybrid_retriever.retrieve(
+        results = await search_executor.run(
+            hybrid_retriever.retrieve,
             query_text=request.query,
             desired_k=request.top_k,
             user_roles=request.user_roles,
             document_ids=request.document_ids,
-            categories=request.categories
+            categories=request.categories,
+            fusion=request.fusion,
+            dense_weight=request.dense_weight,
+            nprobe=request.nprobe,
+            ef_search=request.ef_search,
+            timings=timings,
+            user_id=request.user_id,
+            session_id=request.session_id
+        )
+    except SearchOverloadedError as e:
+        logger.warning(f"Search rejected: {e}")
+        search_metrics.requests.inc("overloaded")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Search service is overloaded. Please retry later.",
+            headers={"Retry-After": str(settings.SEARCH_RETRY_AFTER_SECONDS)}
         )
-        return results
+    except ValueError as e:
+        search_metrics.requests.inc("bad_request")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         logger.error(f"Search failed: {e}", exc_info=True)
+        search_metrics.requests.inc("error")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An error occurred during search: {str(e)}"
         )
 
+    if request.stream:
+        return StreamingResponse(
+            stream_search_results(request, results, timings, request_start),
+            media_type="text/event-stream" if request.stream == "sse" else "application/x-ndjson",
+            headers={"Server-Timing": format_server_timing(timings), "Cache-Control": "no-cache",
+                     "X-Accel-Buffering": "no"}
+        )
+
+    # Serialization is timed here instead of being left to FastAPI after the handler returns
+    stage_start = time.perf_counter()
+    content = jsonable_encoder([apply_snippet(result, request.snippet_chars) for result in results])
+    timings['serialize'] = (time.perf_counter() - stage_start) * 1000
+    timings['total'] = (time.perf_counter() - request_start) * 1000
+    if request.debug:
+        content = {"results": content, "debug": search_debug_info(timings)}
+    search_metrics.observe_timings(timings)
+    search_metrics.requests.inc("ok")
+    search_metrics.results.inc("search", len(results))
+    return JSONResponse(content=content, headers={"Server-Timing": format_server_timing(timings)})
+
+async def stream_search_results(request: SearchRequest, results: List[Dict[str, Any]],
+                                timings: Dict[str, float], request_start: float):
+    """Yields each hit as an NDJSON line or SSE "hit" event, then a "done" line/event"""
+    def frame(event: str, payload: Dict[str, Any]) -> str:
+        data = json.dumps(jsonable_encoder(payload), ensure_ascii=False)
+        return f"event: {event}\ndata: {data}\n\n" if request.stream == "sse" else data + "\n"
+
+    timings['serialize'] = 0.0
+    for result in results:
+        stage_start = time.perf_counter()
+        chunk = frame("hit", apply_snippet(result, request.snippet_chars))
+        timings['serialize'] += (time.perf_counter() - stage_start) * 1000
+        yield chunk
+    timings['total'] = (time.perf_counter() - request_start) * 1000
+    done = {"done": True, "count": len(results)}
+    if request.debug:
+        done["debug"] = search_debug_info(timings)
+    yield frame("done", done)
+    search_metrics.observe_timings(timings)
+    search_metrics.requests.inc("ok")
+    search_metrics.results.inc("search", len(results))
+
+# :path so that chunk ids containing "/" (sent percent-encoded by full_text_url) still match
+@app.get("/chunks/{chunk_id:path}", summary="Get the full text of a chunk", response_model=Dict[str, Any])
+async def get_chunk(chunk_id: str, user_roles: Optional[List[str]] = Query(None)):
+    """
+    Returns an active chunk (chunk_id, document_id, title, full text, metadata) from the
+    resident metadata store, e.g. to expand a snippet returned by /search. With user_roles,
+    chunks those roles cannot see are reported as not found.
+    """
+    if not hybrid_retriever or not search_executor:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Hybrid Retriever is not initialized yet."
+        )
+    try:
+        # Bounded like the search calls, so a burst of fetches cannot starve /search
+        chunk = await search_executor.run(hybrid_retriever.metadata_store.get_chunk, chunk_id, user_roles)
+    except SearchOverloadedError as e:
+        logger.warning(f"Chunk fetch rejected: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Search service is overloaded. Please retry later.",
+            headers={"Retry-After": str(settings.SEARCH_RETRY_AFTER_SECONDS)}
+        )
+    if chunk is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Chunk '{chunk_id}' not found.")
+    return chunk
+
+def batch_query(request: SearchRequest) -> Dict[str, Any]:
+    """retrieve() keyword arguments of one /search/batch query"""
+    return dict(
+        query_text=request.query,
+        desired_k=request.top_k,
+        user_roles=request.user_roles,
+        document_ids=request.document_ids,
+        categories=request.categories,
+        fusion=request.fusion,
+        dense_weight=request.dense_weight,
+        nprobe=request.nprobe,
+        ef_search=request.ef_search,
+        user_id=request.user_id,
+        session_id=request.session_id
+    )
+
+@app.post("/search/batch", summary="Search for several queries at once")
+async def search_chunks_batch(requests: List[SearchRequest]):
+    """
+    Runs a list of searches as one batch: the queries are encoded together, each set of
+    queries with the same filters is answered by one multi-row FAISS search, and all
+    candidates are hydrated together. Results are streamed as NDJSON, one line
+    {"index", "query", "results"} per query as soon as it is ready (result-cache hits
+    first), so lines may arrive out of request order. A failure after streaming has
+    started is reported as a final {"error": ...} line.
+    """
+    if not hybrid_retriever or not search_executor:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Hybrid Retriever is not initialized yet."
+        )
+    if not requests:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="At least one query is required.")
+    if len(requests) > settings.SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.SEARCH_BATCH_MAX_QUERIES} queries are accepted per batch."
+        )
+
+    timings = {}
+    request_start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    results_queue = asyncio.Queue()
+
+    def on_result(position: int, results: List[Dict[str, Any]]):
+        loop.call_soon_threadsafe(results_queue.put_nowait, (position, results))
+
+    batch = asyncio.ensure_future(search_executor.run(
+        hybrid_retriever.retrieve_batch, [batch_query(request) for request in requests],
+        on_result=on_result, timings=timings
+    ))
+    # Results are queued before the batch finishes, so None always comes last
+    batch.add_done_callback(lambda _: results_queue.put_nowait(None))
+
+    # Wait for the first result so that rejections still get a proper status code
+    first = await results_queue.get()
+    if first is None:
+        try:
+            batch.result()
+        except SearchOverloadedError as e:
+            logger.warning(f"Batch search rejected: {e}")
+            search_metrics.requests.inc("overloaded")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Search service is overloaded. Please retry later.",
+                headers={"Retry-After": str(settings.SEARCH_RETRY_AFTER_SECONDS)}
+            )
+        except ValueError as e:
+            search_metrics.requests.inc("bad_request")
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        except Exception as e:
+            logger.error(f"Batch search failed: {e}", exc_info=True)
+            search_metrics.requests.inc("error")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"An error occurred during batch search: {str(e)}"
+            )
+
+    async def stream_results():
+        item = first
+        while item is not None:
+            position, results = item
+            results = [apply_snippet(result, requests[position].snippet_chars) for result in results]
+            line = {"index": position, "query": requests[position].query, "results": results}
+            yield json.dumps(jsonable_encoder(line), ensure_ascii=False) + "\n"
+            search_metrics.results.inc("batch", len(results))
+            item = await results_queue.get()
+        if batch.exception() is not None:
+            logger.error(f"Batch search failed while streaming: {batch.exception()}")
+            search_metrics.requests.inc("error")
+            yield json.dumps({"error": f"An error occurred during batch search: {batch.exception()}"}) + "\n"
+            return
+        timings['total'] = (time.perf_counter() - request_start) * 1000
+        # Batch stages cover every query of the batch, so they get their own histogram series
+        search_metrics.observe_timings({f"batch_{stage}": ms for stage, ms in timings.items()})
+        search_metrics.requests.inc("ok")
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+def require_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """Admin endpoints are disabled unless ADMIN_API_TOKEN is set, and then require it in X-Admin-Token"""
+    if not settings.ADMIN_API_TOKEN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin endpoints are disabled.")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, settings.ADMIN_API_TOKEN):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid admin token.")
+
+def resolve_index_path(index_path: Optional[str]) -> str:
+    """The requested index file, which must lie in the directory of the index being served"""
+    current = os.path.realpath(hybrid_retriever.faiss_index_path)
+    if not index_path:
+        return current
+    index_dir = os.path.dirname(current)
+    resolved = os.path.realpath(os.path.join(index_dir, index_path))
+    if os.path.dirname(resolved) != index_dir:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="index_path must name a file in the configured index directory."
+        )
+    return resolved
+
+class IndexReloadRequest(BaseModel):
+    # File name relative to the directory of the index being served
+    index_path: Optional[str] = Field(None, example="index.faiss")
+
+@app.post("/admin/index/reload", summary="Hot-swap the FAISS index", response_model=Dict[str, Any],
+          dependencies=[Depends(require_admin_token)])
+async def reload_index(request: IndexReloadRequest):
+    """
+    Loads a newly built FAISS index in the background, validates it against SQLite and
+    swaps it in atomically; in-flight searches finish on the previous index.
+    Defaults to re-reading the configured index file; index_path may name another
+    file in the same directory.
+    """
+    if not hybrid_retriever:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Hybrid Retriever is not initialized yet."
+        )
+
+    index_path = resolve_index_path(request.index_path)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(None, hybrid_retriever.update_faiss_index, index_path)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except Exception as e:
+        logger.error(f"Index reload failed: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred during index reload; see the server log."
+        )
+
 # Bạn có thể bỏ comment các endpoint khác khi cần dùng đến
 # @app.post("/chunks/soft-delete", ...)
 # ...
\ No newline at end of file
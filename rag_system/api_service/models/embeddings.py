@@ -1,6 +1,21 @@
 import torch
 from sentence_transformers import SentenceTransformer
+import hashlib
 import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Dict, List, Optional, Any
+
+import numpy as np
+
+from rag_system.api_service.utils.database import encode_embedding, decode_embedding
+from rag_system.api_service.utils.sqlite_cache import AccessTimeBuffer, evict_if_over, init_size_tracking, total_bytes
+from rag_system.api_service.utils.text_processing import clean_text
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +41,255 @@ def get_embedding_model(model_name: str = "AITeamVN/Vietnamese_Embedding", devic
             raise
     return _embedding_model
 
+class QueryEmbeddingBatcher:
+    """
+    Dynamic micro-batching for query embeddings.
+    Concurrent encode() calls are collected for up to max_wait_ms or
+    max_batch_size items and encoded with a single padded model.encode call;
+    each caller receives its own vector.
+    """
+
+    def __init__(self, model, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="query-embedding-batcher", daemon=True)
+        self._worker.start()
+        logger.info(f"Query embedding batcher started (max_batch_size={max_batch_size}, max_wait_ms={max_wait_ms}).")
+
+    def encode(self, text: str) -> np.ndarray:
+        """Encode a single query, blocking until its batch has been processed"""
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _collect_batch(self, first_item):
+        batch = [first_item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Shutdown sentinel: process what we have, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            batch = self._collect_batch(item)
+            texts = [text for text, _ in batch]
+            try:
+                vectors = self.model.encode(texts, batch_size=len(texts), show_progress_bar=False)
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            except Exception as e:
+                logger.error(f"Batched query encoding failed for {len(texts)} queries: {e}", exc_info=True)
+                for _, future in batch:
+                    future.set_exception(e)
+
+    def close(self):
+        """Stop the worker thread after pending queries are encoded"""
+        self._queue.put(None)
+        self._worker.join()
+        logger.info("Query embedding batcher stopped.")
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU cache of query embeddings with TTL-based expiry.
+    Keys are hashes of the cleaned query (see utils.text_processing.query_hash).
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 3600.0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                vector, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return vector
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._entries[key] = (vector, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+class PersistentEmbeddingCache:
+    """
+    Disk-backed embedding cache in a local SQLite file, shared by ingestion runs,
+    API workers and restarts. Keys are sha256(model name + normalized text), values
+    are L2-normalized float32 vectors. Least recently used entries are evicted once
+    the stored vectors exceed max_bytes (see utils.sqlite_cache).
+    """
+
+    def __init__(self, db_path: str = "rag_system/data/embedding_cache.db", model_name: str = "",
+                 max_bytes: int = 512 * 1024 * 1024):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._access = AccessTimeBuffer("embedding_cache")
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    model_name TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_access ON embedding_cache(last_access)")
+        init_size_tracking(self._connection(), "embedding_cache")
+
+    def _connection(self) -> sqlite3.Connection:
+        if not hasattr(self._local, 'connection'):
+            self._local.connection = sqlite3.connect(str(self.db_path), timeout=30.0, check_same_thread=False)
+            self._local.connection.execute("PRAGMA journal_mode = WAL")
+            self._local.connection.execute("PRAGMA synchronous = NORMAL")
+        return self._local.connection
+
+    def key(self, text: str) -> str:
+        normalized = clean_text(text)
+        return hashlib.sha256(f"{self.model_name}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Cached vectors for texts, None where missing"""
+        keys = [self.key(text) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+        try:
+            conn = self._connection()
+            # SQLite limits bound parameters per statement; look up in slices
+            for start in range(0, len(keys), 500):
+                part = list(set(keys[start:start + 500]))
+                placeholders = ",".join("?" * len(part))
+                rows = conn.execute(
+                    f"SELECT cache_key, embedding FROM embedding_cache WHERE cache_key IN ({placeholders})", part
+                ).fetchall()
+                found.update((cache_key, decode_embedding(blob)) for cache_key, blob in rows)
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache read failed: {e}")
+
+        # Access times are buffered; lookups do not take the write lock
+        if found and self._access.touch(found):
+            try:
+                with self._connection() as conn:
+                    self._access.flush(conn)
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding cache access time update failed: {e}")
+
+        vectors = [found.get(cache_key) for cache_key in keys]
+        with self._lock:
+            hits = sum(1 for vector in vectors if vector is not None)
+            self.hits += hits
+            self.misses += len(vectors) - hits
+        return vectors
+
+    def put_many(self, texts: List[str], vectors: List[np.ndarray]):
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            blob = encode_embedding(vector)
+            rows.append((self.key(text), self.model_name, blob, len(blob), now))
+        try:
+            with self._connection() as conn:
+                self._access.flush(conn)
+                # An upsert (not INSERT OR REPLACE) so the size triggers see replaced rows
+                conn.executemany("""
+                    INSERT INTO embedding_cache (cache_key, model_name, embedding, size, last_access)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(cache_key) DO UPDATE SET
+                        model_name = excluded.model_name, embedding = excluded.embedding,
+                        size = excluded.size, last_access = excluded.last_access
+                """, rows)
+                evicted = evict_if_over(conn, "embedding_cache", self.max_bytes)
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+            return
+        if evicted:
+            with self._lock:
+                self.evictions += evicted
+
+    def encode(self, model, texts: List[str], **encode_kwargs) -> np.ndarray:
+        """
+        Normalized embeddings for texts: cached vectors are reused and only the
+        misses go through model.encode (in one call), then get cached.
+        """
+        vectors = self.get_many(texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            encoded = model.encode([texts[i] for i in missing], normalize_embeddings=True, **encode_kwargs)
+            encoded = np.asarray(encoded, dtype=np.float32)
+            self.put_many([texts[i] for i in missing], list(encoded))
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+        return np.vstack(vectors).astype(np.float32) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+    def counters(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters of this process (in memory, no SQLite read)"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            conn = self._connection()
+            entries = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+            total = total_bytes(conn, "embedding_cache")
+        except sqlite3.Error:
+            entries, total = None, None
+        return {'entries': entries, 'bytes': total, 'max_bytes': self.max_bytes, **self.counters()}
+
 if __name__ == "__main__":
     # Example usage and test
     model = get_embedding_model()
@@ -0,0 +1,492 @@
+"""
+BM25 sparse retriever over chunks.text.
+
+The inverted index is stored as compact numpy arrays in a version directory
+under index_path and memory-mapped at startup. index_path/CURRENT names the
+current version; save() writes a new version and switches CURRENT to it, so
+readers (and other API workers) never see a half-written index. Old versions
+are removed once no snapshot of this process maps them any more. A version holds:
+  vocab.json             term -> term id
+  postings_offsets.npy   int64[n_terms + 1], postings of term t are [offsets[t], offsets[t+1])
+  postings_docs.npy      int32 document positions
+  postings_tf.npy        uint16 term frequencies
+  doc_ids.npy            int64 chunk id (FAISS id) of each document position
+  doc_lengths.npy        int32 token count of each document
+  meta.json              k1, b and the data generation the index was built from
+Chunks added after the build live in an in-memory delta segment, soft deletes
+in a per-position deletion sequence; save() merges both into a fresh on-disk
+index, periodically from a background thread and on close().
+Writers publish an immutable _IndexSnapshot under the lock; searches score
+against the snapshot they picked up without taking the lock.
+Writes made by other processes only show up as a newer data generation in
+system_state; the background thread polls it and rebuilds the index from the
+chunks table, so searches never read SQLite.
+"""
+
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+import time
+import weakref
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+
+from rag_system.api_service.utils.database import ExtendedDatabaseManager
+from rag_system.api_service.utils.text_processing import tokenize_for_search
+
+logger = logging.getLogger(__name__)
+
+# deleted_at value of a live document
+NOT_DELETED = np.iinfo(np.int64).max
+
+# index_path/CURRENT holds the name of the current version directory
+CURRENT_FILE = "CURRENT"
+VERSION_PREFIX = "v"
+INDEX_FILES = ('vocab.json', 'meta.json', 'postings_offsets.npy', 'postings_docs.npy',
+               'postings_tf.npy', 'doc_ids.npy', 'doc_lengths.npy')
+
+
+def _grow(array: np.ndarray, capacity: int, fill) -> np.ndarray:
+    grown = np.full(capacity, fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class _IndexSnapshot:
+    """
+    The index as of one write sequence number. The arrays it references are only
+    appended to past size, and deleted_at entries are only set to sequence numbers
+    above this one, so later writes never change what a snapshot sees.
+    """
+
+    __slots__ = ('version', 'vocab', 'postings_offsets', 'postings_docs', 'postings_tf', 'delta_postings',
+                 'doc_ids', 'doc_lengths', 'deleted_at', 'size', 'sequence', 'num_docs', 'avg_doc_length',
+                 '__weakref__')
+
+    def __init__(self, retriever: "BM25Retriever"):
+        # On-disk version the base segment is mapped from (None when built in memory)
+        self.version = retriever._version
+        self.vocab = retriever.vocab
+        self.postings_offsets = retriever.postings_offsets
+        self.postings_docs = retriever.postings_docs
+        self.postings_tf = retriever.postings_tf
+        self.delta_postings = retriever._delta_postings
+        self.doc_ids = retriever._doc_ids
+        self.doc_lengths = retriever._doc_lengths
+        self.deleted_at = retriever._deleted_at
+        self.size = retriever._size
+        self.sequence = retriever._sequence
+        self.num_docs = retriever._live_docs
+        self.avg_doc_length = retriever._total_length / retriever._live_docs if retriever._live_docs else 0.0
+
+    def term_postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        docs, tfs = [], []
+        term_id = self.vocab.get(term)
+        if term_id is not None:
+            start, end = self.postings_offsets[term_id], self.postings_offsets[term_id + 1]
+            docs.append(np.asarray(self.postings_docs[start:end], dtype=np.int64))
+            tfs.append(np.asarray(self.postings_tf[start:end], dtype=np.float32))
+        delta = self.delta_postings.get(term)
+        if delta:
+            delta_array = np.asarray(delta, dtype=np.int64)
+            # Postings appended by writes after this snapshot point past size
+            delta_array = delta_array[delta_array[:, 0] < self.size]
+            docs.append(delta_array[:, 0])
+            tfs.append(delta_array[:, 1].astype(np.float32))
+        if not docs:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return np.concatenate(docs), np.concatenate(tfs)
+
+    def live(self, positions: np.ndarray) -> np.ndarray:
+        return self.deleted_at[positions] > self.sequence
+
+
+class BM25Retriever:
+    """BM25 (Okapi) retriever backed by a persistent, memory-mapped inverted index"""
+
+    def __init__(self, index_path: str = "rag_system/data/indexes/bm25", k1: float = 1.5, b: float = 0.75,
+                 db_manager: Optional[ExtendedDatabaseManager] = None,
+                 persist_interval_seconds: Optional[float] = None,
+                 sync_interval_seconds: Optional[float] = None):
+        self.index_path = Path(index_path)
+        self.k1 = k1
+        self.b = b
+        # Source of the shared data generation; without it the index only follows change events
+        self.db_manager = db_manager
+        # Guards the writer state; searches only read self._snapshot
+        self._lock = threading.RLock()
+        self.data_generation = None
+        # Incremented by every write; deletions are stamped with it
+        self._sequence = 0
+        # Writes applied since the index was last loaded from or saved to disk
+        self.pending_changes = 0
+        # Published snapshots still referenced (by the retriever or in-flight searches)
+        self._snapshots = weakref.WeakSet()
+        self._reset()
+        # Background thread: polls the data generation every sync_interval_seconds and
+        # persists pending changes every persist_interval_seconds
+        self.persist_interval_seconds = persist_interval_seconds
+        self.sync_interval_seconds = sync_interval_seconds
+        self._stop = threading.Event()
+        self._worker = None
+        if persist_interval_seconds or sync_interval_seconds:
+            self._worker = threading.Thread(target=self._run, name="bm25-index-maintenance", daemon=True)
+            self._worker.start()
+
+    def _reset(self):
+        # Base segment (memory-mapped from the version directory once loaded)
+        self._version: Optional[str] = None
+        self.vocab: Dict[str, int] = {}
+        self.postings_offsets = np.zeros(1, dtype=np.int64)
+        self.postings_docs = np.zeros(0, dtype=np.int32)
+        self.postings_tf = np.zeros(0, dtype=np.uint16)
+        # Delta segment: postings of documents added since the base segment was written
+        self._delta_postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        # Per document position (base, then delta); over-allocated so appends rarely copy
+        self._doc_ids = np.zeros(0, dtype=np.int64)
+        self._doc_lengths = np.zeros(0, dtype=np.float32)
+        self._deleted_at = np.zeros(0, dtype=np.int64)
+        self._size = 0
+        self._position_by_id: Dict[int, int] = {}
+        # Corpus statistics, updated per document instead of recomputed
+        self._live_docs = 0
+        self._total_length = 0
+        self.pending_changes = 0
+        self._publish()
+
+    def _publish(self):
+        self._snapshot = _IndexSnapshot(self)
+        self._snapshots.add(self._snapshot)
+
+    @property
+    def num_docs(self) -> int:
+        return self._snapshot.num_docs
+
+    @property
+    def avg_doc_length(self) -> float:
+        return self._snapshot.avg_doc_length
+
+    # ---------- building and persistence ----------
+
+    @classmethod
+    def load_or_build(cls, db_manager: ExtendedDatabaseManager,
+                      index_path: str = "rag_system/data/indexes/bm25", **kwargs) -> "BM25Retriever":
+        """Memory-map the on-disk index, rebuilding it when missing or older than the database"""
+        retriever = cls(index_path, db_manager=db_manager, **kwargs)
+        generation = db_manager.get_generation()
+        if retriever.load() and retriever.data_generation == generation:
+            return retriever
+
+        logger.info(f"BM25 index at {index_path} is missing or stale; rebuilding from the chunks table.")
+        retriever.build(db_manager)
+        retriever.save()
+        return retriever
+
+    def build(self, db_manager: ExtendedDatabaseManager):
+        """Build the index from all active chunks"""
+        generation = db_manager.get_generation()
+        rows = db_manager.query_builder.search_chunks_advanced(
+            columns=['id', 'text'], limit=-1, order_by="id"
+        )
+        with self._lock:
+            self._reset()
+            self._sequence += 1
+            for row in rows:
+                self._add_document(int(row['id']), row['text'] or "")
+            self.data_generation = generation
+            # The rebuild itself is not on disk yet
+            self.pending_changes += 1
+            self._publish()
+        logger.info(f"BM25 index built over {len(rows)} chunks ({len(self._delta_postings)} terms).")
+
+    def _current_version(self) -> Optional[str]:
+        """Name of the current version directory ("" for an index saved before versioning), None if there is none"""
+        pointer = self.index_path / CURRENT_FILE
+        if pointer.exists():
+            return pointer.read_text(encoding="utf-8").strip()
+        if (self.index_path / "meta.json").exists():
+            return ""
+        return None
+
+    def load(self) -> bool:
+        """Memory-map the current version from disk; returns False when there is none"""
+        # Another worker may switch CURRENT and remove this version between the two reads
+        for attempt in range(3):
+            version = self._current_version()
+            if version is None:
+                return False
+            try:
+                self._load_version(version)
+                return True
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+                logger.info(f"BM25 index version {version} was replaced while loading; retrying.")
+
+    def _load_version(self, version: str):
+        version_path = self.index_path / version
+        with self._lock:
+            self._reset()
+            meta = json.loads((version_path / "meta.json").read_text(encoding="utf-8"))
+            vocab = json.loads((version_path / "vocab.json").read_text(encoding="utf-8"))
+            arrays = {name: np.load(version_path / f"{name}.npy", mmap_mode='r')
+                      for name in ('postings_offsets', 'postings_docs', 'postings_tf')}
+            doc_ids = np.load(version_path / "doc_ids.npy").astype(np.int64)
+            doc_lengths = np.load(version_path / "doc_lengths.npy").astype(np.float32)
+
+            self._version = version
+            self.k1, self.b = meta['k1'], meta['b']
+            self.data_generation = meta.get('data_generation')
+            self.vocab = vocab
+            for name, array in arrays.items():
+                setattr(self, name, array)
+            self._doc_ids = doc_ids
+            self._doc_lengths = doc_lengths
+            self._size = len(self._doc_ids)
+            self._deleted_at = np.full(self._size, NOT_DELETED, dtype=np.int64)
+            self._position_by_id = {int(doc_id): pos for pos, doc_id in enumerate(self._doc_ids)}
+            self._live_docs = self._size
+            self._total_length = int(self._doc_lengths.sum())
+            self._sequence += 1
+            self._publish()
+
+        logger.info(f"BM25 index memory-mapped from {version_path} ({self._size} docs, {len(self.vocab)} terms).")
+
+    def save(self):
+        """Merge the delta segment, drop deleted documents, write a new version and make it current"""
+        with self._lock:
+            snapshot = self._snapshot
+            keep = snapshot.live(np.arange(snapshot.size))
+            old_positions = np.flatnonzero(keep)
+            remap = np.full(snapshot.size, -1, dtype=np.int64)
+            remap[old_positions] = np.arange(len(old_positions))
+
+            postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+            for term in set(snapshot.vocab) | set(snapshot.delta_postings):
+                docs, tfs = snapshot.term_postings(term)
+                mask = keep[docs]
+                if mask.any():
+                    postings[term] = (remap[docs[mask]], tfs[mask])
+
+            terms = sorted(postings)
+            lengths = [len(postings[t][0]) for t in terms]
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(lengths)
+            arrays = {
+                'postings_offsets': offsets,
+                'postings_docs': np.concatenate([postings[t][0] for t in terms]).astype(np.int32) if terms else np.zeros(0, dtype=np.int32),
+                'postings_tf': np.concatenate([postings[t][1] for t in terms]).astype(np.uint16) if terms else np.zeros(0, dtype=np.uint16),
+                'doc_ids': snapshot.doc_ids[:snapshot.size][keep].astype(np.int64),
+                'doc_lengths': snapshot.doc_lengths[:snapshot.size][keep].astype(np.int32),
+            }
+
+            # Versions are named by creation time (so they sort by age) and pid (every API
+            # worker persists the same index_path); nothing is ever written into a version
+            # that CURRENT may already name
+            version = f"{VERSION_PREFIX}{time.time_ns():020d}-{os.getpid()}"
+            version_path = self.index_path / version
+            version_path.mkdir(parents=True)
+            for name, array in arrays.items():
+                np.save(version_path / f"{name}.npy", array)
+            (version_path / "vocab.json").write_text(
+                json.dumps({term: i for i, term in enumerate(terms)}, ensure_ascii=False), encoding="utf-8"
+            )
+            (version_path / "meta.json").write_text(
+                json.dumps({'k1': self.k1, 'b': self.b, 'data_generation': self.data_generation}), encoding="utf-8"
+            )
+
+            pointer_tmp = self.index_path / f"{CURRENT_FILE}.{os.getpid()}.tmp"
+            pointer_tmp.write_text(version, encoding="utf-8")
+            os.replace(pointer_tmp, self.index_path / CURRENT_FILE)
+            logger.info(f"BM25 index saved to {version_path}")
+            # Still under the lock, so no write lands between the merge and the reload
+            self._load_version(version)
+        # The merged snapshot may map the previous version; release it before cleaning up
+        del snapshot
+        self._remove_old_versions()
+
+    def _remove_old_versions(self):
+        """
+        Delete versions older than the current one that no snapshot of this process still
+        maps. Versions newer than CURRENT may be another worker's save in progress. A version
+        another worker still maps cannot be deleted on Windows; that is retried on the next call.
+        """
+        current = self._current_version()
+        if not current:
+            return
+        in_use = {snapshot.version for snapshot in list(self._snapshots)}
+        for path in self.index_path.iterdir():
+            if not (path.is_dir() and path.name.startswith(VERSION_PREFIX)) \
+                    or path.name >= current or path.name in in_use:
+                continue
+            try:
+                shutil.rmtree(path)
+            except OSError as e:
+                logger.debug(f"BM25 index version {path.name} not removed yet: {e}")
+        # Files of an index saved before versioning, directly in index_path
+        if "" not in in_use:
+            for name in INDEX_FILES:
+                try:
+                    (self.index_path / name).unlink()
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.debug(f"BM25 index file {name} not removed yet: {e}")
+
+    def persist(self) -> bool:
+        """save() if writes were applied since the index was last loaded or saved"""
+        with self._lock:
+            if not self.pending_changes:
+                return False
+            self.save()
+            return True
+
+    def _run(self):
+        last_persist = time.monotonic()
+        while not self._stop.wait(self.sync_interval_seconds or self.persist_interval_seconds):
+            try:
+                if self.sync_interval_seconds:
+                    self._sync_with_database()
+                if self.persist_interval_seconds and time.monotonic() - last_persist >= self.persist_interval_seconds:
+                    last_persist = time.monotonic()
+                    self.persist()
+                    self._remove_old_versions()
+            except Exception as e:
+                logger.error(f"BM25 index maintenance failed: {e}", exc_info=True)
+
+    def close(self):
+        """Stop the background thread and write any pending changes"""
+        self._stop.set()
+        if self._worker is not None:
+            self._worker.join()
+        self.persist()
+        self._remove_old_versions()
+
+    # ---------- incremental updates ----------
+
+    def add(self, chunk_id: int, text: str):
+        """Add (or replace) a chunk in the delta segment"""
+        with self._lock:
+            self._sequence += 1
+            self._delete_document(chunk_id)
+            self._add_document(chunk_id, text)
+            self.pending_changes += 1
+            self._publish()
+
+    def soft_delete(self, chunk_id: int):
+        """Exclude a chunk from results; it is physically removed on the next save()"""
+        with self._lock:
+            self._sequence += 1
+            if self._delete_document(chunk_id):
+                self.pending_changes += 1
+                self._publish()
+
+    def handle_database_change(self, event: str, **payload):
+        """DatabaseManager change listener keeping the index in sync with chunk writes"""
+        with self._lock:
+            if event in ('insert', 'update'):
+                self.add(payload['id'], payload['chunk'].get('text') or "")
+            elif event == 'soft_delete':
+                self.soft_delete(payload['id'])
+            elif event == 'restore':
+                if self.db_manager is None:
+                    logger.warning("Database restored but no database manager is attached; BM25 index not rebuilt.")
+                    return
+                logger.info("Database restored; rebuilding the BM25 index.")
+                self.build(self.db_manager)
+                return
+            self._advance_generation(payload.get('generation'))
+
+    def _advance_generation(self, generation: Optional[int]):
+        """
+        Adopt the generation of an applied write only if it directly follows ours (a bulk
+        insert reports one generation for many rows). A gap means another process wrote
+        in between, so the generation is left behind and the next search rebuilds.
+        """
+        if generation is not None and self.data_generation is not None \
+                and self.data_generation <= generation <= self.data_generation + 1:
+            self.data_generation = generation
+
+    def _sync_with_database(self):
+        """
+        Rebuild from the chunks table when the shared data generation moved past the index
+        (runs on the background thread; searches keep using the previous snapshot meanwhile)
+        """
+        if self.db_manager is None:
+            return
+        generation = self.db_manager.get_generation()
+        if generation == self.data_generation:
+            return
+        with self._lock:
+            if self.data_generation != generation:
+                logger.info(f"BM25 index is at generation {self.data_generation}, database at {generation}; rebuilding.")
+                self.build(self.db_manager)
+
+    def _add_document(self, chunk_id: int, text: str):
+        """Append a document at the next position; the caller publishes a snapshot"""
+        position = self._size
+        if position == len(self._doc_ids):
+            capacity = max(1024, 2 * position)
+            self._doc_ids = _grow(self._doc_ids, capacity, 0)
+            self._doc_lengths = _grow(self._doc_lengths, capacity, 0)
+            self._deleted_at = _grow(self._deleted_at, capacity, NOT_DELETED)
+        tokens = tokenize_for_search(text)
+        for term, tf in Counter(tokens).items():
+            self._delta_postings[term].append((position, min(tf, np.iinfo(np.uint16).max)))
+        self._doc_ids[position] = chunk_id
+        self._doc_lengths[position] = len(tokens)
+        self._size = position + 1
+        self._position_by_id[chunk_id] = position
+        self._live_docs += 1
+        self._total_length += len(tokens)
+
+    def _delete_document(self, chunk_id: int) -> bool:
+        """Mark a document deleted as of the current sequence; the caller publishes a snapshot"""
+        position = self._position_by_id.pop(chunk_id, None)
+        if position is None:
+            return False
+        self._deleted_at[position] = self._sequence
+        self._live_docs -= 1
+        self._total_length -= int(self._doc_lengths[position])
+        return True
+
+    # ---------- search ----------
+
+    def search(self, query_text: str, k: int = 10,
+               eligible_ids: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Return up to k (chunk_id, score) pairs ranked by BM25 score.
+        eligible_ids, when given, restricts results to those chunk ids.
+        """
+        query_terms = set(tokenize_for_search(query_text))
+        snapshot = self._snapshot
+        if not query_terms or snapshot.num_docs == 0:
+            return []
+
+        scores = np.zeros(snapshot.size, dtype=np.float32)
+        for term in query_terms:
+            docs, tfs = snapshot.term_postings(term)
+            live = snapshot.live(docs)
+            docs, tfs = docs[live], tfs[live]
+            if len(docs) == 0:
+                continue
+            df = len(docs)
+            idf = math.log(1.0 + (snapshot.num_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * snapshot.doc_lengths[docs] / snapshot.avg_doc_length)
+            scores[docs] += idf * tfs * (self.k1 + 1.0) / (tfs + norm)
+
+        doc_ids = snapshot.doc_ids[:snapshot.size]
+        if eligible_ids is not None:
+            scores[~np.isin(doc_ids, eligible_ids)] = 0.0
+
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(doc_ids[pos]), float(scores[pos])) for pos in ranked]
@@ -1,112 +1,689 @@
 import faiss
 import numpy as np
-import json
 import logging
 import os # Import os module
-from typing import List, Dict, Any, Optional
-from rag_system.api_service.utils.database import ExtendedDatabaseManager
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, List, Dict, Any, Optional, Tuple
+from rag_system.api_service.utils.database import ExtendedDatabaseManager, decode_embedding
+from rag_system.api_service.retrieval.metadata_store import ChunkMetadataStore
+from rag_system.api_service.retrieval.bm25_retriever import BM25Retriever
+from rag_system.api_service.utils.text_processing import clean_text, query_hash
+from rag_system.api_service.utils.result_cache import make_result_cache_key
+from rag_system.api_service.utils import index_factory
+from rag_system.api_service.utils.faiss_ids import check_index_ids, diff_index_ids, indexable_ids, load_active_embeddings
+from rag_system.api_service.utils.indexing import IndexHandle, read_index, write_index_atomic
 
 logger = logging.getLogger(__name__)
 
+FUSION_MODES = ("dense", "rrf", "weighted")
+
+# retrieve() keyword defaults applied to each query of retrieve_batch()
+BATCH_QUERY_DEFAULTS = {
+    'desired_k': 5, 'user_roles': None, 'document_ids': None, 'categories': None,
+    'fusion': "dense", 'dense_weight': 0.5, 'nprobe': None, 'ef_search': None,
+    'user_id': None, 'session_id': None
+}
+
+
+def reciprocal_rank_fusion(ranked_lists: List[List[Tuple[int, float]]], k: int = 60) -> List[Tuple[int, float]]:
+    """Merges ranked (id, score) lists by summing 1 / (k + rank) over the lists each id appears in."""
+    fused: Dict[int, float] = {}
+    for hits in ranked_lists:
+        for rank, (chunk_id, _) in enumerate(hits, start=1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def _min_max_normalize(hits: List[Tuple[int, float]]) -> Dict[int, float]:
+    if not hits:
+        return {}
+    scores = [score for _, score in hits]
+    low, high = min(scores), max(scores)
+    if high == low:
+        return {chunk_id: 1.0 for chunk_id, _ in hits}
+    return {chunk_id: (score - low) / (high - low) for chunk_id, score in hits}
+
+
+def weighted_score_fusion(dense_hits: List[Tuple[int, float]], sparse_hits: List[Tuple[int, float]],
+                          dense_weight: float = 0.5) -> List[Tuple[int, float]]:
+    """Merges dense and sparse hits by a weighted sum of their min-max normalized scores."""
+    dense_scores = _min_max_normalize(dense_hits)
+    sparse_scores = _min_max_normalize(sparse_hits)
+    fused = {
+        chunk_id: dense_weight * dense_scores.get(chunk_id, 0.0) + (1.0 - dense_weight) * sparse_scores.get(chunk_id, 0.0)
+        for chunk_id in set(dense_scores) | set(sparse_scores)
+    }
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
 class HybridRetriever:
-    def __init__(self, embedding_model, db_manager: ExtendedDatabaseManager, faiss_index_path: str = "rag_system/data/indexes/index.faiss"):
+    def __init__(self, embedding_model, db_manager: ExtendedDatabaseManager, faiss_index_path: str = "rag_system/data/indexes/index.faiss",
+                 metadata_store: Optional[ChunkMetadataStore] = None, query_encoder=None,
+                 query_cache=None, result_cache=None, bm25_retriever: Optional[BM25Retriever] = None,
+                 embedding_cache=None,
+                 fusion_candidates: int = 50, rrf_k: int = 60, max_reconcile_fraction: float = 0.05,
+                 mmap_index: bool = False, index_type: str = "flat",
+                 index_options: Optional[Dict[str, Any]] = None, nprobe: int = 16, ef_search: int = 64,
+                 analytics_writer=None):
         self.embedding_model = embedding_model
+        # Optional QueryEmbeddingBatcher shared by concurrent requests
+        self.query_encoder = query_encoder
+        # Optional QueryEmbeddingCache keyed by the cleaned query hash
+        self.query_cache = query_cache
+        # Optional PersistentEmbeddingCache consulted on in-memory cache misses
+        self.embedding_cache = embedding_cache
+        # Optional result cache keyed by request + data/index generation
+        self.result_cache = result_cache
+        # Optional sparse retriever for rrf/weighted fusion; runs concurrently with FAISS
+        self.bm25_retriever = bm25_retriever
+        # Optional SearchAnalyticsWriter; every retrieve() queues one search_analytics row
+        self.analytics_writer = analytics_writer
+        self.fusion_candidates = fusion_candidates
+        self.rrf_k = rrf_k
+        self._fusion_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bm25") if bm25_retriever else None
         self.db_manager = db_manager
         self.faiss_index_path = faiss_index_path
-        self.faiss_index = self._load_or_create_faiss_index()
+        # Memory-mapped, read-only index: pages are shared between workers via the page cache
+        self.mmap_index = mmap_index
+        # Index type and build options (nlist, pq_m, hnsw_m, ef_construction) for indexes built
+        # in-process; nprobe/ef_search are the defaults requests can override
+        if index_type not in index_factory.INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}'. Expected one of {index_factory.INDEX_TYPES}.")
+        self.index_type = index_type
+        self.index_options = index_options or {}
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        # Hot swaps may patch up to this fraction of ids from SQLite; larger gaps are rejected
+        self.max_reconcile_fraction = max_reconcile_fraction
+        # index_generation identifies the served index content (part of the result cache key);
+        # index_file_generation is the mtime of the index file as last loaded or written by
+        # this process (the file watcher swaps when it differs). Our own persist of live
+        # changes moves only the latter.
+        self.index_generation = self._index_file_generation(faiss_index_path)
+        self.index_file_generation = self.index_generation
+        # Searches pin the current handle (refcount) and hold its read lock; live
+        # maintenance holds the write lock. index_update_lock serializes maintenance with swaps.
+        self._handle_lock = threading.Lock()
+        self.index_update_lock = threading.RLock()
+        self._index_handle = IndexHandle(self._load_or_create_faiss_index(), self.index_generation)
+        self.metadata_store = metadata_store or ChunkMetadataStore(db_manager)
         logger.info("HybridRetriever initialized.")
 
+    @property
+    def faiss_index(self) -> faiss.Index:
+        return self._index_handle.index
+
+    @property
+    def index_handle(self) -> IndexHandle:
+        return self._index_handle
+
+    @contextmanager
+    def acquire_index(self):
+        """Pin the current index for a search; a concurrent swap frees it only after release."""
+        with self._handle_lock:
+            handle = self._index_handle.acquire()
+        try:
+            yield handle
+        finally:
+            handle.release()
+
+    def install_index(self, index: faiss.Index, generation: int, file_generation: Optional[int] = None):
+        """
+        Atomically make index the served index; the previous one is retired. file_generation
+        is the mtime of the file it was loaded from (defaults to generation); pass the
+        current one for an index that is not on disk yet.
+        """
+        with self._handle_lock:
+            previous = self._index_handle
+            self._index_handle = IndexHandle(index, generation)
+            self.index_generation = generation
+            self.index_file_generation = generation if file_generation is None else file_generation
+        previous.retire()
+
+    @staticmethod
+    def _index_file_generation(index_path: Optional[str]) -> int:
+        """Identifies the loaded index by its file mtime, so all workers agree on it."""
+        if index_path and os.path.exists(index_path):
+            return os.stat(index_path).st_mtime_ns
+        return 0
+
     def _load_or_create_faiss_index(self):
         """Loads FAISS index from disk or creates a new one if it doesn't exist."""
         if self.faiss_index_path and os.path.exists(self.faiss_index_path): # Changed faiss.file_exists to os.path.exists
-            logger.info(f"Loading FAISS index from {self.faiss_index_path}")
-            index = faiss.read_index(self.faiss_index_path)
-            if not isinstance(index, faiss.IndexIDMap2):
+            logger.info(f"Loading FAISS index from {self.faiss_index_path}{' (memory-mapped)' if self.mmap_index else ''}")
+            index = read_index(self.faiss_index_path, mmap=self.mmap_index)
+            if not index_factory.has_chunk_ids(index):
                 # If it's not an IDMap2, wrap it. This might happen if the index was saved without IDs.
                 # For existing indices, this might require a rebuild if IDs are crucial.
                 logger.warning("Loaded FAISS index is not IndexIDMap2. Wrapping it. Consider rebuilding if IDs are inconsistent.")
                 base_index = index
                 index = faiss.IndexIDMap2(base_index)
-            logger.info(f"FAISS index loaded with {index.ntotal} vectors.")
+            index_factory.apply_search_defaults(index, nprobe=self.nprobe, ef_search=self.ef_search)
+            logger.info(f"FAISS index loaded with {index.ntotal} vectors ({index_factory.index_type_of(index)}).")
+            self._log_id_consistency(index)
             return index
         else:
-            logger.warning(f"FAISS index not found at {self.faiss_index_path}. Creating a new IndexFlatIP.")
+            logger.warning(f"FAISS index not found at {self.faiss_index_path}. Building a '{self.index_type}' index from the database.")
             # Determine embedding dimension from the model
             dimension = self.embedding_model.get_sentence_embedding_dimension()
             if dimension is None:
                 raise ValueError("Could not determine embedding dimension from the model. Cannot create FAISS index.")
-            
-            base_index = faiss.IndexFlatIP(dimension)
-            index = faiss.IndexIDMap2(base_index)
-            logger.info(f"New FAISS IndexFlatIP (dim={dimension}) with IndexIDMap2 created.")
-            return index
+
+            ids, vectors = load_active_embeddings(self.db_manager, dimension)
+            return self.build_index(ids, vectors, dimension)
+
+    def _log_id_consistency(self, index: faiss.Index):
+        """Warns at startup when the index ids do not match chunks.id (e.g. an index built with other ids)."""
+        report = check_index_ids(index, self.db_manager)
+        if report['consistent']:
+            return
+        message = (f"FAISS index ids do not match the database: {report['matched']}/{report['indexable_chunks']} "
+                   f"chunks indexed, {report['stale']} unknown or inactive ids, {report['duplicates']} duplicates.")
+        if report['ntotal'] and report['matched'] == 0:
+            logger.error(message + " No search can return results; rebuild the index (scripts/rebuild_index.py).")
+        else:
+            logger.warning(message)
+
+    def build_index(self, ids: np.ndarray, vectors: np.ndarray, dimension: Optional[int] = None) -> faiss.Index:
+        """Builds (and trains) an index of the configured type over the given chunk ids and vectors."""
+        return index_factory.build_index(
+            vectors, ids, self.index_type,
+            dimension=dimension or self.embedding_model.get_sentence_embedding_dimension(),
+            nprobe=self.nprobe, ef_search=self.ef_search, **self.index_options
+        )
+
+    @staticmethod
+    def _make_id_selector(eligible_ids: np.ndarray) -> faiss.IDSelector:
+        """
+        Compiles the eligible chunk ids into a FAISS IDSelectorBitmap so that
+        the search only scans eligible vectors.
+        """
+        bits = np.zeros(int(eligible_ids.max()) + 1, dtype=bool)
+        bits[eligible_ids] = True
+        # FAISS reads bit i from byte i >> 3 at position i & 7 (little-endian bit order)
+        return faiss.IDSelectorBitmap(np.packbits(bits, bitorder="little"))
+
+    def _encode_query(self, query_text: str) -> np.ndarray:
+        """
+        Returns the normalized embedding of a query. The in-memory cache is keyed by the
+        NFC-normalized, whitespace-collapsed query, which is exactly the text the model
+        encodes (casing is kept: the model is case-sensitive).
+        """
+        text = clean_text(query_text)
+        cache_key = query_hash(text) if self.query_cache is not None else None
+        if cache_key is not None:
+            cached = self.query_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        query_embedding = self.embedding_cache.get_many([text])[0] if self.embedding_cache is not None else None
+        if query_embedding is None:
+            if self.query_encoder is not None:
+                query_embedding = self.query_encoder.encode(text)
+            else:
+                query_embedding = self.embedding_model.encode([text])[0]
+            query_embedding = query_embedding / np.linalg.norm(query_embedding) # Normalize for cosine similarity
+            if self.embedding_cache is not None:
+                self.embedding_cache.put_many([text], [query_embedding])
+
+        if cache_key is not None:
+            self.query_cache.put(cache_key, query_embedding)
+        return query_embedding
+
+    def _encode_queries(self, query_texts: List[str]) -> np.ndarray:
+        """
+        Returns the normalized embeddings of several queries as one (n, d) array. Cache
+        misses are encoded together in a single model.encode call (keys and encoded text
+        as in _encode_query).
+        """
+        cleaned = [clean_text(text) for text in query_texts]
+        cache_keys = [query_hash(text) for text in cleaned]
+        vectors: List[Optional[np.ndarray]] = [None] * len(cleaned)
+        if self.query_cache is not None:
+            vectors = [self.query_cache.get(key) for key in cache_keys]
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing and self.embedding_cache is not None:
+            for i, vector in zip(missing, self.embedding_cache.get_many([cleaned[i] for i in missing])):
+                vectors[i] = vector
+            missing = [i for i in missing if vectors[i] is None]
+        if missing:
+            # Queries sharing a cache key (same cleaned text) are encoded once
+            first_by_key = {}
+            for i in missing:
+                first_by_key.setdefault(cache_keys[i], i)
+            texts = [cleaned[i] for i in first_by_key.values()]
+            encoded = self.embedding_model.encode(texts, batch_size=len(texts), show_progress_bar=False)
+            encoded = encoded / np.linalg.norm(encoded, axis=1, keepdims=True)
+            by_key = dict(zip(first_by_key, encoded))
+            for i in missing:
+                vectors[i] = by_key[cache_keys[i]]
+            if self.embedding_cache is not None:
+                self.embedding_cache.put_many(texts, list(encoded))
+
+        if self.query_cache is not None:
+            for key, vector in zip(cache_keys, vectors):
+                self.query_cache.put(key, vector)
+        return np.vstack(vectors).astype(np.float32)
 
     def retrieve(self, query_text: str, desired_k: int = 5, user_roles: Optional[List[str]] = None, 
                  document_ids: Optional[List[str]] = None, categories: Optional[List[str]] = None,
-                 compensation_factor: int = 3) -> List[Dict[str, Any]]:
+                 fusion: str = "dense", dense_weight: float = 0.5,
+                 nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                 timings: Optional[Dict[str, float]] = None,
+                 user_id: Optional[str] = None, session_id: Optional[str] = None) -> List[Dict[str, Any]]:
         """
-        Retrieves relevant chunks using FAISS and applies metadata filtering.
+        Retrieves relevant chunks, restricted to the chunks that pass the metadata filters.
+        fusion selects dense-only FAISS search ("dense"), or dense + BM25 merged with
+        reciprocal-rank fusion ("rrf") or a min-max normalized weighted sum ("weighted",
+        dense_weight * dense + (1 - dense_weight) * bm25).
+        nprobe (IVF indexes) and ef_search (HNSW) override the index defaults for this
+        request, trading latency for recall; they are ignored by other index types.
+        If a timings dict is given, per-stage durations (ms) are recorded into it, plus
+        'retrieve' for the whole call.
+        With an analytics writer, the search (including those timings) is logged to
+        search_analytics asynchronously; user_id and session_id are stored with it.
         """
+        self._check_fusion(fusion)
+        if timings is None:
+            timings = {}
+        retrieve_start = time.perf_counter()
+
+        cache_key = None
+        if self.result_cache is not None:
+            stage_start = time.perf_counter()
+            cache_key = self._result_cache_key(query_text, desired_k, user_roles, document_ids, categories,
+                                               fusion, dense_weight, nprobe, ef_search)
+            cached_results = self.result_cache.get(cache_key)
+            timings['result_cache'] = (time.perf_counter() - stage_start) * 1000
+            if cached_results is not None:
+                timings['retrieve'] = (time.perf_counter() - retrieve_start) * 1000
+                self._log_search(query_text, cached_results, timings, user_id, session_id)
+                return cached_results
+
+        results = self._search(query_text, desired_k, user_roles, document_ids, categories,
+                               fusion, dense_weight, timings, nprobe=nprobe, ef_search=ef_search)
+        if cache_key is not None:
+            self.result_cache.put(cache_key, results)
+        timings['retrieve'] = (time.perf_counter() - retrieve_start) * 1000
+        self._log_search(query_text, results, timings, user_id, session_id)
+        return results
+
+    def _check_fusion(self, fusion: str):
+        if fusion not in FUSION_MODES:
+            raise ValueError(f"Unknown fusion mode '{fusion}'. Expected one of {FUSION_MODES}.")
+        if fusion != "dense" and self.bm25_retriever is None:
+            raise ValueError(f"Fusion mode '{fusion}' requires a BM25 retriever, but none is configured.")
+
+    def _result_cache_key(self, query_text: str, desired_k: int, user_roles: Optional[List[str]],
+                          document_ids: Optional[List[str]], categories: Optional[List[str]],
+                          fusion: str, dense_weight: float, nprobe: Optional[int], ef_search: Optional[int]) -> str:
+        return make_result_cache_key(
+            query_text, desired_k, user_roles, document_ids, categories,
+            # The generation the metadata store was loaded at: no SQLite read per search
+            generation=(self.metadata_store.data_generation, self.index_generation),
+            fusion=fusion, dense_weight=dense_weight, nprobe=nprobe, ef_search=ef_search
+        )
+
+    def retrieve_batch(self, queries: List[Dict[str, Any]],
+                       on_result: Callable[[int, List[Dict[str, Any]]], None],
+                       timings: Optional[Dict[str, float]] = None):
+        """
+        Retrieves several queries together. Each query is a dict of retrieve() keyword
+        arguments (query_text is required). on_result(position, results) is called once per
+        query as soon as its results are ready: result-cache hits first, then the rest in
+        request order.
+        The uncached queries are encoded in one model call and searched with one multi-row
+        FAISS search per distinct filter set (the id selector applies to every row of a search),
+        and the candidates of all queries are hydrated together. Batch-wide stage durations
+        are recorded into timings and logged with every query's search_analytics row.
+        """
+        queries = [dict(BATCH_QUERY_DEFAULTS, **query) for query in queries]
+        for query in queries:
+            self._check_fusion(query['fusion'])
+        if timings is None:
+            timings = {}
+        retrieve_start = time.perf_counter()
+
+        pending, cache_keys = [], {}
+        stage_start = time.perf_counter()
+        for position, query in enumerate(queries):
+            if self.result_cache is not None:
+                cache_keys[position] = self._result_cache_key(
+                    query['query_text'], query['desired_k'], query['user_roles'], query['document_ids'],
+                    query['categories'], query['fusion'], query['dense_weight'], query['nprobe'], query['ef_search']
+                )
+                cached_results = self.result_cache.get(cache_keys[position])
+                if cached_results is not None:
+                    query_timings = dict(timings, retrieve=(time.perf_counter() - retrieve_start) * 1000)
+                    self._log_search(query['query_text'], cached_results, query_timings,
+                                     query['user_id'], query['session_id'])
+                    on_result(position, cached_results)
+                    continue
+            pending.append(position)
+        if self.result_cache is not None:
+            timings['result_cache'] = (time.perf_counter() - stage_start) * 1000
+        if not pending:
+            return
+
+        # Queries sharing filters and search knobs share one FAISS search; eligible ids once per group
+        stage_start = time.perf_counter()
+        groups: Dict[Tuple, List[int]] = {}
+        for position in pending:
+            query = queries[position]
+            group_key = tuple(tuple(sorted(query[name] or ())) for name in ('user_roles', 'document_ids', 'categories'))
+            groups.setdefault(group_key + (query['nprobe'], query['ef_search']), []).append(position)
+        eligible = {}
+        for group_key, positions in groups.items():
+            first = queries[positions[0]]
+            eligible[group_key] = self.metadata_store.eligible_ids(
+                user_roles=first['user_roles'], document_ids=first['document_ids'], categories=first['categories']
+            )
+        timings['filter'] = (time.perf_counter() - stage_start) * 1000
+
+        # Both retrievers look deeper than top_k for fused queries so that fusion can reorder candidates
+        candidate_k, sparse_futures = {}, {}
+        for group_key, positions in groups.items():
+            for position in positions:
+                query = queries[position]
+                candidate_k[position] = query['desired_k']
+                if query['fusion'] != "dense":
+                    candidate_k[position] = max(query['desired_k'], self.fusion_candidates)
+                    if len(eligible[group_key]):
+                        sparse_futures[position] = self._fusion_pool.submit(
+                            self._sparse_search, query['query_text'], candidate_k[position], eligible[group_key]
+                        )
+
+        dense_hits: Dict[int, List[Tuple[int, float]]] = {position: [] for position in pending}
+        searchable = [position for group_key, positions in groups.items() if len(eligible[group_key])
+                      for position in positions]
+        if searchable and self.faiss_index.ntotal:
+            stage_start = time.perf_counter()
+            embeddings = self._encode_queries([queries[position]['query_text'] for position in searchable])
+            rows = dict(zip(searchable, embeddings))
+            timings['encode'] = (time.perf_counter() - stage_start) * 1000
+
+            stage_start = time.perf_counter()
+            for group_key, positions in groups.items():
+                if not len(eligible[group_key]):
+                    continue
+                nprobe, ef_search = group_key[-2:]
+                group_hits = self._faiss_search(
+                    np.vstack([rows[position] for position in positions]),
+                    max(candidate_k[position] for position in positions),
+                    eligible[group_key], nprobe, ef_search
+                )
+                for position, hits in zip(positions, group_hits):
+                    dense_hits[position] = hits[:candidate_k[position]]
+            timings['faiss_search'] = (time.perf_counter() - stage_start) * 1000
+
+        stage_start = time.perf_counter()
+        fused, sparse_hits = {}, {}
+        for position in pending:
+            query = queries[position]
+            sparse_hits[position] = []
+            if query['fusion'] == "dense":
+                fused[position] = dense_hits[position]
+                continue
+            if position in sparse_futures:
+                sparse_hits[position], _ = sparse_futures[position].result()
+            if query['fusion'] == "rrf":
+                merged = reciprocal_rank_fusion([dense_hits[position], sparse_hits[position]], k=self.rrf_k)
+            else:
+                merged = weighted_score_fusion(dense_hits[position], sparse_hits[position], query['dense_weight'])
+            fused[position] = merged[:query['desired_k']]
+        timings['fusion'] = (time.perf_counter() - stage_start) * 1000
+
+        # One hydration for the candidates of every query
+        stage_start = time.perf_counter()
+        id_to_metadata = self.metadata_store.hydrate(sorted({chunk_id for hits in fused.values() for chunk_id, _ in hits}))
+        timings['hydrate'] = (time.perf_counter() - stage_start) * 1000
+        timings['retrieve'] = (time.perf_counter() - retrieve_start) * 1000
+
+        for position in pending:
+            query = queries[position]
+            results = self._rank_results(fused[position], dense_hits[position], sparse_hits[position],
+                                         query['fusion'], id_to_metadata)
+            if position in cache_keys:
+                self.result_cache.put(cache_keys[position], results)
+            self._log_search(query['query_text'], results, timings, query['user_id'], query['session_id'])
+            on_result(position, results)
+
+    def _log_search(self, query_text: str, results: List[Dict[str, Any]], timings: Dict[str, float],
+                    user_id: Optional[str], session_id: Optional[str]):
+        """Queues the search_analytics row; never blocks on SQLite (rows are dropped under backpressure)."""
+        if self.analytics_writer is None:
+            return
+        self.analytics_writer.record(
+            query_text=query_text,
+            query_embedding_hash=query_hash(clean_text(query_text)),
+            results_count=len(results),
+            top_chunk_ids=[result['chunk_id'] for result in results],
+            search_time_ms=int(round(timings['retrieve'] + timings.get('queue_wait', 0))),
+            user_id=user_id,
+            session_id=session_id,
+            stage_timings={stage: round(ms, 3) for stage, ms in timings.items()}
+        )
+
+    def _dense_search(self, query_text: str, k: int, eligible_ids: np.ndarray, timings: Dict[str, float],
+                      nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Encodes the query and runs the filtered FAISS search; returns (chunk id, cosine) pairs."""
         if self.faiss_index.ntotal == 0:
-            logger.warning("FAISS index is empty. No retrieval possible.")
+            logger.warning("FAISS index is empty. No dense retrieval possible.")
             return []
 
         # Compute query embedding
-        query_embedding = self.embedding_model.encode([query_text])[0]
-        query_embedding = query_embedding / np.linalg.norm(query_embedding) # Normalize for cosine similarity
-
-        # Initial search with compensation factor
-        initial_k = desired_k * compensation_factor
-        distances, faiss_ids = self.faiss_index.search(
-            query_embedding.reshape(1, -1), 
-            initial_k
-        )
-        
-        # Filter valid IDs (FAISS returns -1 for empty slots if ntotal < k)
-        valid_faiss_ids = [int(id) for id in faiss_ids[0] if id != -1]
-        
-        if not valid_faiss_ids:
-            logger.info("No valid FAISS IDs found after initial search.")
-            return []
-        
-        # Query metadata from SQLite
-        # Use the advanced query builder from DatabaseManager
-        filtered_chunks = self.db_manager.query_builder.search_chunks_advanced(
-            chunk_ids=valid_faiss_ids,
+        stage_start = time.perf_counter()
+        query_embedding = self._encode_query(query_text)
+        timings['encode'] = (time.perf_counter() - stage_start) * 1000
+
+        stage_start = time.perf_counter()
+        hits = self._faiss_search(query_embedding.reshape(1, -1), k, eligible_ids, nprobe, ef_search)[0]
+        timings['faiss_search'] = (time.perf_counter() - stage_start) * 1000
+        return hits
+
+    def _faiss_search(self, query_embeddings: np.ndarray, k: int, eligible_ids: np.ndarray,
+                      nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[List[Tuple[int, float]]]:
+        """Runs one filtered FAISS search for all rows of query_embeddings; returns (chunk id, cosine) pairs per row."""
+        # Filtered search: only eligible vectors are scanned (exact top-k for flat indexes)
+        selector = self._make_id_selector(eligible_ids)
+        with self.acquire_index() as handle, handle.lock.read():
+            distances, faiss_ids = handle.index.search(
+                np.ascontiguousarray(query_embeddings, dtype=np.float32),
+                k,
+                params=index_factory.search_parameters(handle.index, selector, nprobe=nprobe, ef_search=ef_search)
+            )
+
+        # FAISS returns -1 for empty slots if fewer than k vectors are eligible; an HNSW index
+        # updated live can hold an old and a new vector for the same id, keep the best one
+        rows = []
+        for row_ids, row_distances in zip(faiss_ids, distances):
+            hits, seen = [], set()
+            for faiss_id, distance in zip(row_ids, row_distances):
+                if faiss_id != -1 and faiss_id not in seen:
+                    seen.add(faiss_id)
+                    hits.append((int(faiss_id), float(distance)))
+            rows.append(hits)
+        return rows
+
+    def _sparse_search(self, query_text: str, k: int, eligible_ids: np.ndarray) -> Tuple[List[Tuple[int, float]], float]:
+        """Runs the BM25 search; returns its hits and its duration in ms."""
+        stage_start = time.perf_counter()
+        hits = self.bm25_retriever.search(query_text, k, eligible_ids=eligible_ids)
+        return hits, (time.perf_counter() - stage_start) * 1000
+
+    def _search(self, query_text: str, desired_k: int, user_roles: Optional[List[str]],
+                document_ids: Optional[List[str]], categories: Optional[List[str]],
+                fusion: str, dense_weight: float, timings: Dict[str, float],
+                nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Runs the filtered dense/sparse searches, fusion and hydration (the uncached path of retrieve)."""
+        stage_start = time.perf_counter()
+        eligible_ids = self.metadata_store.eligible_ids(
             user_roles=user_roles,
             document_ids=document_ids,
-            categories=categories,
-            limit=desired_k * compensation_factor # Apply limit after filtering
+            categories=categories
         )
+        timings['filter'] = (time.perf_counter() - stage_start) * 1000
+        if len(eligible_ids) == 0:
+            logger.info("No active chunks match the requested filters.")
+            return []
 
-        # Maintain FAISS ranking order and apply final desired_k
-        id_to_metadata = {chunk['id']: chunk for chunk in filtered_chunks}
-        ranked_results = []
-        
-        for i, faiss_id in enumerate(faiss_ids[0]):
-            if faiss_id in id_to_metadata:
-                chunk_data = id_to_metadata[faiss_id]
-                result = {
-                    'chunk_id': chunk_data['chunk_id'],
-                    'document_id': chunk_data['document_id'],
-                    'title': chunk_data['title'],
-                    'text': chunk_data['text'],
-                    'similarity_score': float(distances[0][i]),
-                    'rank': len(ranked_results) + 1,
-                    'metadata': json.loads(chunk_data['metadata']) if chunk_data['metadata'] else {}
-                }
-                ranked_results.append(result)
-                
-                if len(ranked_results) >= desired_k:
-                    break
+        if fusion == "dense":
+            dense_hits = self._dense_search(query_text, desired_k, eligible_ids, timings, nprobe, ef_search)
+            fused = dense_hits
+            sparse_hits = []
+        else:
+            # Both retrievers look deeper than top_k so that fusion can reorder candidates
+            candidate_k = max(desired_k, self.fusion_candidates)
+            sparse_future = self._fusion_pool.submit(self._sparse_search, query_text, candidate_k, eligible_ids)
+            stage_start = time.perf_counter()
+            dense_hits = self._dense_search(query_text, candidate_k, eligible_ids, timings, nprobe, ef_search)
+            timings['dense'] = (time.perf_counter() - stage_start) * 1000
+            sparse_hits, timings['bm25'] = sparse_future.result()
+
+            stage_start = time.perf_counter()
+            if fusion == "rrf":
+                fused = reciprocal_rank_fusion([dense_hits, sparse_hits], k=self.rrf_k)
+            else:
+                fused = weighted_score_fusion(dense_hits, sparse_hits, dense_weight)
+            fused = fused[:desired_k]
+            timings['fusion'] = (time.perf_counter() - stage_start) * 1000
+
+        if not fused:
+            logger.info("No candidates found for the query.")
+            return []
+
+        # Hydrate the union of candidates once from the resident metadata store (no SQLite on the hot path)
+        stage_start = time.perf_counter()
+        id_to_metadata = self.metadata_store.hydrate([chunk_id for chunk_id, _ in fused])
+        ranked_results = self._rank_results(fused, dense_hits, sparse_hits, fusion, id_to_metadata)
+        timings['hydrate'] = (time.perf_counter() - stage_start) * 1000
         
+        if fusion != "dense":
+            dense_count = sum(1 for r in ranked_results if r['retriever_scores']['dense'])
+            bm25_count = sum(1 for r in ranked_results if r['retriever_scores']['bm25'])
+            logger.info(f"Fusion '{fusion}' for '{query_text}': {dense_count} results from dense, "
+                        f"{bm25_count} from BM25 (dense {timings.get('dense', 0):.1f} ms, bm25 {timings['bm25']:.1f} ms)")
         logger.info(f"Retrieved {len(ranked_results)} results for query '{query_text}'")
         return ranked_results
 
-    def update_faiss_index(self, new_index_path: str):
-        """Updates the FAISS index reference after a rebuild."""
-        if faiss.file_exists(new_index_path):
-            self.faiss_index = faiss.read_index(new_index_path)
-            logger.info(f"FAISS index updated to {new_index_path} with {self.faiss_index.ntotal} vectors.")
-        else:
-            logger.error(f"New FAISS index file not found at {new_index_path}. Index not updated.")
+    @staticmethod
+    def _rank_results(fused: List[Tuple[int, float]], dense_hits: List[Tuple[int, float]],
+                      sparse_hits: List[Tuple[int, float]], fusion: str,
+                      id_to_metadata: Dict[int, Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Builds the ranked result dicts for the fused (chunk id, score) pairs from hydrated metadata."""
+        dense_ranks = {chunk_id: (rank, score) for rank, (chunk_id, score) in enumerate(dense_hits, start=1)}
+        sparse_ranks = {chunk_id: (rank, score) for rank, (chunk_id, score) in enumerate(sparse_hits, start=1)}
+        ranked_results = []
+
+        for chunk_id, fused_score in fused:
+            if chunk_id not in id_to_metadata:
+                continue
+            chunk_data = id_to_metadata[chunk_id]
+            result = {
+                'chunk_id': chunk_data['chunk_id'],
+                'document_id': chunk_data['document_id'],
+                'title': chunk_data['title'],
+                'text': chunk_data['text'],
+                'similarity_score': dense_ranks.get(chunk_id, (None, 0.0))[1],
+                'rank': len(ranked_results) + 1,
+                'metadata': chunk_data['metadata']
+            }
+            if fusion != "dense":
+                result['fusion_score'] = fused_score
+                result['retriever_scores'] = {
+                    name: {'rank': ranks[chunk_id][0], 'score': ranks[chunk_id][1]} if chunk_id in ranks else None
+                    for name, ranks in (('dense', dense_ranks), ('bm25', sparse_ranks))
+                }
+            ranked_results.append(result)
+        return ranked_results
+
+    def update_faiss_index(self, new_index_path: str, only_if_changed: bool = False) -> Dict[str, Any]:
+        """
+        Hot-swaps in a newly built index without interrupting searches.
+        The file is loaded and validated (chunk ids, dimension, id coverage against the
+        active chunks in SQLite) before anything changes; small coverage gaps from writes
+        made while it was being built are patched from SQLite. In-flight searches finish
+        on the old index, which is freed afterwards. Raises ValueError if validation fails.
+        """
+        if not os.path.exists(new_index_path):
+            raise ValueError(f"New FAISS index file not found at {new_index_path}. Index not updated.")
+
+        load_start = time.perf_counter()
+        generation = self._index_file_generation(new_index_path)
+        if only_if_changed and generation == self.index_file_generation:
+            return {'swapped': False, 'index_path': new_index_path}
+        new_index = read_index(new_index_path, mmap=self.mmap_index)
+        index_factory.apply_search_defaults(new_index, nprobe=self.nprobe, ef_search=self.ef_search)
+        load_ms = (time.perf_counter() - load_start) * 1000
+
+        if not index_factory.has_chunk_ids(new_index):
+            raise ValueError(f"Index at {new_index_path} is a {type(new_index).__name__} without chunk ids "
+                             f"(expected an IndexIDMap2 or an IVF index).")
+        dimension = self.embedding_model.get_sentence_embedding_dimension()
+        if new_index.d != dimension:
+            raise ValueError(f"Index at {new_index_path} has dimension {new_index.d}, the embedding model has {dimension}.")
+
+        # Live maintenance waits from here until the swap, so no change event is lost in between
+        with self.index_update_lock:
+            if only_if_changed and self._index_file_generation(new_index_path) == self.index_file_generation:
+                return {'swapped': False, 'index_path': new_index_path}
+            added, removed = self._reconcile_index(new_index, new_index_path)
+
+            if new_index_path != self.faiss_index_path or added or removed:
+                # Publish the served index at the canonical path (other workers' watchers pick it up)
+                write_index_atomic(new_index, self.faiss_index_path)
+                generation = self._index_file_generation(self.faiss_index_path)
+            self.install_index(new_index, generation)
+
+        logger.info(f"FAISS index hot-swapped from {new_index_path}: {new_index.ntotal} vectors "
+                    f"(+{added}/-{removed} reconciled, loaded in {load_ms:.0f} ms).")
+        return {
+            'swapped': True,
+            'index_path': new_index_path,
+            'ntotal': new_index.ntotal,
+            'dimension': new_index.d,
+            'reconciled_added': added,
+            'reconciled_removed': removed,
+            'load_ms': round(load_ms, 2)
+        }
+
+    def _reconcile_index(self, index: faiss.Index, index_path: str) -> Tuple[int, int]:
+        """Checks the index ids against the active chunks and patches small differences."""
+        active_ids = indexable_ids(self.db_manager)
+        missing, stale, duplicates = diff_index_ids(index, active_ids)
+        # An HNSW index maintained live keeps superseded vectors (same id) until it is rebuilt
+        removable = index_factory.supports_remove(index)
+        if removable and len(duplicates):
+            raise ValueError(f"Index at {index_path} contains {len(duplicates)} duplicate ids.")
+        allowed = int(self.max_reconcile_fraction * max(len(active_ids), 1))
+        if len(missing) + len(stale) > allowed:
+            raise ValueError(
+                f"Index at {index_path} does not match the database: {len(missing)} active chunks missing, "
+                f"{len(stale)} unknown or inactive ids (at most {allowed} can be reconciled)."
+            )
+
+        if self.mmap_index and (len(missing) or len(stale)):
+            raise ValueError(
+                f"Index at {index_path} is {len(missing)} active chunks short and has {len(stale)} stale ids; "
+                f"a memory-mapped index cannot be patched, rebuild it."
+            )
+        if len(stale) and not removable:
+            # Searches only consider eligible ids, so the vectors stay until the next rebuild
+            logger.warning(f"Index at {index_path} keeps {len(stale)} stale ids (its type cannot remove vectors).")
+            stale = stale[:0]
+        if len(stale):
+            index.remove_ids(stale)
+        added = 0
+        for start in range(0, len(missing), 500):
+            rows = self.db_manager.get_chunks_by_ids(missing[start:start + 500].tolist(), columns=['embedding'])
+            if not rows:
+                continue
+            ids = np.asarray(list(rows.keys()), dtype=np.int64)
+            vectors = np.vstack([decode_embedding(rows[row_id]['embedding']) for row_id in ids]).astype(np.float32)
+            index.add_with_ids(vectors, ids)
+            added += len(ids)
+        return added, len(stale)
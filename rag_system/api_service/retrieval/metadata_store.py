@@ -0,0 +1,234 @@
+"""
+Resident chunk metadata store for the /search hot path.
+Holds an array-backed copy of the active chunks so that filtering and
+hydration do not touch SQLite during a search. A background thread reloads
+the copy after change events and when the shared data generation moves
+(writes made by other processes, e.g. scripts/import_data.py), polling it
+every refresh_interval_seconds; searches only read the current snapshot.
+"""
+
+import json
+import logging
+import threading
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from rag_system.api_service.utils.database import ExtendedDatabaseManager
+
+logger = logging.getLogger(__name__)
+
+# Role bitmask width: bit 0 is reserved for the "all" role
+MAX_ROLES = 64
+
+# Display and filter fields held by the store (never the embedding)
+STORE_COLUMNS = ['id', 'chunk_id', 'document_id', 'title', 'category', 'access_roles', 'metadata', 'text']
+
+
+class _MetadataSnapshot:
+    """Immutable columnar view of the active chunks, sorted by FAISS id"""
+
+    def __init__(self, rows: List[Any]):
+        count = len(rows)
+        self.ids = np.empty(count, dtype=np.int64)
+        self.document_codes = np.empty(count, dtype=np.int32)
+        self.category_codes = np.empty(count, dtype=np.int32)
+        self.role_masks = np.zeros(count, dtype=np.uint64)
+        self.text_offsets = np.zeros(count + 1, dtype=np.int64)
+        self.chunk_ids: List[str] = []
+        self.chunk_positions: Dict[str, int] = {}
+        self.titles: List[Optional[str]] = []
+        self.metadata: List[Optional[str]] = []
+
+        self.documents: Dict[str, int] = {}
+        self.categories: Dict[str, int] = {}
+        self.roles: Dict[str, int] = {"all": 0}
+        self.document_names: List[str] = []
+
+        texts = []
+        for i, row in enumerate(rows):
+            self.ids[i] = row['id']
+            self.document_codes[i] = self._code(self.documents, row['document_id'], self.document_names)
+            self.category_codes[i] = self._code(self.categories, row['category'])
+            self.role_masks[i] = self._role_mask(row['access_roles'], row['id'])
+            self.chunk_positions[row['chunk_id']] = i
+            self.chunk_ids.append(row['chunk_id'])
+            self.titles.append(row['title'])
+            self.metadata.append(row['metadata'])
+            texts.append(row['text'] or "")
+            self.text_offsets[i + 1] = self.text_offsets[i] + len(texts[-1])
+
+        self.text_blob = "".join(texts)
+
+    @staticmethod
+    def _code(vocab: Dict[str, int], value: Optional[str], names: Optional[List[str]] = None) -> int:
+        if value not in vocab:
+            vocab[value] = len(vocab)
+            if names is not None:
+                names.append(value)
+        return vocab[value]
+
+    def _role_mask(self, access_roles: Optional[str], row_id: int) -> int:
+        try:
+            roles = json.loads(access_roles) if access_roles else []
+        except (json.JSONDecodeError, TypeError):
+            logger.warning(f"Invalid access_roles for chunk row {row_id}; it will only match unfiltered searches.")
+            roles = []
+
+        mask = 0
+        for role in roles:
+            if role not in self.roles:
+                if len(self.roles) >= MAX_ROLES:
+                    raise ValueError(f"More than {MAX_ROLES} distinct access roles are not supported")
+                self.roles[role] = len(self.roles)
+            mask |= 1 << self.roles[role]
+        return mask
+
+    def role_bits(self, user_roles: List[str]) -> int:
+        """Bitmask of the given roles plus "all" (unknown roles match nothing)"""
+        bits = 1 << self.roles['all']
+        for role in user_roles:
+            if role in self.roles:
+                bits |= 1 << self.roles[role]
+        return bits
+
+    def record(self, pos: int) -> Dict[str, Any]:
+        """Display fields of the chunk at a row position"""
+        start, end = self.text_offsets[pos], self.text_offsets[pos + 1]
+        raw_metadata = self.metadata[pos]
+        return {
+            'chunk_id': self.chunk_ids[pos],
+            'document_id': self.document_names[self.document_codes[pos]],
+            'title': self.titles[pos],
+            'text': self.text_blob[start:end],
+            'metadata': json.loads(raw_metadata) if raw_metadata else {}
+        }
+
+    def positions(self, ids: np.ndarray) -> np.ndarray:
+        """Map FAISS ids to row positions, -1 for ids that are not active"""
+        if len(self.ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        pos = np.clip(np.searchsorted(self.ids, ids), 0, len(self.ids) - 1)
+        return np.where(self.ids[pos] == ids, pos, -1)
+
+
+class ChunkMetadataStore:
+    """
+    Array-backed cache of active chunk metadata keyed by FAISS id (chunks.id).
+    Built from the chunks table; a background thread rebuilds it after DatabaseManager
+    change events (right away) and when system_state.data_generation moved past the
+    generation it was loaded at (checked every refresh_interval_seconds). Readers never
+    query SQLite, so a write shows up in searches once the reload finished.
+    """
+
+    def __init__(self, db_manager: ExtendedDatabaseManager, refresh_interval_seconds: float = 1.0):
+        self.db_manager = db_manager
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self._lock = threading.Lock()
+        self._snapshot: Optional[_MetadataSnapshot] = None
+        self._stale = True
+        self.data_generation: Optional[int] = None
+        db_manager.add_change_listener(self._on_database_change)
+        self.reload()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="metadata-store-refresh", daemon=True)
+        self._worker.start()
+
+    def _on_database_change(self, event: str, **payload):
+        self._stale = True
+        self._wake.set()
+
+    def reload(self):
+        """Rebuild the store from the chunks table"""
+        with self._lock:
+            # Cleared (and the generation read) before the rows so that changes committed
+            # during the load mark it stale again
+            self._stale = False
+            generation = self.db_manager.get_generation()
+            rows = self.db_manager.query_builder.search_chunks_advanced(
+                columns=STORE_COLUMNS,
+                limit=-1,  # SQLite: no limit
+                order_by="id"
+            )
+
+            self._snapshot = _MetadataSnapshot(rows)
+            self.data_generation = generation
+        logger.info(f"Chunk metadata store loaded with {len(rows)} active chunks (generation {generation}).")
+
+    def refresh(self) -> bool:
+        """Reload if a change event arrived or another process moved the data generation"""
+        # Writes by other processes raise the shared generation without a change event
+        if not self._stale and self.db_manager.get_generation() == self.data_generation:
+            return False
+        self.reload()
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.refresh_interval_seconds)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Failed to refresh the chunk metadata store: {e}", exc_info=True)
+
+    def close(self):
+        """Stop the refresh thread"""
+        self._stop.set()
+        self._wake.set()
+        self._worker.join()
+
+    def _current(self) -> _MetadataSnapshot:
+        return self._snapshot
+
+    def __len__(self) -> int:
+        return len(self._current().ids)
+
+    def eligible_ids(self, user_roles: Optional[List[str]] = None,
+                     document_ids: Optional[List[str]] = None,
+                     categories: Optional[List[str]] = None) -> np.ndarray:
+        """Return the FAISS ids of active chunks that pass the access and metadata filters"""
+        snapshot = self._current()
+        mask = np.ones(len(snapshot.ids), dtype=bool)
+
+        if user_roles and 'all' not in user_roles:
+            mask &= (snapshot.role_masks & np.uint64(snapshot.role_bits(user_roles))) != 0
+
+        if document_ids:
+            codes = [snapshot.documents[d] for d in document_ids if d in snapshot.documents]
+            mask &= np.isin(snapshot.document_codes, codes)
+
+        if categories:
+            codes = [snapshot.categories[c] for c in categories if c in snapshot.categories]
+            mask &= np.isin(snapshot.category_codes, codes)
+
+        return snapshot.ids[mask]
+
+    def hydrate(self, ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Return display fields for the given FAISS ids; inactive ids are omitted"""
+        snapshot = self._current()
+        positions = snapshot.positions(np.asarray(ids, dtype=np.int64))
+
+        records = {}
+        for faiss_id, pos in zip(ids, positions):
+            if pos < 0:
+                continue
+            records[int(faiss_id)] = snapshot.record(pos)
+        return records
+
+    def get_chunk(self, chunk_id: str, user_roles: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Return the display fields of an active chunk by its chunk_id, or None if it is
+        not active or (with user_roles) not visible to those roles, as in eligible_ids().
+        """
+        snapshot = self._current()
+        pos = snapshot.chunk_positions.get(chunk_id)
+        if pos is None:
+            return None
+        if user_roles and 'all' not in user_roles:
+            if not int(snapshot.role_masks[pos]) & snapshot.role_bits(user_roles):
+                return None
+        return snapshot.record(pos)
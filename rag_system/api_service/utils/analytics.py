@@ -0,0 +1,119 @@
+"""
+Asynchronous search analytics.
+Searches enqueue their search_analytics row without blocking; a background
+thread writes queued rows in batches (one transaction per batch), so a query
+never waits for an SQLite commit. When the queue is full, rows are dropped
+and counted instead of slowing searches down.
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Dict, List
+
+from rag_system.api_service.utils.database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+
+class SearchAnalyticsWriter:
+    """
+    Batches search_analytics inserts. A batch is flushed when it reaches
+    max_batch_size rows or flush_interval_ms after its first row, whichever
+    comes first. At most max_queue_size rows wait in memory.
+    """
+
+    def __init__(self, db_manager: DatabaseManager, max_batch_size: int = 200,
+                 flush_interval_ms: float = 1000.0, max_queue_size: int = 10000):
+        self.db_manager = db_manager
+        self.max_batch_size = max_batch_size
+        self.flush_interval_ms = flush_interval_ms
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue_size)
+        self._stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="search-analytics", daemon=True)
+        self._worker.start()
+        logger.info(f"Search analytics writer started (batch {max_batch_size}, every {flush_interval_ms} ms).")
+
+    def record(self, **search) -> bool:
+        """Queue one row (DatabaseManager.log_search keywords); returns False if it was dropped"""
+        try:
+            self._queue.put_nowait(search)
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            return False
+        with self._stats_lock:
+            self.enqueued += 1
+        return True
+
+    def _next_batch(self) -> List[Dict[str, Any]]:
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        try:
+            self.db_manager.log_searches_bulk(batch)
+        except Exception as e:
+            with self._stats_lock:
+                self.failed += len(batch)
+            logger.error(f"Failed to write {len(batch)} search analytics rows: {e}")
+            return
+        with self._stats_lock:
+            self.written += len(batch)
+            self.batches += 1
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+
+    def flush(self):
+        """Write everything queued so far on the calling thread"""
+        while True:
+            batch = []
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._write(batch)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'batches': self.batches,
+                'queue_depth': self._queue.qsize()
+            }
+
+    def close(self):
+        """Stop the writer thread and write the remaining rows"""
+        self._stop.set()
+        self._worker.join()
+        self.flush()
+        logger.info(f"Search analytics writer stopped ({self.written} rows written, {self.dropped} dropped).")
@@ -0,0 +1,160 @@
+"""
+Streaming on-disk format for ingested documents.
+
+A document is written as two files that are produced and consumed one chunk
+at a time, so memory stays flat regardless of document size:
+  <document_id>.jsonl   line 1: document header (document_id, title, source,
+                        model_name, embedding_dim, ...); then one JSON object
+                        per chunk, without its embedding
+  <document_id>.f32     raw little-endian float32 embeddings, row i belongs
+                        to chunk line i
+Legacy single-file <document_id>.json documents (embeddings as JSON lists)
+can still be read through the same reader.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FORMAT_NAME = "jsonl+f32"
+CHUNKS_SUFFIX = ".jsonl"
+EMBEDDINGS_SUFFIX = ".f32"
+LEGACY_SUFFIX = ".json"
+
+_FLOAT32_LE = np.dtype("<f4")
+
+
+class ChunkStreamWriter:
+    """
+    Writes one document incrementally. Output goes to temporary files that
+    replace <document_id>.jsonl/.f32 only when the writer is closed without
+    error, so readers never see a half-written document.
+    """
+
+    def __init__(self, output_dir: Union[str, Path], header: Dict[str, Any]):
+        if 'document_id' not in header or 'embedding_dim' not in header:
+            raise ValueError("Document header requires 'document_id' and 'embedding_dim'")
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.header = dict(header, format=FORMAT_NAME)
+        self.dim = int(header['embedding_dim'])
+        self.chunks_path = self.output_dir / f"{header['document_id']}{CHUNKS_SUFFIX}"
+        self.embeddings_path = self.output_dir / f"{header['document_id']}{EMBEDDINGS_SUFFIX}"
+        self._chunks_tmp = self.chunks_path.with_name(self.chunks_path.name + ".tmp")
+        self._embeddings_tmp = self.embeddings_path.with_name(self.embeddings_path.name + ".tmp")
+        self._chunks_file = open(self._chunks_tmp, "w", encoding="utf-8")
+        self._embeddings_file = open(self._embeddings_tmp, "wb")
+        self._chunks_file.write(json.dumps(self.header, ensure_ascii=False) + "\n")
+        self.count = 0
+
+    def write(self, chunk: Dict[str, Any], embedding: np.ndarray):
+        """Append one chunk (any 'embedding' key in it is ignored) and its vector"""
+        self.write_batch([chunk], np.asarray(embedding).reshape(1, -1))
+
+    def write_batch(self, chunks: List[Dict[str, Any]], embeddings: np.ndarray):
+        """Append several chunks and their (len(chunks), dim) embedding matrix"""
+        embeddings = np.asarray(embeddings, dtype=_FLOAT32_LE)
+        if embeddings.shape != (len(chunks), self.dim):
+            raise ValueError(f"Expected embeddings of shape ({len(chunks)}, {self.dim}), got {embeddings.shape}")
+        for chunk in chunks:
+            record = {key: value for key, value in chunk.items() if key != 'embedding'}
+            self._chunks_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._embeddings_file.write(np.ascontiguousarray(embeddings).tobytes())
+        self.count += len(chunks)
+
+    def close(self, commit: bool = True):
+        """Close the files and publish them (commit=True) or discard them"""
+        self._chunks_file.close()
+        self._embeddings_file.close()
+        if commit:
+            # Sidecar first: a .jsonl is only ever visible next to a complete .f32
+            os.replace(self._embeddings_tmp, self.embeddings_path)
+            os.replace(self._chunks_tmp, self.chunks_path)
+        else:
+            for tmp_path in (self._chunks_tmp, self._embeddings_tmp):
+                if tmp_path.exists():
+                    tmp_path.unlink()
+
+    def __enter__(self) -> "ChunkStreamWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(commit=exc_type is None)
+
+
+class ChunkStreamReader:
+    """
+    Reads a document written by ChunkStreamWriter (or a legacy .json file).
+    The header is available immediately; chunks are yielded lazily together
+    with their embedding, which is read from a memory-mapped sidecar.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._legacy = self.path.suffix == LEGACY_SUFFIX
+        if self._legacy:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._legacy_data = json.load(f)
+            self.header = {key: value for key, value in self._legacy_data.items() if key != 'chunks'}
+        else:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.header = json.loads(f.readline())
+            self.embeddings_path = self.path.with_suffix(EMBEDDINGS_SUFFIX)
+
+    def _embeddings(self) -> np.ndarray:
+        dim = int(self.header['embedding_dim'])
+        if os.path.getsize(self.embeddings_path) == 0:
+            return np.zeros((0, dim), dtype=_FLOAT32_LE)
+        return np.memmap(self.embeddings_path, dtype=_FLOAT32_LE, mode="r").reshape(-1, dim)
+
+    def __iter__(self) -> Iterator[Tuple[Dict[str, Any], Optional[np.ndarray]]]:
+        """Yield (chunk, embedding) pairs; embedding is None if the chunk has none"""
+        if self._legacy:
+            for chunk in self._legacy_data.get("chunks", []):
+                embedding = chunk.pop("embedding", None)
+                yield chunk, (np.asarray(embedding, dtype=np.float32) if embedding is not None else None)
+            return
+
+        embeddings = self._embeddings()
+        with open(self.path, "r", encoding="utf-8") as f:
+            f.readline()  # header
+            row = -1
+            for line in f:
+                if not line.strip():
+                    continue
+                row += 1
+                if row >= len(embeddings):
+                    logger.warning(f"{self.embeddings_path.name} has no vector for chunk #{row} of {self.path.name}")
+                    yield json.loads(line), None
+                    continue
+                yield json.loads(line), np.array(embeddings[row], dtype=np.float32)
+
+    def iter_batches(self, batch_size: int = 500) -> Iterator[Tuple[List[Dict[str, Any]], List[Optional[np.ndarray]]]]:
+        """Yield lists of up to batch_size chunks with their embeddings"""
+        chunks, embeddings = [], []
+        for chunk, embedding in self:
+            chunks.append(chunk)
+            embeddings.append(embedding)
+            if len(chunks) >= batch_size:
+                yield chunks, embeddings
+                chunks, embeddings = [], []
+        if chunks:
+            yield chunks, embeddings
+
+
+def find_ingested_documents(directory: Union[str, Path]) -> List[Path]:
+    """
+    List the ingested documents in a directory. A legacy .json file is skipped
+    when the same document also exists in the streaming format.
+    """
+    directory = Path(directory)
+    streamed = sorted(directory.glob(f"*{CHUNKS_SUFFIX}"))
+    stems = {path.stem for path in streamed}
+    legacy = [path for path in sorted(directory.glob(f"*{LEGACY_SUFFIX}")) if path.stem not in stems]
+    return streamed + legacy
@@ -6,14 +6,70 @@ Handles SQLite operations, schema creation, and data management
 import sqlite3
 import json
 import logging
-from typing import List, Dict, Any, Optional, Tuple
+import struct
+from typing import List, Dict, Any, Optional, Tuple, Union
 from pathlib import Path
 from datetime import datetime
 from contextlib import contextmanager
 import threading
 
+import numpy as np
+
 logger = logging.getLogger(__name__)
 
+# Embeddings are stored as a BLOB: an 8-byte header (magic, dtype code, dim)
+# followed by the raw little-endian float32 values.
+EMBEDDING_BLOB_MAGIC = b"EMB"
+EMBEDDING_DTYPE_FLOAT32 = 1
+_EMBEDDING_HEADER = struct.Struct("<3sBI")
+
+# Every chunks column except the (large) embedding; the default projection for reads
+CHUNK_COLUMNS = [
+    'id', 'chunk_id', 'document_id', 'title', 'source', 'version', 'language',
+    'text', 'tokens', 'heading', 'heading_level', 'section_index', 'section_chunk_index',
+    'start_page', 'end_page', 'is_active', 'invalidated_by', 'access_roles',
+    'confidentiality_level', 'author', 'category', 'keywords', 'summary', 'metadata',
+    'created_at', 'updated_at', 'last_accessed'
+]
+
+
+def _projection(columns: Optional[List[str]]) -> str:
+    """Build a validated SELECT column list for the chunks table"""
+    if not columns:
+        columns = CHUNK_COLUMNS
+    unknown = set(columns) - set(CHUNK_COLUMNS) - {'embedding'}
+    if unknown:
+        raise ValueError(f"Unknown chunk columns: {sorted(unknown)}")
+    return ', '.join(columns)
+
+
+def encode_embedding(vector: Union[List[float], np.ndarray]) -> bytes:
+    """Serialize an embedding vector to the binary BLOB format"""
+    array = np.asarray(vector, dtype="<f4").reshape(-1)
+    header = _EMBEDDING_HEADER.pack(EMBEDDING_BLOB_MAGIC, EMBEDDING_DTYPE_FLOAT32, array.shape[0])
+    return header + array.tobytes()
+
+
+def decode_embedding(data: Union[bytes, str]) -> np.ndarray:
+    """
+    Deserialize an embedding stored in the chunks table.
+    Accepts the binary BLOB format and, for rows that have not been
+    migrated yet, the legacy JSON text format.
+    """
+    if isinstance(data, str):
+        return np.asarray(json.loads(data), dtype="float32")
+
+    if len(data) < _EMBEDDING_HEADER.size:
+        raise ValueError("Embedding blob is shorter than its header")
+
+    magic, dtype_code, dim = _EMBEDDING_HEADER.unpack_from(data)
+    if magic != EMBEDDING_BLOB_MAGIC or dtype_code != EMBEDDING_DTYPE_FLOAT32:
+        raise ValueError("Unknown embedding blob format")
+    if len(data) != _EMBEDDING_HEADER.size + 4 * dim:
+        raise ValueError(f"Embedding blob length does not match dim={dim}")
+
+    return np.frombuffer(data, dtype="<f4", count=dim, offset=_EMBEDDING_HEADER.size)
+
 class DatabaseManager:
     """Thread-safe SQLite database manager for RAG system"""
     
@@ -21,6 +77,7 @@ class DatabaseManager:
         self.db_path = Path(db_path)
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
         self._local = threading.local()
+        self._change_listeners = []
         self.init_database()
         logger.info(f"Database initialized at: {self.db_path}")
     
@@ -40,6 +97,23 @@ class DatabaseManager:
         
         return self._local.connection
     
+    def add_change_listener(self, listener):
+        """
+        Register a callback invoked as listener(event, **payload) after a chunk
+        write is committed. Events: 'insert', 'update', 'soft_delete', 'restore'.
+        Every payload carries the data generation the write committed as, so a
+        listener can tell whether other writers committed in between.
+        """
+        self._change_listeners.append(listener)
+    
+    def _notify_change(self, event: str, **payload):
+        """Dispatch a change event to all registered listeners"""
+        for listener in self._change_listeners:
+            try:
+                listener(event, **payload)
+            except Exception as e:
+                logger.error(f"Change listener failed for '{event}' event: {e}", exc_info=True)
+    
     @contextmanager
     def get_cursor(self):
         """Context manager for database operations"""
@@ -93,8 +167,8 @@ class DatabaseManager:
             summary TEXT DEFAULT '',
             metadata TEXT DEFAULT '{}',
             
-            -- Embedding for rebuild capability
-            embedding TEXT,
+            -- Embedding for rebuild capability (binary float32, see encode_embedding)
+            embedding BLOB,
             
             -- Timestamps
             created_at TEXT DEFAULT CURRENT_TIMESTAMP,
@@ -154,13 +228,24 @@ class DatabaseManager:
             user_id TEXT,
             timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
             feedback_score INTEGER DEFAULT NULL,
-            session_id TEXT
+            session_id TEXT,
+            stage_timings TEXT
+        );
+        """
+        
+        # Key/value state, e.g. the data generation counter used by result caches
+        system_state_table = """
+        CREATE TABLE IF NOT EXISTS system_state (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
         );
         """
         
         # Create indexes for performance
         indexes = [
             "CREATE INDEX IF NOT EXISTS idx_chunks_active ON chunks(is_active);",
+            # Covering index: active-id scans and id hydration filters are answered from the index
+            "CREATE INDEX IF NOT EXISTS idx_chunks_active_id ON chunks(is_active, invalidated_by, id);",
             "CREATE INDEX IF NOT EXISTS idx_chunks_chunk_id ON chunks(chunk_id);",
             "CREATE INDEX IF NOT EXISTS idx_chunks_document_id ON chunks(document_id);",
             "CREATE INDEX IF NOT EXISTS idx_chunks_version ON chunks(version);",
@@ -177,22 +262,59 @@ class DatabaseManager:
             cursor.execute(audit_table)
             cursor.execute(documents_table)
             cursor.execute(search_analytics)
+            # Databases created before per-stage timings were logged
+            cursor.execute("PRAGMA table_info(search_analytics)")
+            if 'stage_timings' not in {row['name'] for row in cursor.fetchall()}:
+                cursor.execute("ALTER TABLE search_analytics ADD COLUMN stage_timings TEXT")
+            cursor.execute(system_state_table)
+            cursor.execute("INSERT OR IGNORE INTO system_state (key, value) VALUES ('data_generation', 0)")
             
             for index_sql in indexes:
                 cursor.execute(index_sql)
         
         logger.info("Database schema initialized successfully")
     
-    def insert_chunk(self, chunk_data: Dict[str, Any]) -> int:
-        """Insert a new chunk and return its ID"""
+    def _bump_generation(self, cursor: sqlite3.Cursor) -> int:
+        """Advance the data generation inside the caller's write transaction and return it"""
+        cursor.execute("UPDATE system_state SET value = value + 1 WHERE key = 'data_generation'")
+        cursor.execute("SELECT value FROM system_state WHERE key = 'data_generation'")
+        return cursor.fetchone()[0]
+    
+    def get_generation(self) -> int:
+        """
+        Current data generation. It changes on every chunk write and on restore,
+        and is shared by all processes using this database file.
+        """
+        with self.get_cursor() as cursor:
+            cursor.execute("SELECT value FROM system_state WHERE key = 'data_generation'")
+            row = cursor.fetchone()
+            return row[0] if row else 0
+    
+    _INSERT_CHUNK_SQL = """
+        INSERT INTO chunks (
+            chunk_id, document_id, title, source, version, language,
+            text, tokens, heading, heading_level, section_index, section_chunk_index,
+            start_page, end_page, access_roles, confidentiality_level,
+            author, category, keywords, summary, metadata, embedding
+        ) VALUES (
+            :chunk_id, :document_id, :title, :source, :version, :language,
+            :text, :tokens, :heading, :heading_level, :section_index, :section_chunk_index,
+            :start_page, :end_page, :access_roles, :confidentiality_level,
+            :author, :category, :keywords, :summary, :metadata, :embedding
+        )
+        """
+    
+    @staticmethod
+    def _prepare_chunk_row(chunk_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Fill defaults and serialize embedding/list/dict fields for the chunks table (in place)"""
         
         # Prepare data with defaults
         chunk_data.setdefault('created_at', datetime.now().isoformat())
         chunk_data.setdefault('updated_at', datetime.now().isoformat())
         
-        # Convert lists/dicts to JSON strings
-        if 'embedding' in chunk_data and isinstance(chunk_data['embedding'], list):
-            chunk_data['embedding'] = json.dumps(chunk_data['embedding'])
+        # Convert embeddings to binary and lists/dicts to JSON strings
+        if 'embedding' in chunk_data and isinstance(chunk_data['embedding'], (list, np.ndarray)):
+            chunk_data['embedding'] = encode_embedding(chunk_data['embedding'])
         
         if 'access_roles' in chunk_data and isinstance(chunk_data['access_roles'], list):
             chunk_data['access_roles'] = json.dumps(chunk_data['access_roles'])
@@ -203,26 +325,89 @@ class DatabaseManager:
         if 'metadata' in chunk_data and isinstance(chunk_data['metadata'], dict):
             chunk_data['metadata'] = json.dumps(chunk_data['metadata'])
         
-        insert_sql = """
-        INSERT INTO chunks (
-            chunk_id, document_id, title, source, version, language,
-            text, tokens, heading, heading_level, section_index, section_chunk_index,
-            start_page, end_page, access_roles, confidentiality_level,
-            author, category, keywords, summary, metadata, embedding
-        ) VALUES (
-            :chunk_id, :document_id, :title, :source, :version, :language,
-            :text, :tokens, :heading, :heading_level, :section_index, :section_chunk_index,
-            :start_page, :end_page, :access_roles, :confidentiality_level,
-            :author, :category, :keywords, :summary, :metadata, :embedding
-        )
-        """
+        return chunk_data
+    
+    def insert_chunk(self, chunk_data: Dict[str, Any]) -> int:
+        """Insert a new chunk and return its ID"""
+        self._prepare_chunk_row(chunk_data)
         
         with self.get_cursor() as cursor:
-            cursor.execute(insert_sql, chunk_data)
+            cursor.execute(self._INSERT_CHUNK_SQL, chunk_data)
             chunk_id = cursor.lastrowid
+            generation = self._bump_generation(cursor)
+        
+        logger.debug(f"Inserted chunk {chunk_data.get('chunk_id')} with ID {chunk_id}")
+        self._notify_change('insert', id=chunk_id, chunk=chunk_data, generation=generation)
+        return chunk_id
+    
+    def insert_chunks_bulk(self, chunks: List[Dict[str, Any]], batch_size: int = 500) -> List[int]:
+        """
+        Insert many chunks and return their IDs in input order.
+        Rows are written with executemany in one transaction per batch_size rows,
+        so a failing batch (e.g. a duplicate chunk_id) is rolled back as a whole.
+        """
+        row_ids: List[int] = []
+        for start in range(0, len(chunks), batch_size):
+            batch = [self._prepare_chunk_row(chunk) for chunk in chunks[start:start + batch_size]]
+            chunk_ids = [chunk['chunk_id'] for chunk in batch]
+            
+            with self.get_cursor() as cursor:
+                cursor.executemany(self._INSERT_CHUNK_SQL, batch)
+                # executemany does not expose per-row lastrowid; chunk_id is UNIQUE
+                placeholders = ",".join("?" * len(chunk_ids))
+                cursor.execute(f"SELECT id, chunk_id FROM chunks WHERE chunk_id IN ({placeholders})", chunk_ids)
+                id_by_chunk = {row['chunk_id']: row['id'] for row in cursor.fetchall()}
+                generation = self._bump_generation(cursor)
+            
+            batch_ids = [id_by_chunk[chunk_id] for chunk_id in chunk_ids]
+            for row_id, chunk in zip(batch_ids, batch):
+                self._notify_change('insert', id=row_id, chunk=chunk, generation=generation)
+            row_ids.extend(batch_ids)
+        
+        logger.debug(f"Bulk inserted {len(row_ids)} chunks")
+        return row_ids
+    
+    def update_chunk(self, chunk_data: Dict[str, Any], reason: str = "", user_id: str = "system") -> Optional[int]:
+        """
+        Replace the content of an existing chunk (matched by chunk_id) in place and
+        reactivate it. The row ID (and therefore the FAISS ID) is kept; returns it,
+        or None if the chunk does not exist.
+        """
+        self._prepare_chunk_row(chunk_data)
+        chunk_data['updated_at'] = datetime.now().isoformat()
+        
+        with self.get_cursor() as cursor:
+            cursor.execute("SELECT * FROM chunks WHERE chunk_id = ?", (chunk_data['chunk_id'],))
+            old_data = cursor.fetchone()
+            if not old_data:
+                logger.warning(f"Chunk {chunk_data['chunk_id']} not found for update")
+                return None
             
-            logger.debug(f"Inserted chunk {chunk_data.get('chunk_id')} with ID {chunk_id}")
-            return chunk_id
+            cursor.execute("""
+                UPDATE chunks SET
+                    document_id = :document_id, title = :title, source = :source, version = :version,
+                    language = :language, text = :text, tokens = :tokens, heading = :heading,
+                    heading_level = :heading_level, section_index = :section_index,
+                    section_chunk_index = :section_chunk_index, start_page = :start_page, end_page = :end_page,
+                    access_roles = :access_roles, confidentiality_level = :confidentiality_level,
+                    author = :author, category = :category, keywords = :keywords, summary = :summary,
+                    metadata = :metadata, embedding = :embedding,
+                    is_active = 1, invalidated_by = NULL, updated_at = :updated_at
+                WHERE chunk_id = :chunk_id
+            """, chunk_data)
+            generation = self._bump_generation(cursor)
+            
+            # Audit log (the binary embedding is not JSON serializable and not needed here)
+            old_values = {key: old_data[key] for key in old_data.keys() if key != 'embedding'}
+            new_values = {key: value for key, value in chunk_data.items() if key != 'embedding'}
+            cursor.execute("""
+                INSERT INTO audit_log (table_name, record_id, action, old_values, new_values, reason, user_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, ('chunks', old_data['id'], 'UPDATE', json.dumps(old_values), json.dumps(new_values), reason, user_id))
+        
+        logger.debug(f"Updated chunk {chunk_data['chunk_id']} (ID {old_data['id']})")
+        self._notify_change('update', id=old_data['id'], chunk=chunk_data, generation=generation)
+        return old_data['id']
     
     def get_active_chunks(self, document_id: Optional[str] = None) -> List[sqlite3.Row]:
         """Get all active chunks, optionally filtered by document"""
@@ -243,15 +428,19 @@ class DatabaseManager:
             cursor.execute(base_sql, params)
             return cursor.fetchall()
     
-    def get_chunks_by_ids(self, chunk_ids: List[int]) -> Dict[int, sqlite3.Row]:
-        """Get chunks by their database IDs"""
+    def get_chunks_by_ids(self, chunk_ids: List[int],
+                          columns: Optional[List[str]] = None) -> Dict[int, sqlite3.Row]:
+        """Get chunks by their database IDs (all columns except the embedding unless requested)"""
         
         if not chunk_ids:
             return {}
         
+        if columns and 'id' not in columns:
+            columns = ['id'] + list(columns)
+        
         placeholders = ','.join(['?' for _ in chunk_ids])
         sql = f"""
-        SELECT * FROM chunks 
+        SELECT {_projection(columns)} FROM chunks 
         WHERE id IN ({placeholders})
         AND is_active = 1 
         AND invalidated_by IS NULL
@@ -283,8 +472,10 @@ class DatabaseManager:
                     updated_at = ?
                 WHERE chunk_id = ?
             """, (invalidated_by, datetime.now().isoformat(), chunk_id))
+            generation = self._bump_generation(cursor)
             
-            # Audit log
+            # Audit log (the binary embedding is not JSON serializable and not needed here)
+            old_values = {key: old_data[key] for key in old_data.keys() if key != 'embedding'}
             cursor.execute("""
                 INSERT INTO audit_log (table_name, record_id, action, old_values, reason, user_id)
                 VALUES (?, ?, ?, ?, ?, ?)
@@ -292,33 +483,55 @@ class DatabaseManager:
                 'chunks', 
                 old_data['id'], 
                 'SOFT_DELETE',
-                json.dumps(dict(old_data)),
+                json.dumps(old_values),
                 reason,
                 user_id
             ))
             
-            logger.info(f"Soft deleted chunk {chunk_id}")
-            return True
+        logger.info(f"Soft deleted chunk {chunk_id}")
+        self._notify_change('soft_delete', id=old_data['id'], chunk_id=chunk_id, generation=generation)
+        return True
+    
+    _INSERT_SEARCH_SQL = """
+        INSERT INTO search_analytics (
+            query_text, query_embedding_hash, results_count, top_chunk_ids, 
+            search_time_ms, user_id, session_id, stage_timings
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """
     
     def log_search(self, query_text: str, results_count: int, 
-                  search_time_ms: int, top_chunk_ids: List[int],
-                  user_id: Optional[str] = None, session_id: Optional[str] = None):
+                  search_time_ms: int, top_chunk_ids: List[Any],
+                  user_id: Optional[str] = None, session_id: Optional[str] = None,
+                  query_embedding_hash: Optional[str] = None,
+                  stage_timings: Optional[Dict[str, float]] = None):
         """Log search analytics"""
         
+        self.log_searches_bulk([{
+            'query_text': query_text,
+            'results_count': results_count,
+            'search_time_ms': search_time_ms,
+            'top_chunk_ids': top_chunk_ids,
+            'user_id': user_id,
+            'session_id': session_id,
+            'query_embedding_hash': query_embedding_hash,
+            'stage_timings': stage_timings
+        }])
+    
+    def log_searches_bulk(self, searches: List[Dict[str, Any]]):
+        """Insert many search_analytics rows (log_search keyword dicts) in one transaction"""
+        
+        rows = [(
+            search['query_text'],
+            search.get('query_embedding_hash'),
+            search.get('results_count'),
+            json.dumps(search.get('top_chunk_ids') or [], ensure_ascii=False),
+            search.get('search_time_ms'),
+            search.get('user_id'),
+            search.get('session_id'),
+            json.dumps(search['stage_timings']) if search.get('stage_timings') else None
+        ) for search in searches]
         with self.get_cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO search_analytics (
-                    query_text, results_count, top_chunk_ids, 
-                    search_time_ms, user_id, session_id
-                ) VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                query_text,
-                results_count, 
-                json.dumps(top_chunk_ids),
-                search_time_ms,
-                user_id,
-                session_id
-            ))
+            cursor.executemany(self._INSERT_SEARCH_SQL, rows)
     
     def get_database_stats(self) -> Dict[str, Any]:
         """Get database statistics"""
@@ -377,6 +590,38 @@ class DatabaseManager:
             
             logger.info(f"Cleaned up logs older than {days} days")
     
+    def migrate_embeddings_to_blob(self, batch_size: int = 500) -> int:
+        """Convert legacy JSON text embeddings to the binary format in place"""
+        
+        migrated = 0
+        
+        while True:
+            with self.get_cursor() as cursor:
+                cursor.execute("""
+                    SELECT id, embedding FROM chunks
+                    WHERE typeof(embedding) = 'text' AND embedding != ''
+                    LIMIT ?
+                """, (batch_size,))
+                rows = cursor.fetchall()
+                
+                if not rows:
+                    break
+                
+                updates = []
+                for row in rows:
+                    try:
+                        updates.append((encode_embedding(decode_embedding(row['embedding'])), row['id']))
+                    except (json.JSONDecodeError, TypeError, ValueError) as e:
+                        # Clear unreadable embeddings so the loop always terminates
+                        logger.warning(f"Invalid embedding for chunk row {row['id']}: {e}. Clearing it.")
+                        updates.append((None, row['id']))
+                
+                cursor.executemany("UPDATE chunks SET embedding = ? WHERE id = ?", updates)
+                migrated += len(updates)
+        
+        logger.info(f"Migrated {migrated} embeddings to binary format")
+        return migrated
+    
     def close_connections(self):
         """Close all database connections"""
         if hasattr(self._local, 'connection'):
@@ -409,6 +654,9 @@ class DatabaseManager:
         if not backup_path.exists():
             raise FileNotFoundError(f"Backup file not found: {backup_path}")
         
+        # Remember the generation so the restored database never reuses it
+        previous_generation = self.get_generation()
+        
         # Close existing connections
         self.close_connections()
         
@@ -416,7 +664,16 @@ class DatabaseManager:
         import shutil
         shutil.copy2(backup_path, self.db_path)
         
+        # Older backups may predate system_state
+        self.init_database()
+        with self.get_cursor() as cursor:
+            cursor.execute(
+                "UPDATE system_state SET value = MAX(value, ?) + 1 WHERE key = 'data_generation'",
+                (previous_generation,)
+            )
+        
         logger.info(f"Database restored from: {backup_path}")
+        self._notify_change('restore', generation=self.get_generation())
     
     def vacuum_database(self):
         """Vacuum database to reclaim space and optimize"""
@@ -449,6 +706,18 @@ class ChunkFilter:
         self.params[param_name] = value
         return self
     
+    def add_in_condition(self, field: str, values: List[Any]) -> 'ChunkFilter':
+        """Add a field IN (...) condition"""
+        param_names = []
+        for value in values:
+            param_name = f"{field}_{self.param_counter}"
+            param_names.append(f":{param_name}")
+            self.params[param_name] = value
+            self.param_counter += 1
+        
+        self.conditions.append(f"{field} IN ({', '.join(param_names)})")
+        return self
+    
     def add_text_search(self, text: str, fields: List[str] = None) -> 'ChunkFilter':
         """Add full-text search condition"""
         if not fields:
@@ -519,8 +788,6 @@ class DatabaseQueryBuilder:
     def __init__(self, db_manager: DatabaseManager):
         self.db = db_manager
     
-    # Thay thế hàm cũ trong lớp DatabaseQueryBuilder bằng hàm này
-
     def search_chunks_advanced(self, 
                             chunk_ids: Optional[List[int]] = None,
                             text_search: Optional[str] = None,
@@ -531,58 +798,61 @@ class DatabaseQueryBuilder:
                             date_to: Optional[str] = None,
                             limit: int = 100,
                             offset: int = 0,
-                            order_by: str = "updated_at DESC") -> List[sqlite3.Row]:
-        """Advanced chunk search with multiple filters"""
+                            order_by: str = "updated_at DESC",
+                            columns: Optional[List[str]] = None) -> List[sqlite3.Row]:
+        """
+        Advanced chunk search with multiple filters.
+        Callers declare the columns they need; by default every column except
+        the embedding is returned.
+        """
         
-        # Sử dụng filter_builder để xây dựng các điều kiện và tham số một cách an toàn
-        base_query = "SELECT * FROM chunks"
         filter_builder = ChunkFilter()
-
-        # Luôn thêm các điều kiện cơ bản
         filter_builder.add_condition("is_active", "=", 1)
         filter_builder.add_condition("invalidated_by", "IS", None)
-
-        # Thêm các bộ lọc tùy chọn
+        
         if chunk_ids:
-            # Xử lý an toàn cho danh sách ID
-            placeholders = ','.join(['?' for _ in chunk_ids])
-            # Thêm trực tiếp vào query string và params vì filter_builder không hỗ trợ tốt
-            # Đây là một cách tiếp cận khác, an toàn hơn
-            # Chúng ta sẽ xây dựng query mà không dùng filter_builder cho trường hợp này
-            
-            # Cách tiếp cận đơn giản và đúng đắn nhất
-            base_query_simple = "SELECT * FROM chunks"
-            conditions = ["is_active = 1", "invalidated_by IS NULL"]
-            params = []
-
-            if chunk_ids:
-                placeholders = ','.join(['?' for _ in chunk_ids])
-                conditions.append(f"id IN ({placeholders})")
-                params.extend(chunk_ids)
-            
-            if document_ids:
-                placeholders = ','.join(['?' for _ in document_ids])
-                conditions.append(f"document_id IN ({placeholders})")
-                params.extend(document_ids)
-
-            if categories:
-                placeholders = ','.join(['?' for _ in categories])
-                conditions.append(f"category IN ({placeholders})")
-                params.extend(categories)
-            
-            # Nối các điều kiện lại với nhau
-            if conditions:
-                final_query = f"{base_query_simple} WHERE {' AND '.join(conditions)}"
-            else:
-                final_query = base_query_simple
-
-            final_query += f" ORDER BY {order_by} LIMIT ? OFFSET ?"
-            params.extend([limit, offset])
-
-            # FIX: Thêm khối lệnh thực thi và trả về kết quả
-            with self.db.get_cursor() as cursor:
-                cursor.execute(final_query, params)
-                return cursor.fetchall()
+            filter_builder.add_in_condition("id", chunk_ids)
+        if text_search:
+            filter_builder.add_text_search(text_search)
+        if document_ids:
+            filter_builder.add_in_condition("document_id", document_ids)
+        if user_roles:
+            filter_builder.add_access_roles(user_roles)
+        if categories:
+            filter_builder.add_in_condition("category", categories)
+        if date_from or date_to:
+            filter_builder.add_date_range(date_from, date_to)
+        
+        query, params = filter_builder.build_query(f"SELECT {_projection(columns)} FROM chunks")
+        query += f" ORDER BY {order_by} LIMIT :limit OFFSET :offset"
+        params.update({'limit': limit, 'offset': offset})
+        
+        with self.db.get_cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+    
+    def get_eligible_chunk_ids(self,
+                               user_roles: Optional[List[str]] = None,
+                               document_ids: Optional[List[str]] = None,
+                               categories: Optional[List[str]] = None) -> List[int]:
+        """Get IDs of active chunks that pass the access and metadata filters"""
+        
+        filter_builder = ChunkFilter()
+        filter_builder.add_condition("is_active", "=", 1)
+        filter_builder.add_condition("invalidated_by", "IS", None)
+        
+        if user_roles:
+            filter_builder.add_access_roles(user_roles)
+        if document_ids:
+            filter_builder.add_in_condition("document_id", document_ids)
+        if categories:
+            filter_builder.add_in_condition("category", categories)
+        
+        query, params = filter_builder.build_query("SELECT id FROM chunks")
+        
+        with self.db.get_cursor() as cursor:
+            cursor.execute(query, params)
+            return [row[0] for row in cursor.fetchall()]
     
     def get_chunk_statistics(self, document_id: Optional[str] = None) -> Dict[str, Any]:
         """Get detailed statistics about chunks"""
@@ -638,7 +908,8 @@ class DatabaseQueryBuilder:
         cleanup_results = {
             'orphaned_chunks': 0,
             'duplicate_chunk_ids': 0,
-            'invalid_embeddings': 0
+            'invalid_embeddings': 0,
+            'legacy_json_embeddings': 0
         }
         
         with self.db.get_cursor() as cursor:
@@ -659,14 +930,20 @@ class DatabaseQueryBuilder:
             """)
             cleanup_results['duplicate_chunk_ids'] = len(cursor.fetchall())
             
-            # Find chunks with invalid embedding JSON
+            # Find chunks with malformed binary embeddings
             cursor.execute("""
                 SELECT COUNT(*) FROM chunks
-                WHERE embedding IS NOT NULL 
-                AND embedding != ''
-                AND json_valid(embedding) = 0
-            """)
+                WHERE typeof(embedding) = 'blob'
+                AND (length(embedding) <= ? OR (length(embedding) - ?) % 4 != 0)
+            """, (_EMBEDDING_HEADER.size, _EMBEDDING_HEADER.size))
             cleanup_results['invalid_embeddings'] = cursor.fetchone()[0]
+            
+            # Find chunks still stored as JSON text (need migrate_embeddings_to_blob)
+            cursor.execute("""
+                SELECT COUNT(*) FROM chunks
+                WHERE typeof(embedding) = 'text' AND embedding != ''
+            """)
+            cleanup_results['legacy_json_embeddings'] = cursor.fetchone()[0]
         
         return cleanup_results
 
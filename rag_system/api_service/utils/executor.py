@@ -0,0 +1,89 @@
+"""
+Execution layer for blocking search work.
+Runs encoder, FAISS and metadata stages on a bounded thread pool so the
+FastAPI event loop stays responsive, and rejects work when the queue is full.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+
+class SearchOverloadedError(Exception):
+    """Raised when the search queue is full and the request should be retried later"""
+
+
+class SearchExecutor:
+    """
+    Bounded thread pool for blocking search calls.
+    At most max_workers calls run concurrently and at most max_queue_depth
+    more wait for a worker; anything beyond that raises SearchOverloadedError.
+    Threads (not processes) are used because SentenceTransformer and FAISS
+    release the GIL during their heavy lifting and share the loaded model.
+    """
+
+    def __init__(self, max_workers: int = 4, max_queue_depth: int = 32):
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="search")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue_depth)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self._in_flight - self.max_workers)
+
+    async def run(self, fn: Callable[..., Any], *args,
+                  timings: Optional[Dict[str, float]] = None, **kwargs) -> Any:
+        """
+        Run fn(*args, **kwargs) on the pool. The time spent waiting for a worker
+        is recorded in timings['queue_wait'] (ms) when a timings dict is given.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise SearchOverloadedError(
+                f"Search queue is full ({self.max_workers} running, {self.max_queue_depth} queued)"
+            )
+
+        with self._lock:
+            self._in_flight += 1
+        submitted = time.perf_counter()
+
+        def task():
+            if timings is not None:
+                timings['queue_wait'] = (time.perf_counter() - submitted) * 1000
+                return fn(*args, timings=timings, **kwargs)
+            return fn(*args, **kwargs)
+
+        try:
+            future = self._pool.submit(task)
+        except BaseException:
+            self._release()
+            raise
+        # Released when fn has actually finished (or was cancelled before it started), not
+        # when the awaiting request goes away, so a disconnect does not free a busy worker's slot
+        future.add_done_callback(lambda _: self._release())
+        return await asyncio.wrap_future(future)
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+        logger.info("Search executor shut down.")
+
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    """Format stage timings (ms) as a Server-Timing header value"""
+    return ", ".join(f"{stage};dur={duration:.2f}" for stage, duration in timings.items())
@@ -0,0 +1,115 @@
+"""
+FAISS id scheme shared by the importer, scripts/rebuild_index.py, live index
+maintenance and the retriever.
+
+The FAISS id of a chunk is its chunks.id (SQLite INTEGER PRIMARY KEY): it is
+assigned once at insert, survives updates, restarts and rebuilds, and is the
+key the metadata store hydrates search results by. Never derive ids from
+hash(chunk_id): Python salts str hashes per process, so such ids differ on
+every run and match nothing.
+
+An index is consistent when it holds exactly one vector for every indexable
+chunk (active, not invalidated, with an embedding) and no other ids.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from rag_system.api_service.utils.database import DatabaseManager, decode_embedding
+
+logger = logging.getLogger(__name__)
+
+# Chunks that belong in the FAISS index
+INDEXABLE_CHUNKS_SQL = "is_active = 1 AND invalidated_by IS NULL AND embedding IS NOT NULL"
+
+
+def faiss_id(row_id: int) -> int:
+    """The FAISS id of the chunk stored at chunks.id = row_id"""
+    row_id = int(row_id)
+    if row_id <= 0:
+        raise ValueError(f"Invalid chunks.id {row_id}; FAISS ids are positive row ids.")
+    return row_id
+
+
+def lookup_faiss_ids(db_manager: DatabaseManager, chunk_ids: List[str]) -> Dict[str, int]:
+    """Map string chunk_ids to their FAISS ids (chunk_ids that are not stored are left out)"""
+    result: Dict[str, int] = {}
+    with db_manager.get_cursor() as cursor:
+        for start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[start:start + 500]
+            placeholders = ",".join("?" for _ in batch)
+            cursor.execute(f"SELECT id, chunk_id FROM chunks WHERE chunk_id IN ({placeholders})", batch)
+            result.update({row['chunk_id']: faiss_id(row['id']) for row in cursor.fetchall()})
+    return result
+
+
+def indexable_ids(db_manager: DatabaseManager) -> np.ndarray:
+    """Sorted FAISS ids of all chunks that belong in the index"""
+    with db_manager.get_cursor() as cursor:
+        cursor.execute(f"SELECT id FROM chunks WHERE {INDEXABLE_CHUNKS_SQL} ORDER BY id")
+        return np.asarray([row['id'] for row in cursor.fetchall()], dtype=np.int64)
+
+
+def load_active_embeddings(db_manager: DatabaseManager, dimension: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return (ids, vectors) of all indexable chunks. Rows whose dimension differs from
+    dimension (by default the dimension of the first row) are skipped.
+    """
+    with db_manager.get_cursor() as cursor:
+        cursor.execute(f"SELECT id, embedding FROM chunks WHERE {INDEXABLE_CHUNKS_SQL} ORDER BY id")
+        rows = cursor.fetchall()
+
+    ids, vectors = [], []
+    for row in rows:
+        vector = decode_embedding(row['embedding'])
+        if dimension is None:
+            dimension = vector.shape[0]
+        if vector.shape[0] != dimension:
+            logger.warning(f"Chunk row {row['id']} has dimension {vector.shape[0]}, expected {dimension}; skipped.")
+            continue
+        ids.append(faiss_id(row['id']))
+        vectors.append(vector)
+    if not vectors:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, dimension or 0), dtype=np.float32)
+    return np.asarray(ids, dtype=np.int64), np.vstack(vectors).astype(np.float32)
+
+
+def index_ids(index: faiss.Index) -> np.ndarray:
+    """The ids stored in an IndexIDMap/IndexIDMap2 or in the inverted lists of an IVF index"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.vector_to_array(index.id_map).astype(np.int64)
+    invlists = faiss.extract_index_ivf(index).invlists
+    lists = [faiss.rev_swig_ptr(invlists.get_ids(list_no), invlists.list_size(list_no)).astype(np.int64)
+             for list_no in range(invlists.nlist) if invlists.list_size(list_no)]
+    return np.concatenate(lists) if lists else np.zeros(0, dtype=np.int64)
+
+
+def diff_index_ids(index: faiss.Index, expected_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Compare the ids in an index with the ids it should hold. Returns (missing, stale,
+    duplicates): expected ids with no vector, stored ids that are not expected, and
+    ids stored more than once.
+    """
+    unique, counts = np.unique(index_ids(index), return_counts=True)
+    return np.setdiff1d(expected_ids, unique), np.setdiff1d(unique, expected_ids), unique[counts > 1]
+
+
+def check_index_ids(index: faiss.Index, db_manager: DatabaseManager, sample_size: int = 10) -> Dict[str, Any]:
+    """Id-map consistency report of an index against the indexable chunks in the database"""
+    expected = indexable_ids(db_manager)
+    missing, stale, duplicates = diff_index_ids(index, expected)
+    return {
+        'ntotal': int(index.ntotal),
+        'indexable_chunks': int(len(expected)),
+        'matched': int(len(expected) - len(missing)),
+        'missing': int(len(missing)),
+        'stale': int(len(stale)),
+        'duplicates': int(len(duplicates)),
+        'consistent': not (len(missing) or len(stale) or len(duplicates)),
+        'missing_sample': missing[:sample_size].tolist(),
+        'stale_sample': stale[:sample_size].tolist(),
+        'duplicate_sample': duplicates[:sample_size].tolist()
+    }
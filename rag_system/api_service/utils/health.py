@@ -0,0 +1,72 @@
+"""
+Background health diagnostics.
+DatabaseManager.health_check() scans whole tables (statistics, orphaned and
+malformed chunks), and the SQLite-backed caches count their rows, so these run
+on a schedule in a daemon thread and /health serves the latest snapshot;
+/livez and /readyz never touch SQLite.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from rag_system.api_service.utils.database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+
+class HealthMonitor:
+    """
+    Runs db_manager.health_check() and the optional named collectors (e.g. cache
+    stats) every interval_seconds and caches the results as one snapshot.
+    """
+
+    def __init__(self, db_manager: DatabaseManager, interval_seconds: float = 300.0,
+                 collectors: Optional[Dict[str, Callable[[], Any]]] = None):
+        self.db_manager = db_manager
+        self.interval_seconds = interval_seconds
+        self.collectors = collectors or {}
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="health-check", daemon=True)
+        self._worker.start()
+        logger.info(f"Health monitor started (diagnostics every {interval_seconds}s).")
+
+    def refresh(self) -> Dict[str, Any]:
+        """Run the diagnostics now and replace the snapshot"""
+        started = time.perf_counter()
+        try:
+            database = self.db_manager.health_check()
+        except Exception as e:
+            database = {'status': 'error', 'issues': [f"Health check failed: {e}"], 'warnings': [], 'stats': {}}
+        snapshot = {'database': database}
+        for name, collect in self.collectors.items():
+            try:
+                snapshot[name] = collect()
+            except Exception as e:
+                snapshot[name] = {'error': str(e)}
+        snapshot['checked_at'] = datetime.now().isoformat()
+        snapshot['duration_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+        previous = self._snapshot
+        self._snapshot = snapshot
+        if previous is None or previous['database'].get('status') != database.get('status'):
+            log = logger.info if database.get('status') == 'healthy' else logger.warning
+            log(f"Database health: {database.get('status')} (issues: {database.get('issues')}, warnings: {database.get('warnings')})")
+        return snapshot
+
+    def snapshot(self) -> Dict[str, Any]:
+        """The latest diagnostics; the database status is 'pending' until the first run finishes"""
+        return self._snapshot or {'database': {'status': 'pending'}, 'checked_at': None}
+
+    def _run(self):
+        while True:
+            self.refresh()
+            if self._stop.wait(self.interval_seconds):
+                return
+
+    def close(self):
+        self._stop.set()
+        self._worker.join()
@@ -0,0 +1,148 @@
+"""
+FAISS index factory for the selectable INDEX_TYPE.
+
+All index types use inner product over normalized embeddings and are keyed by
+chunks.id:
+  flat       exact brute-force scan (IndexFlatIP)
+  ivf_flat   inverted lists over k-means cells, full vectors (IndexIVFFlat)
+  ivf_pq     inverted lists with product-quantized codes (IndexIVFPQ)
+  hnsw       graph index (IndexHNSWFlat); supports adds but not removals
+  sq8        8-bit scalar-quantized scan (IndexScalarQuantizer)
+IVF indexes store the ids in their inverted lists and are used directly; the
+other types are wrapped in IndexIDMap2. Types that need training are trained
+on (a sample of) the stored embeddings before they are filled.
+"""
+
+import logging
+import math
+from typing import Optional
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq8")
+TRAINED_INDEX_TYPES = ("ivf_flat", "ivf_pq", "sq8")
+
+# k-means wants ~39 points per centroid; more than this many training points adds little
+_POINTS_PER_CENTROID = 39
+_MAX_TRAINING_POINTS = 100_000
+
+
+def default_nlist(n_vectors: int) -> int:
+    """About 4 * sqrt(n) IVF cells, with at least 39 training points per cell"""
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // _POINTS_PER_CENTROID))
+
+
+def factory_string(index_type: str, dimension: int, n_vectors: int, nlist: int = 0,
+                   pq_m: int = 64, hnsw_m: int = 32) -> str:
+    """The faiss.index_factory description of an INDEX_TYPE"""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'. Expected one of {INDEX_TYPES}.")
+    nlist = nlist or default_nlist(n_vectors)
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    if index_type == "ivf_pq":
+        if dimension % pq_m:
+            raise ValueError(f"PQ sub-quantizers ({pq_m}) must divide the embedding dimension ({dimension}).")
+        return f"IVF{nlist},PQ{pq_m}"
+    if index_type == "hnsw":
+        return f"HNSW{hnsw_m},Flat"
+    return "SQ8"
+
+
+def build_index(vectors: np.ndarray, ids: np.ndarray, index_type: str = "flat",
+                dimension: Optional[int] = None, nlist: int = 0, pq_m: int = 64,
+                hnsw_m: int = 32, ef_construction: int = 200,
+                nprobe: int = 16, ef_search: int = 64) -> faiss.Index:
+    """
+    Build, train and fill an index of the given type from (ids, vectors).
+    With no vectors to train on, a trained type falls back to flat.
+    """
+    dimension = dimension or vectors.shape[1]
+    if index_type in TRAINED_INDEX_TYPES and len(vectors) == 0:
+        logger.warning(f"No embeddings to train a '{index_type}' index on; creating a flat index instead.")
+        index_type = "flat"
+    if index_type == "ivf_pq" and len(vectors) < 256:
+        raise ValueError(f"An ivf_pq index needs at least 256 training vectors, got {len(vectors)}.")
+
+    description = factory_string(index_type, dimension, len(vectors), nlist, pq_m, hnsw_m)
+    base_index = faiss.index_factory(dimension, description, faiss.METRIC_INNER_PRODUCT)
+    if index_type == "hnsw":
+        base_index.hnsw.efConstruction = ef_construction
+
+    if not base_index.is_trained:
+        sample = vectors
+        if len(vectors) > _MAX_TRAINING_POINTS:
+            rows = np.random.default_rng(0).choice(len(vectors), _MAX_TRAINING_POINTS, replace=False)
+            sample = vectors[np.sort(rows)]
+        logger.info(f"Training {description} on {len(sample)} embeddings...")
+        base_index.train(np.ascontiguousarray(sample, dtype=np.float32))
+
+    # IVF keeps ids in its inverted lists (and IndexIDMap cannot remove from it)
+    index = base_index if faiss.try_extract_index_ivf(base_index) else faiss.IndexIDMap2(base_index)
+    apply_search_defaults(index, nprobe=nprobe, ef_search=ef_search)
+    if len(vectors):
+        index.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), np.asarray(ids, dtype=np.int64))
+    logger.info(f"Built {description} index with {index.ntotal} vectors.")
+    return index
+
+
+def _base_index(index: faiss.Index) -> faiss.Index:
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def index_type_of(index: faiss.Index) -> str:
+    """The INDEX_TYPE an index was built as (the class name for anything else)"""
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(base, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base, faiss.IndexScalarQuantizer):
+        return "sq8"
+    if isinstance(base, faiss.IndexFlat):
+        return "flat"
+    return type(base).__name__
+
+
+def has_chunk_ids(index: faiss.Index) -> bool:
+    """Whether search results are external (chunk) ids rather than insertion positions"""
+    return isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) or faiss.try_extract_index_ivf(index) is not None
+
+
+def supports_remove(index: faiss.Index) -> bool:
+    """HNSW graphs cannot delete vectors; everything else built here can"""
+    return not isinstance(_base_index(index), faiss.IndexHNSW)
+
+
+def apply_search_defaults(index: faiss.Index, nprobe: int = 16, ef_search: int = 64):
+    """Set the index-wide nprobe/efSearch used when a request does not override them"""
+    base = _base_index(index)
+    ivf = faiss.try_extract_index_ivf(base)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    elif isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = ef_search
+
+
+def search_parameters(index: faiss.Index, selector: Optional[faiss.IDSelector] = None,
+                      nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> faiss.SearchParameters:
+    """
+    Per-search parameters: the id selector plus nprobe (IVF) or efSearch (HNSW),
+    falling back to the index-wide values. Ignored knobs are harmless.
+    """
+    base = _base_index(index)
+    ivf = faiss.try_extract_index_ivf(base)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=min(nprobe or ivf.nprobe, ivf.nlist))
+    if isinstance(base, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search or base.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
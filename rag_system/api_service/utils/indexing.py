@@ -0,0 +1,293 @@
+"""
+Live FAISS index maintenance.
+Applies DatabaseManager change events to the in-memory FAISS index as they
+happen (add_with_ids / remove_ids) and periodically persists the index with an
+atomic file replace, so the served index tracks SQLite without full rebuilds.
+Also provides the reference-counted index handle used for hot swaps and a
+watcher that swaps in index files rebuilt by other processes.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import faiss
+import numpy as np
+
+from rag_system.api_service.utils.database import DatabaseManager, decode_embedding
+from rag_system.api_service.utils.faiss_ids import load_active_embeddings
+from rag_system.api_service.utils.index_factory import index_type_of, supports_remove
+
+logger = logging.getLogger(__name__)
+
+# Read-only mapping of the stored vectors (IndexFlat codes and IVF lists) instead of a heap copy
+MMAP_IO_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+
+def read_index(index_path: str, mmap: bool = False) -> faiss.Index:
+    """Read a FAISS index, memory-mapped read-only when mmap is set"""
+    if mmap:
+        return faiss.read_index(index_path, MMAP_IO_FLAGS)
+    return faiss.read_index(index_path)
+
+
+class ReadWriteLock:
+    """
+    Many concurrent readers (searches) or one writer (index mutation).
+    Waiting writers block new readers so updates are not starved under load.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class IndexHandle:
+    """
+    A loaded FAISS index plus its own read/write lock and a reference count.
+    Searches acquire the current handle; once a swap retires it, the index is
+    released when the last in-flight search on it finishes.
+    """
+
+    def __init__(self, index: faiss.Index, generation: int = 0):
+        self.index = index
+        self.generation = generation
+        self.lock = ReadWriteLock()
+        self._refs = 0
+        self._retired = False
+        self._ref_lock = threading.Lock()
+
+    def acquire(self) -> "IndexHandle":
+        with self._ref_lock:
+            self._refs += 1
+        return self
+
+    def release(self):
+        with self._ref_lock:
+            self._refs -= 1
+            free = self._retired and self._refs == 0
+        if free:
+            self._free()
+
+    def retire(self):
+        """Mark the handle as replaced; frees the index now if no search is using it"""
+        with self._ref_lock:
+            self._retired = True
+            free = self._refs == 0
+        if free:
+            self._free()
+
+    def _free(self):
+        ntotal = self.index.ntotal if self.index is not None else 0
+        self.index = None
+        logger.info(f"Released retired FAISS index ({ntotal} vectors).")
+
+
+def write_index_atomic(index: faiss.Index, index_path: str):
+    """Write the index to a temporary file and rename it over index_path"""
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    tmp_path = f"{index_path}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, index_path)
+
+
+class FaissIndexMaintainer:
+    """
+    Keeps a HybridRetriever's FAISS index in sync with chunk writes.
+    Register handle_database_change as a DatabaseManager change listener; it
+    mutates the index under the retriever's index_lock (write side) while
+    searches hold the read side. A background thread persists the index every
+    persist_interval_seconds when it has changed.
+    Only writes made through this process's DatabaseManager are observed. The API
+    process itself does not write chunks, so chunks imported by scripts/import_data.py
+    reach a running API only when IndexFileWatcher hot-swaps the index file that the
+    importer wrote.
+    """
+
+    def __init__(self, retriever, db_manager: DatabaseManager, persist_interval_seconds: float = 60.0):
+        if retriever.mmap_index:
+            # Resizing a mapped index aborts inside FAISS instead of raising
+            raise ValueError("A memory-mapped FAISS index is read-only and cannot be maintained live.")
+        self.retriever = retriever
+        self.db_manager = db_manager
+        self.persist_interval_seconds = persist_interval_seconds
+        self.pending_changes = 0
+        self.applied_changes = 0
+        # Vectors left in an index that cannot remove (HNSW); searches skip them via the
+        # eligible-id selector and duplicates, and the next rebuild drops them
+        self.stale_vectors = 0
+        self.last_persisted_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._persist_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="faiss-index-persist", daemon=True)
+        self._worker.start()
+        logger.info(f"FAISS index maintainer started (persist every {persist_interval_seconds}s).")
+
+    def handle_database_change(self, event: str, **payload):
+        """DatabaseManager change listener applying chunk writes to the live index"""
+        if event == 'insert':
+            self._add(payload['id'], payload['chunk'].get('embedding'))
+        elif event == 'update':
+            self._remove(payload['id'])
+            self._add(payload['id'], payload['chunk'].get('embedding'))
+        elif event == 'soft_delete':
+            self._remove(payload['id'])
+        elif event == 'restore':
+            self.rebuild_from_database()
+
+    def _add(self, faiss_id: int, embedding):
+        if embedding is None:
+            logger.warning(f"Chunk row {faiss_id} has no embedding; not added to the FAISS index.")
+            return
+        vector = decode_embedding(embedding) if isinstance(embedding, (bytes, str)) else np.asarray(embedding, dtype=np.float32)
+        # index_update_lock keeps the current handle stable against a concurrent hot swap
+        with self.retriever.index_update_lock:
+            handle = self.retriever.index_handle
+            with handle.lock.write():
+                if vector.shape[0] != handle.index.d:
+                    logger.warning(f"Chunk row {faiss_id} has dimension {vector.shape[0]}, index has {handle.index.d}; not added.")
+                    return
+                handle.index.add_with_ids(vector.reshape(1, -1).astype(np.float32), np.asarray([faiss_id], dtype=np.int64))
+                self._mark_changed()
+
+    def _remove(self, faiss_id: int):
+        with self.retriever.index_update_lock:
+            handle = self.retriever.index_handle
+            if not supports_remove(handle.index):
+                self.stale_vectors += 1
+                return
+            with handle.lock.write():
+                removed = handle.index.remove_ids(np.asarray([faiss_id], dtype=np.int64))
+                if removed:
+                    self._mark_changed()
+
+    def _mark_changed(self):
+        self.pending_changes += 1
+        self.applied_changes += 1
+
+    def rebuild_from_database(self):
+        """Rebuild (and retrain) the index from all active chunks (used after a database restore)"""
+        dimension = self.retriever.faiss_index.d
+        ids, vectors = load_active_embeddings(self.db_manager, dimension)
+        index = self.retriever.build_index(ids, vectors)
+        with self.retriever.index_update_lock:
+            # New content (a new result cache generation), but the file on disk is unchanged
+            # until the next persist, so the watcher must not swap the old file back in
+            self.retriever.install_index(index, time.time_ns(),
+                                         file_generation=self.retriever.index_file_generation)
+            self.stale_vectors = 0
+            self._mark_changed()
+        logger.info(f"FAISS index rebuilt from database with {index.ntotal} vectors.")
+
+    def persist(self, force: bool = False) -> bool:
+        """Atomically write the index to disk if it changed since the last persist"""
+        with self._persist_lock, self.retriever.index_update_lock:
+            if not self.pending_changes and not force:
+                return False
+            index_path = self.retriever.faiss_index_path
+            handle = self.retriever.index_handle
+            # Read side: searches continue, mutations wait until the snapshot is written
+            with handle.lock.read():
+                changes = self.pending_changes
+                write_index_atomic(handle.index, index_path)
+            self.pending_changes -= changes
+            self.last_persisted_at = time.time()
+            # Our own write is not a new index for the file watcher. The content is unchanged,
+            # so index_generation (part of the result cache key) stays as it is
+            self.retriever.index_file_generation = self.retriever._index_file_generation(index_path)
+        logger.info(f"FAISS index persisted to {index_path} ({changes} changes).")
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.persist_interval_seconds):
+            try:
+                self.persist()
+            except Exception as e:
+                logger.error(f"Failed to persist FAISS index: {e}", exc_info=True)
+
+    def stats(self):
+        return {
+            'pending_changes': self.pending_changes,
+            'applied_changes': self.applied_changes,
+            'last_persisted_at': self.last_persisted_at,
+            'stale_vectors': self.stale_vectors,
+            'index_type': index_type_of(self.retriever.faiss_index),
+            'ntotal': self.retriever.faiss_index.ntotal
+        }
+
+    def close(self):
+        """Stop the persist thread and write any pending changes"""
+        self._stop.set()
+        self._worker.join()
+        self.persist()
+        logger.info("FAISS index maintainer stopped.")
+
+
+class IndexFileWatcher:
+    """
+    Polls the retriever's index file and hot-swaps it in when it is replaced
+    by another process (e.g. scripts/rebuild_index.py or another worker's persist).
+    """
+
+    def __init__(self, retriever, poll_interval_seconds: float = 5.0):
+        self.retriever = retriever
+        self.poll_interval_seconds = poll_interval_seconds
+        self.last_error: Optional[str] = None
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="faiss-index-watcher", daemon=True)
+        self._worker.start()
+        logger.info(f"Watching {retriever.faiss_index_path} for new FAISS indexes every {poll_interval_seconds}s.")
+
+    def _run(self):
+        failed_generation = None
+        while not self._stop.wait(self.poll_interval_seconds):
+            path = self.retriever.faiss_index_path
+            generation = self.retriever._index_file_generation(path)
+            if generation in (0, self.retriever.index_file_generation, failed_generation):
+                continue
+            try:
+                self.retriever.update_faiss_index(path, only_if_changed=True)
+                self.last_error = None
+            except Exception as e:
+                # Do not retry the same file every poll; a newer file will be tried
+                failed_generation = generation
+                self.last_error = str(e)
+                logger.error(f"Hot swap of {path} rejected: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._worker.join()
@@ -0,0 +1,126 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+Search stage durations are aggregated into cumulative histograms (one series
+per stage), request outcomes into counters, and component state (executor,
+caches, analytics queue) is read through gauge callbacks when /metrics is
+scraped. No client library is needed; render() produces the scrape body.
+"""
+
+import bisect
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans a cached hit (<1 ms) to a cold encode under load
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value not in (float("inf"), float("-inf")) else ("+Inf" if value > 0 else "-Inf")
+
+
+class Histogram:
+    """Cumulative histogram with one series per label value"""
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[str, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, totals = self._series.setdefault(label_value, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[position] += 1
+            totals[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), totals[0]) for key, (counts, totals) in self._series.items()}
+        for label_value, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels({self.label: label_value, 'le': _format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels({self.label: label_value})
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter with one series per label value"""
+
+    def __init__(self, name: str, help_text: str, label: str):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value: str, amount: float = 1.0):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for label_value, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels({self.label: label_value})} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Search latency histograms, request counters and gauge callbacks"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.stage_seconds = Histogram(
+            "rag_search_stage_duration_seconds",
+            "Duration of each search pipeline stage (queue_wait, encode, faiss_search, bm25, hydrate, serialize, total, ...).",
+            "stage", buckets
+        )
+        self.requests = Counter("rag_search_requests_total", "Search requests by outcome.", "outcome")
+        self.results = Counter("rag_search_results_total", "Results returned by search requests.", "endpoint")
+        self._gauges: Dict[str, Tuple[str, Callable[[], Optional[float]]]] = {}
+
+    def observe_timings(self, timings: Dict[str, float]):
+        """Record a timings dict (stage -> milliseconds) as it is filled by the retriever and handler"""
+        for stage, milliseconds in timings.items():
+            self.stage_seconds.observe(stage, milliseconds / 1000.0)
+
+    def register_gauge(self, name: str, help_text: str, read: Callable[[], Optional[float]]):
+        """Expose read() as a gauge; it is called on every scrape and skipped when it returns None or fails"""
+        self._gauges[name] = (help_text, read)
+
+    def render(self) -> str:
+        lines = self.stage_seconds.render() + self.requests.render() + self.results.render()
+        for name, (help_text, read) in sorted(self._gauges.items()):
+            try:
+                value = read()
+            except Exception as e:
+                logger.debug(f"Gauge {name} failed: {e}")
+                continue
+            if value is None:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {_format_value(value)}"]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,200 @@
+"""
+Search result caches.
+Results are cached as JSON payloads under a key that includes the data and
+index generations, so any write or index swap makes older entries unreachable.
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+from rag_system.api_service.utils.sqlite_cache import AccessTimeBuffer, evict_if_over, init_size_tracking, total_bytes
+from rag_system.api_service.utils.text_processing import clean_text
+
+logger = logging.getLogger(__name__)
+
+
+def make_result_cache_key(query_text: str, top_k: int,
+                          user_roles: Optional[List[str]] = None,
+                          document_ids: Optional[List[str]] = None,
+                          categories: Optional[List[str]] = None,
+                          generation: Any = None,
+                          **options) -> str:
+    """
+    Build a cache key from the normalized request and the current generation. The query
+    keeps its casing, like the text the model encodes, so case variants do not share results.
+    """
+    payload = [
+        clean_text(query_text),
+        top_k,
+        sorted(user_roles or []),
+        sorted(document_ids or []),
+        sorted(categories or []),
+        generation,
+        sorted(options.items())
+    ]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class _CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class MemoryResultCache:
+    """Per-process LRU result cache bounded by the total size of cached payloads"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = _CacheStats()
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is None:
+                self._stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats.hits += 1
+        return json.loads(payload)
+
+    def put(self, key: str, results: List[Dict[str, Any]]):
+        payload = json.dumps(results, ensure_ascii=False)
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = payload
+            self._bytes += len(payload)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self._stats.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'backend': 'memory', 'entries': len(self._entries), 'bytes': self._bytes,
+                    'max_bytes': self.max_bytes, **self._stats.as_dict()}
+
+
+class SQLiteResultCache:
+    """
+    Result cache in a local SQLite file, shared by every uvicorn worker on the host.
+    Least recently used entries are evicted once the stored payloads exceed max_bytes
+    (see utils.sqlite_cache: trigger-maintained size total, buffered access times).
+    """
+
+    def __init__(self, db_path: str = "rag_system/data/result_cache.db", max_bytes: int = 64 * 1024 * 1024):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._stats = _CacheStats()
+        self._access = AccessTimeBuffer("result_cache")
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS result_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_result_cache_access ON result_cache(last_access)")
+        init_size_tracking(self._connection(), "result_cache")
+
+    def _connection(self) -> sqlite3.Connection:
+        if not hasattr(self._local, 'connection'):
+            self._local.connection = sqlite3.connect(str(self.db_path), timeout=5.0, check_same_thread=False)
+            self._local.connection.execute("PRAGMA journal_mode = WAL")
+            self._local.connection.execute("PRAGMA synchronous = NORMAL")
+        return self._local.connection
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        try:
+            row = self._connection().execute("SELECT payload FROM result_cache WHERE cache_key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Result cache read failed: {e}")
+            return None
+
+        if row is None:
+            self._stats.misses += 1
+            return None
+        self._stats.hits += 1
+        # The access time is buffered; reads do not take the write lock
+        if self._access.touch([key]):
+            self._flush_access_times()
+        return json.loads(row[0])
+
+    def _flush_access_times(self):
+        try:
+            with self._connection() as conn:
+                self._access.flush(conn)
+        except sqlite3.Error as e:
+            logger.warning(f"Result cache access time update failed: {e}")
+
+    def put(self, key: str, results: List[Dict[str, Any]]):
+        payload = json.dumps(results, ensure_ascii=False)
+        if len(payload) > self.max_bytes:
+            return
+        try:
+            with self._connection() as conn:
+                # Buffered access times go first so eviction sees recent hits
+                self._access.flush(conn)
+                # An upsert (not INSERT OR REPLACE) so the size triggers see the replaced row
+                conn.execute("""
+                    INSERT INTO result_cache (cache_key, payload, size, last_access)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(cache_key) DO UPDATE SET
+                        payload = excluded.payload, size = excluded.size, last_access = excluded.last_access
+                """, (key, payload, len(payload), time.time()))
+                self._stats.evictions += evict_if_over(conn, "result_cache", self.max_bytes)
+        except sqlite3.Error as e:
+            logger.warning(f"Result cache write failed: {e}")
+
+    def counters(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters of this process (in memory, no SQLite read)"""
+        return self._stats.as_dict()
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            conn = self._connection()
+            entries = conn.execute("SELECT COUNT(*) FROM result_cache").fetchone()[0]
+            total = total_bytes(conn, "result_cache")
+        except sqlite3.Error:
+            entries, total = None, None
+        return {'backend': 'sqlite', 'entries': entries, 'bytes': total,
+                'max_bytes': self.max_bytes, **self._stats.as_dict()}
+
+
+def create_result_cache(backend: str, max_bytes: int, db_path: str):
+    """Create the configured result cache; backend is 'memory', 'sqlite' or 'none'"""
+    if backend == "memory":
+        return MemoryResultCache(max_bytes=max_bytes)
+    if backend == "sqlite":
+        return SQLiteResultCache(db_path=db_path, max_bytes=max_bytes)
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown result cache backend: {backend}")
@@ -0,0 +1,115 @@
+"""
+Bookkeeping shared by the SQLite-backed LRU caches (search results, embeddings).
+
+A cache table needs cache_key, size and last_access columns. Its total size is
+kept in a one-row <table>_size table maintained by triggers, so every process
+sharing the file reads it without a SUM() scan. Once the total exceeds the
+budget, the least recently used rows are evicted in one batch down to a low-water
+mark. Access times of hits are buffered in memory and written in batches instead
+of one UPDATE per read.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable
+
+logger = logging.getLogger(__name__)
+
+# Eviction frees space down to this fraction of max_bytes, so it does not run on every write
+EVICT_LOW_WATER = 0.9
+
+
+def init_size_tracking(conn: sqlite3.Connection, table: str):
+    """Create the <table>_size row and the triggers keeping it equal to SUM(size)"""
+    size_table = f"{table}_size"
+    if conn.in_transaction:
+        conn.commit()
+    # One transaction, so no write from another process slips between the seed and the triggers
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {size_table} (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                total INTEGER NOT NULL
+            )
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_size_insert AFTER INSERT ON {table}
+            BEGIN UPDATE {size_table} SET total = total + NEW.size WHERE id = 0; END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_size_delete AFTER DELETE ON {table}
+            BEGIN UPDATE {size_table} SET total = total - OLD.size WHERE id = 0; END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_size_update AFTER UPDATE OF size ON {table}
+            BEGIN UPDATE {size_table} SET total = total + NEW.size - OLD.size WHERE id = 0; END
+        """)
+        # Files written before size tracking existed are measured once
+        conn.execute(f"INSERT OR IGNORE INTO {size_table} (id, total) SELECT 0, COALESCE(SUM(size), 0) FROM {table}")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def total_bytes(conn: sqlite3.Connection, table: str) -> int:
+    row = conn.execute(f"SELECT total FROM {table}_size WHERE id = 0").fetchone()
+    return row[0] if row else 0
+
+
+def evict_if_over(conn: sqlite3.Connection, table: str, max_bytes: int) -> int:
+    """
+    When the table holds more than max_bytes, delete the least recently used rows down to
+    EVICT_LOW_WATER * max_bytes. Runs inside the caller's write transaction; returns the
+    number of rows deleted.
+    """
+    total = total_bytes(conn, table)
+    if total <= max_bytes:
+        return 0
+    bytes_to_free = total - int(max_bytes * EVICT_LOW_WATER)
+    freed = 0
+    evicted = []
+    for cache_key, size in conn.execute(f"SELECT cache_key, size FROM {table} ORDER BY last_access"):
+        evicted.append((cache_key,))
+        freed += size
+        if freed >= bytes_to_free:
+            break
+    conn.executemany(f"DELETE FROM {table} WHERE cache_key = ?", evicted)
+    return len(evicted)
+
+
+class AccessTimeBuffer:
+    """
+    Last-access times of cache hits, held in memory until they are written as one
+    batch: from the next write transaction, or when max_pending keys or
+    flush_interval_seconds have accumulated.
+    """
+
+    def __init__(self, table: str, max_pending: int = 256, flush_interval_seconds: float = 1.0):
+        self.table = table
+        self.max_pending = max_pending
+        self.flush_interval_seconds = flush_interval_seconds
+        self._pending: Dict[str, float] = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def touch(self, keys: Iterable[str]) -> bool:
+        """Record a hit on keys; returns True when a flush is due"""
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                self._pending[key] = now
+            return (len(self._pending) >= self.max_pending
+                    or time.monotonic() - self._last_flush >= self.flush_interval_seconds)
+
+    def flush(self, conn: sqlite3.Connection):
+        """Write the buffered access times (inside the caller's transaction when it has one)"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if pending:
+            conn.executemany(f"UPDATE {self.table} SET last_access = MAX(last_access, ?) WHERE cache_key = ?",
+                             [(accessed, key) for key, accessed in pending.items()])
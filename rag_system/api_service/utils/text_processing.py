@@ -0,0 +1,56 @@
+"""
+Text normalization shared by ingestion and query processing.
+"""
+
+import hashlib
+import re
+import unicodedata
+from typing import List
+
+from pyvi import ViTokenizer
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def clean_text(text: str) -> str:
+    # Chuẩn hóa Unicode NFC
+    text = unicodedata.normalize("NFC", text)
+    # Loại bỏ BOM, zero-width space
+    text = text.replace("\ufeff", "").replace("\u200b", "")
+    # Thay nhiều khoảng trắng bằng 1
+    text = re.sub(r"\s+", " ", text)
+    return text.strip()
+
+
+def preprocess_vietnamese(text: str) -> str:
+    text = clean_text(text)
+    return ViTokenizer.tokenize(text)
+
+
+def tokenize_for_search(text: str) -> List[str]:
+    """Lowercased pyvi word tokens without punctuation (compound words keep their underscores)"""
+    return _WORD_PATTERN.findall(preprocess_vietnamese(text).lower())
+
+
+def query_hash(cleaned_query: str) -> str:
+    """
+    Stable hash of a clean_text()-ed query, the exact text the model encodes (query
+    embedding cache key, stored as search_analytics.query_embedding_hash)
+    """
+    return hashlib.sha256(cleaned_query.encode("utf-8")).hexdigest()
+
+
+def make_snippet(text: str, max_chars: int) -> str:
+    """The start of text cut to max_chars at a word boundary, with an ellipsis when shortened"""
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    boundary = cut.rfind(" ")
+    if boundary > max_chars // 2:
+        cut = cut[:boundary]
+    return cut.rstrip() + "…"
+
+
+def content_hash(text: str) -> str:
+    """Hash of a chunk's exact text, used to detect changed chunks between ingestion runs"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
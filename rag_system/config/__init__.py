@@ -7,7 +7,12 @@ import os
 import logging
 from pathlib import Path
 from typing import Optional, List
-from pydantic import BaseSettings, validator
+try:
+    # pydantic v2: settings live in the pydantic-settings package
+    from pydantic_settings import BaseSettings
+    from pydantic import field_validator as validator
+except ImportError:
+    from pydantic import BaseSettings, validator
 
 class Settings(BaseSettings):
     """Application settings with validation"""
@@ -20,18 +25,73 @@ class Settings(BaseSettings):
     # Database Settings
     DATABASE_PATH: str = "data/metadata.db"
     FAISS_INDEX_PATH: str = "data/indexes/faiss_index.idx"
-    BM25_INDEX_PATH: str = "data/indexes/bm25_index.pkl"
+    BM25_INDEX_PATH: str = "rag_system/data/indexes/bm25"  # directory of memory-mapped .npy arrays
+    # Memory-map the FAISS index read-only (shared page cache across workers, near-instant
+    # startup). A mapped index cannot be mutated, so live maintenance is disabled in this mode.
+    FAISS_MMAP: bool = False
+    # FAISS index type for indexes built by the API and scripts/rebuild_index.py:
+    # flat (exact), ivf_flat, ivf_pq, hnsw or sq8. Approximate types are trained on the stored embeddings.
+    INDEX_TYPE: str = "flat"
+    INDEX_NLIST: int = 0  # IVF cells; 0 = about 4 * sqrt(number of chunks)
+    INDEX_PQ_M: int = 64  # PQ sub-quantizers (must divide the embedding dimension)
+    INDEX_HNSW_M: int = 32
+    INDEX_HNSW_EF_CONSTRUCTION: int = 200
+    # Default search-time recall/latency knobs; /search can override them per request
+    INDEX_NPROBE: int = 16
+    INDEX_EF_SEARCH: int = 64
+    # /health serves database diagnostics (full-table scans) refreshed in the background this often
+    HEALTH_CHECK_INTERVAL_SECONDS: float = 300.0
+    # The resident chunk metadata store checks the shared data generation this often
+    # (writes by other processes); in-process writes trigger a reload right away
+    METADATA_STORE_REFRESH_INTERVAL_SECONDS: float = 1.0
+    # Live FAISS index maintenance: changed index is written to disk at most this often
+    FAISS_PERSIST_INTERVAL_SECONDS: float = 60.0
+    # The BM25 delta segment is merged into the on-disk index at most this often (and on shutdown)
+    BM25_PERSIST_INTERVAL_SECONDS: float = 300.0
+    # ...and checks the shared data generation this often, rebuilding after writes by other processes
+    BM25_SYNC_INTERVAL_SECONDS: float = 1.0
+    # Hot swap: poll the index file and swap in indexes rebuilt by other processes
+    FAISS_WATCH_INDEX_FILE: bool = True
+    FAISS_WATCH_INTERVAL_SECONDS: float = 5.0
     
     # Model Settings
     EMBEDDING_MODEL: str = "AITeamVN/Vietnamese_Embedding"
     EMBEDDING_DEVICE: str = "cuda" if os.getenv("CUDA_AVAILABLE") == "true" else "cpu"
     EMBEDDING_DIMENSION: int = 384
+    # Query micro-batching: wait up to N ms or M queries before one encode call
+    EMBEDDING_BATCH_MAX_WAIT_MS: float = 5.0
+    EMBEDDING_BATCH_MAX_SIZE: int = 32
+    # Query embedding cache (LRU + TTL)
+    QUERY_CACHE_MAX_SIZE: int = 1024
+    QUERY_CACHE_TTL_SECONDS: float = 3600.0
+    # Persistent embedding cache (SQLite, keyed by model name + normalized text hash)
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_PATH: str = "rag_system/data/embedding_cache.db"
+    EMBEDDING_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+    
+    # Search Result Cache Settings ("memory", "sqlite" to share across workers, or "none")
+    RESULT_CACHE_BACKEND: str = "memory"
+    RESULT_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RESULT_CACHE_PATH: str = "rag_system/data/result_cache.db"
     
     # Search Settings  
     DEFAULT_TOP_K: int = 5
     COMPENSATION_FACTOR: int = 3
     MAX_RETRIES: int = 2
     
+    # Search Execution Settings
+    SEARCH_MAX_WORKERS: int = 4
+    SEARCH_MAX_QUEUE_DEPTH: int = 32
+    SEARCH_RETRY_AFTER_SECONDS: int = 1
+    # Most queries accepted by one /search/batch request
+    SEARCH_BATCH_MAX_QUERIES: int = 64
+    # search_analytics rows are queued and written in batches by a background thread;
+    # rows beyond the queue size are dropped (counted in /health) instead of slowing searches
+    SEARCH_ANALYTICS_ENABLED: bool = True
+    SEARCH_ANALYTICS_BATCH_SIZE: int = 200
+    SEARCH_ANALYTICS_FLUSH_INTERVAL_MS: float = 1000.0
+    SEARCH_ANALYTICS_QUEUE_SIZE: int = 10000
+    
     # Logging Settings
     LOG_LEVEL: str = "INFO"
     LOG_FILE: str = "logs/rag_system.log"
@@ -39,8 +99,10 @@ class Settings(BaseSettings):
     # Security Settings
     ALLOWED_ORIGINS: List[str] = ["*"]  # Configure for production
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    # Token required in the X-Admin-Token header by /admin endpoints; they are disabled while unset
+    ADMIN_API_TOKEN: Optional[str] = None
     
-    @validator('DATABASE_PATH', 'FAISS_INDEX_PATH', 'BM25_INDEX_PATH', 'LOG_FILE')
+    @validator('DATABASE_PATH', 'FAISS_INDEX_PATH', 'BM25_INDEX_PATH', 'LOG_FILE', 'RESULT_CACHE_PATH', 'EMBEDDING_CACHE_PATH')
     def create_parent_dirs(cls, v):
         """Create parent directories if they don't exist"""
         path = Path(v)
@@ -0,0 +1,53 @@
+"""GET /chunks/{chunk_id} and the full_text_url links /search returns for truncated snippets"""
+
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("sentence_transformers")
+from fastapi.testclient import TestClient
+
+from rag_system.api_service import main
+from rag_system.api_service.utils.executor import SearchExecutor
+
+
+class _Store:
+    def __init__(self, chunks):
+        self.chunks = {chunk['chunk_id']: chunk for chunk in chunks}
+
+    def get_chunk(self, chunk_id, user_roles=None):
+        return self.chunks.get(chunk_id)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    chunks = [
+        {'chunk_id': 'lythaito-000', 'document_id': 'lythaito', 'title': 'Lý Thái Tổ',
+         'text': 'Lý Thái Tổ trị vì từ năm 1009 đến khi qua đời vào năm 1028. ' * 10, 'metadata': {}},
+        {'chunk_id': 'lich-su/lythaito-001', 'document_id': 'lich-su/lythaito', 'title': 'Lý Thái Tổ',
+         'text': 'Thời gian trị vì của ông chủ yếu tập trung vào việc xây dựng đất nước. ' * 10, 'metadata': {}},
+    ]
+    monkeypatch.setattr(main, "hybrid_retriever", SimpleNamespace(metadata_store=_Store(chunks)))
+    executor = SearchExecutor(max_workers=1, max_queue_depth=1)
+    monkeypatch.setattr(main, "search_executor", executor)
+    # Without a `with` block the startup event (model and index loading) does not run
+    yield TestClient(main.app), chunks
+    executor.shutdown()
+
+
+@pytest.mark.parametrize("position", [0, 1])
+def test_full_text_url_returns_the_chunk(client, position):
+    test_client, chunks = client
+    chunk = chunks[position]
+    result = main.apply_snippet(dict(chunk, similarity_score=0.9, rank=1), snippet_chars=40)
+
+    assert result['text_truncated']
+    response = test_client.get(result['full_text_url'])
+    assert response.status_code == 200
+    assert response.json()['chunk_id'] == chunk['chunk_id']
+    assert response.json()['text'] == chunk['text']
+
+
+def test_unknown_chunk_is_404(client):
+    test_client, _ = client
+    assert test_client.get("/chunks/lich-su%2Fmissing").status_code == 404
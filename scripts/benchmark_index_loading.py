@@ -0,0 +1,109 @@
+# benchmark_index_loading.py
+import argparse
+import logging
+import multiprocessing as mp
+import time
+
+import numpy as np
+from colorama import Fore, Style, init as colorama_init
+
+# ==== CONFIG ====
+INDEX_PATH = "rag_system/data/indexes/index.faiss"
+WORKERS = 4
+QUERIES = 10
+
+# ==== INIT COLOR LOG ====
+colorama_init(autoreset=True)
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+def log_info(msg): logging.info(Fore.CYAN + msg + Style.RESET_ALL)
+def log_success(msg): logging.info(Fore.GREEN + msg + Style.RESET_ALL)
+
+def read_memory_kb():
+    """Rss/Pss/Private của tiến trình hiện tại (kB) từ /proc/self/smaps_rollup"""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'private': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+    }
+
+def worker(index_path, mmap, queries, barrier, results):
+    """Một worker giống một tiến trình API: load index, chạy truy vấn đầu tiên, đo bộ nhớ"""
+    from rag_system.api_service.utils.indexing import read_index
+
+    baseline = read_memory_kb()
+    started = time.perf_counter()
+    index = read_index(index_path, mmap=mmap)
+    loaded = time.perf_counter()
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((queries, index.d)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index.search(vectors[:1], 5)
+    first_query = time.perf_counter()
+    if queries > 1:
+        index.search(vectors[1:], 5)
+    done = time.perf_counter()
+
+    # Đo khi mọi worker đều đang giữ index, để thấy phần trang được chia sẻ (PSS)
+    barrier.wait()
+    memory = read_memory_kb()
+    barrier.wait()
+    results.put({
+        'load_ms': (loaded - started) * 1000,
+        'first_query_ms': (first_query - started) * 1000,
+        'query_ms': (done - first_query) * 1000 / max(queries - 1, 1),
+        'rss_mb': (memory['rss'] - baseline['rss']) / 1024,
+        'pss_mb': (memory['pss'] - baseline['pss']) / 1024,
+        'private_mb': (memory['private'] - baseline['private']) / 1024,
+    })
+
+def run_mode(index_path, mmap, workers, queries):
+    context = mp.get_context("spawn")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(index_path, mmap, queries, barrier, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    rows = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return rows
+
+def main():
+    """
+    So sánh load FAISS index vào heap với memory-map (FAISS_MMAP) trên nhiều worker:
+    thời gian load, thời gian tới truy vấn đầu tiên và RSS/PSS tăng thêm mỗi worker.
+    Với mmap các trang vector nằm trong page cache dùng chung nên tổng PSS không nhân theo số worker.
+    Chạy hai lần nếu muốn đo với page cache nguội/nóng (drop_caches cần quyền root).
+    """
+    parser = argparse.ArgumentParser(description="Benchmark heap vs memory-mapped FAISS index loading")
+    parser.add_argument("--index", default=INDEX_PATH, help="Đường dẫn tới file FAISS index")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Số tiến trình load index đồng thời")
+    parser.add_argument("--queries", type=int, default=QUERIES, help="Số truy vấn ngẫu nhiên mỗi worker")
+    args = parser.parse_args()
+
+    log_info(f"📊 Benchmark '{args.index}' với {args.workers} worker...")
+    header = f"{'mode':<6} {'load ms':>9} {'1st query ms':>13} {'query ms':>9} {'RSS MB':>8} {'PSS MB':>8} {'private MB':>11} {'total PSS MB':>13}"
+    lines = [header, "-" * len(header)]
+    for mode, mmap in (("heap", False), ("mmap", True)):
+        rows = run_mode(args.index, mmap, args.workers, args.queries)
+        mean = {key: float(np.mean([row[key] for row in rows])) for key in rows[0]}
+        total_pss = sum(row['pss_mb'] for row in rows)
+        lines.append(
+            f"{mode:<6} {mean['load_ms']:>9.1f} {mean['first_query_ms']:>13.1f} {mean['query_ms']:>9.2f} "
+            f"{mean['rss_mb']:>8.1f} {mean['pss_mb']:>8.1f} {mean['private_mb']:>11.1f} {total_pss:>13.1f}"
+        )
+
+    for line in lines:
+        log_success(line)
+    log_info("ℹ️ Giá trị RSS/PSS/private là phần tăng thêm sau khi load, trung bình mỗi worker.")
+
+if __name__ == "__main__":
+    main()
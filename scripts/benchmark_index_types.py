@@ -0,0 +1,107 @@
+# benchmark_index_types.py
+import argparse
+import logging
+import time
+
+import faiss
+import numpy as np
+from colorama import Fore, Style, init as colorama_init
+
+from rag_system.api_service.utils.database import DatabaseManager
+from rag_system.api_service.utils.index_factory import INDEX_TYPES, build_index, search_parameters
+from rag_system.api_service.utils.faiss_ids import load_active_embeddings
+from rag_system.config import settings
+
+# ==== CONFIG ====
+DB_PATH = "rag_system/data/metadata.db"
+TOP_K = 10
+QUERIES = 500
+NPROBE_SWEEP = "1,4,16,64"
+EF_SEARCH_SWEEP = "16,64,256"
+
+# ==== INIT COLOR LOG ====
+colorama_init(autoreset=True)
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+def log_info(msg): logging.info(Fore.CYAN + msg + Style.RESET_ALL)
+def log_success(msg): logging.info(Fore.GREEN + msg + Style.RESET_ALL)
+def log_warn(msg): logging.warning(Fore.YELLOW + msg + Style.RESET_ALL)
+
+def timed_search(index, queries, k, params):
+    """Tìm từng truy vấn một (giống /search); trả về (ids, danh sách latency ms)"""
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k, params=params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(ids[0])
+    return np.vstack(results), latencies
+
+def recall_at_k(found, truth):
+    """Tỉ lệ trung bình của top-k đúng (Flat) xuất hiện trong top-k tìm được"""
+    hits = [len(np.intersect1d(f[f != -1], t[t != -1])) / max((t != -1).sum(), 1) for f, t in zip(found, truth)]
+    return float(np.mean(hits))
+
+def main():
+    """
+    Báo cáo recall@k so với latency cho các INDEX_TYPE, lấy IndexFlatIP làm ground truth.
+    Truy vấn là embedding của các chunk được giữ lại (không đưa vào index), nên không tự khớp chính nó.
+    """
+    parser = argparse.ArgumentParser(description="Recall@k vs latency report for FAISS index types")
+    parser.add_argument("--db", default=DB_PATH, help="Đường dẫn tới metadata.db")
+    parser.add_argument("--types", default=",".join(INDEX_TYPES), help="Các loại index cần đo, cách nhau bởi dấu phẩy")
+    parser.add_argument("--k", type=int, default=TOP_K, help="k của recall@k")
+    parser.add_argument("--queries", type=int, default=QUERIES, help="Số chunk giữ lại làm truy vấn")
+    parser.add_argument("--nprobe", default=NPROBE_SWEEP, help="Các giá trị nprobe cho IVF")
+    parser.add_argument("--ef-search", default=EF_SEARCH_SWEEP, help="Các giá trị efSearch cho HNSW")
+    parser.add_argument("--nlist", type=int, default=settings.INDEX_NLIST, help="Số cell IVF (0 = tự động)")
+    parser.add_argument("--pq-m", type=int, default=settings.INDEX_PQ_M, help="Số sub-quantizer PQ")
+    parser.add_argument("--hnsw-m", type=int, default=settings.INDEX_HNSW_M, help="M của HNSW")
+    args = parser.parse_args()
+
+    db = DatabaseManager(args.db)
+    ids, vectors = load_active_embeddings(db)
+    db.close_connections()
+    if len(ids) <= args.queries:
+        log_warn(f"⚠️ Chỉ có {len(ids)} embeddings, cần nhiều hơn --queries={args.queries}.")
+        return
+
+    rng = np.random.default_rng(0)
+    held_out = np.zeros(len(ids), dtype=bool)
+    held_out[rng.choice(len(ids), args.queries, replace=False)] = True
+    queries = np.ascontiguousarray(vectors[held_out])
+    ids, vectors = ids[~held_out], vectors[~held_out]
+    log_info(f"📚 {len(ids)} vectors (dim {vectors.shape[1]}), {len(queries)} truy vấn, k={args.k}")
+
+    truth_index = build_index(vectors, ids, "flat")
+    truth, _ = timed_search(truth_index, queries, args.k, None)
+
+    header = f"{'index':<10} {'param':<14} {'recall@' + str(args.k):>10} {'mean ms':>9} {'p95 ms':>8} {'build s':>8} {'size MB':>8}"
+    lines = [header, "-" * len(header)]
+    for index_type in args.types.split(","):
+        build_start = time.perf_counter()
+        try:
+            index = build_index(vectors, ids, index_type, nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m)
+        except ValueError as e:
+            log_warn(f"⚠️ Bỏ qua {index_type}: {e}")
+            continue
+        build_seconds = time.perf_counter() - build_start
+        size_mb = len(faiss.serialize_index(index)) / (1024 * 1024)
+
+        if index_type.startswith("ivf"):
+            sweep = [(f"nprobe={n}", {'nprobe': int(n)}) for n in args.nprobe.split(",")]
+        elif index_type == "hnsw":
+            sweep = [(f"efSearch={ef}", {'ef_search': int(ef)}) for ef in args.ef_search.split(",")]
+        else:
+            sweep = [("-", {})]
+        for label, knobs in sweep:
+            found, latencies = timed_search(index, queries, args.k, search_parameters(index, **knobs))
+            lines.append(
+                f"{index_type:<10} {label:<14} {recall_at_k(found, truth):>10.3f} {np.mean(latencies):>9.3f} "
+                f"{np.percentile(latencies, 95):>8.3f} {build_seconds:>8.2f} {size_mb:>8.1f}"
+            )
+
+    for line in lines:
+        log_success(line)
+
+if __name__ == "__main__":
+    main()
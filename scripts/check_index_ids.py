@@ -0,0 +1,53 @@
+# check_index_ids.py
+import argparse
+import json
+import logging
+import sys
+
+import faiss
+from colorama import Fore, Style, init as colorama_init
+
+from rag_system.api_service.utils.database import DatabaseManager
+from rag_system.api_service.utils.faiss_ids import check_index_ids
+
+# ==== CONFIG ====
+DB_PATH = "rag_system/data/metadata.db"
+INDEX_PATH = "rag_system/data/indexes/index.faiss"
+
+# ==== INIT COLOR LOG ====
+colorama_init(autoreset=True)
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+def log_info(msg): logging.info(Fore.CYAN + msg + Style.RESET_ALL)
+def log_success(msg): logging.info(Fore.GREEN + msg + Style.RESET_ALL)
+def log_error(msg): logging.error(Fore.RED + msg + Style.RESET_ALL)
+
+def main():
+    """
+    Kiểm tra FAISS index có đúng một vector cho mỗi chunk active (ID = chunks.id) và không có ID lạ.
+    Thoát với mã 1 nếu không khớp, để dùng được trong cron/CI trước khi deploy index.
+    """
+    parser = argparse.ArgumentParser(description="Check FAISS ids against chunks.id")
+    parser.add_argument("--db", default=DB_PATH, help="Đường dẫn tới metadata.db")
+    parser.add_argument("--index", default=INDEX_PATH, help="Đường dẫn tới file FAISS index")
+    parser.add_argument("--json", action="store_true", help="In báo cáo dạng JSON")
+    args = parser.parse_args()
+
+    db = DatabaseManager(args.db)
+    index = faiss.read_index(args.index)
+    report = check_index_ids(index, db)
+    db.close_connections()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        log_info(f"🔍 '{args.index}': {report['ntotal']} vectors, {report['indexable_chunks']} chunks active có embedding.")
+        log_info(f"   khớp {report['matched']}, thiếu {report['missing']}, thừa {report['stale']}, trùng {report['duplicates']}")
+    if report['consistent']:
+        log_success("✅ ID của index khớp với database.")
+        return 0
+    log_error(f"❌ Index lệch database. Ví dụ thiếu: {report['missing_sample']}, thừa: {report['stale_sample']}. "
+              f"Chạy scripts/rebuild_index.py để dựng lại.")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,9 @@
 # import_data.py (FINAL-FIXED version 2)
 import os
-import json
 import logging
-from pathlib import Path
-from typing import Dict, Any
+import time
+from datetime import datetime
+from typing import Dict, Any, Optional
 
 import faiss
 import numpy as np
@@ -12,12 +12,27 @@ from colorama import Fore, Style, init as colorama_init
 
 # Import lớp quản lý DB từ chính hệ thống của bạn
 from rag_system.api_service.utils.database import DatabaseManager
+from rag_system.api_service.utils.chunk_stream import ChunkStreamReader, find_ingested_documents
+from rag_system.api_service.utils.index_factory import build_index, has_chunk_ids, supports_remove
+from rag_system.api_service.utils.faiss_ids import check_index_ids, load_active_embeddings
+from rag_system.api_service.utils.indexing import write_index_atomic
+from rag_system.config import settings
+from rag_system.api_service.utils.text_processing import content_hash
 
 # ==== CONFIG ====
 INDEX_PATH = "rag_system/data/indexes/index.faiss"
 JSON_DIR = "rag_system/data/ingested_json"
 MODEL_NAME = "AITeamVN/Vietnamese_Embedding"
 USE_GPU = True
+BULK_BATCH_SIZE = 500  # số chunk mỗi transaction
+# Loại index khi phải dựng mới (flat / ivf_flat / ivf_pq / hnsw / sq8), lấy từ settings
+INDEX_TYPE = settings.INDEX_TYPE
+INDEX_OPTIONS = {
+    "nlist": settings.INDEX_NLIST,
+    "pq_m": settings.INDEX_PQ_M,
+    "hnsw_m": settings.INDEX_HNSW_M,
+    "ef_construction": settings.INDEX_HNSW_EF_CONSTRUCTION,
+}
 
 # ==== INIT COLOR LOG ====
 colorama_init(autoreset=True)
@@ -52,12 +67,68 @@ def upsert_document(db: DatabaseManager, doc_data: Dict[str, Any]) -> None:
                 VALUES (:document_id, :title, :source, :version, :language, :processing_status)
             """, doc_payload)
 
-def update_document_status(db: DatabaseManager, doc_id: str, status: str, num_chunks: int):
-    """Cập nhật trạng thái sau khi xử lý xong."""
+def update_document_status(db: DatabaseManager, doc_id: str, status: str, num_chunks: int,
+                           file_hash: Optional[str] = None):
+    """Cập nhật trạng thái sau khi xử lý xong (file_hash và last_processed chỉ khi thành công)."""
+    last_processed = datetime.now().isoformat() if status == "completed" else None
     with db.get_cursor() as cursor:
         cursor.execute("""
-            UPDATE documents SET processing_status = ?, total_chunks = ? WHERE document_id = ?
-        """, (status, num_chunks, doc_id))
+            UPDATE documents SET processing_status = ?, total_chunks = ?,
+                file_hash = COALESCE(?, file_hash), last_processed = COALESCE(?, last_processed)
+            WHERE document_id = ?
+        """, (status, num_chunks, file_hash, last_processed, doc_id))
+
+def is_document_unchanged(db: DatabaseManager, doc_id: str, file_hash: Optional[str]) -> bool:
+    """Tài liệu đã import thành công với cùng file_hash thì bỏ qua."""
+    if not file_hash:
+        return False
+    with db.get_cursor() as cursor:
+        cursor.execute("SELECT file_hash, processing_status FROM documents WHERE document_id = ?", (doc_id,))
+        row = cursor.fetchone()
+    return row is not None and row['file_hash'] == file_hash and row['processing_status'] == 'completed'
+
+def get_existing_chunks(db: DatabaseManager, doc_id: str) -> Dict[str, Any]:
+    """chunk_id -> (id, text_hash, is_active) của các chunk đã có trong DB cho tài liệu."""
+    with db.get_cursor() as cursor:
+        cursor.execute("SELECT id, chunk_id, text, is_active FROM chunks WHERE document_id = ?", (doc_id,))
+        return {
+            row['chunk_id']: (row['id'], content_hash(row['text'] or ''), bool(row['is_active']))
+            for row in cursor.fetchall()
+        }
+
+def load_or_create_index(dim: int):
+    """Mở index hiện có để cập nhật tăng dần; trả về (index, True) nếu phải tạo mới (index=None)."""
+    if os.path.exists(INDEX_PATH):
+        index = faiss.read_index(INDEX_PATH)
+        if has_chunk_ids(index) and index.d == dim:
+            log_info(f"📦 Cập nhật FAISS index hiện có ({index.ntotal} vectors)...")
+            return index, False
+        log_warn("⚠️ Index hiện có không mang chunk id hoặc sai số chiều, tạo lại từ DB.")
+    log_info(f"📦 Sẽ dựng FAISS index '{INDEX_TYPE}' mới từ DB...")
+    return None, True
+
+def build_chunk_payload(data: Dict[str, Any], chunk: Dict[str, Any]) -> Dict[str, Any]:
+    """Tạo bản ghi chunk cho DB từ dữ liệu JSON."""
+    chunk_text = chunk.get('text', '')
+    chunk_payload = {
+        'chunk_id': chunk['chunk_id'],
+        'document_id': data['document_id'],
+        'title': data.get('title'),
+        'source': data.get('source'),
+        'version': data.get('version', '1.0'),
+        'language': data.get('language', 'vi'),
+        'text': chunk_text,
+        'embedding': chunk['embedding'],
+        # FIX: Thêm key 'tokens' với giá trị là số từ trong text
+        'tokens': len(chunk_text.split())
+    }
+
+    # Cung cấp giá trị mặc định cho các tham số khác mà DB yêu cầu
+    for key in ['heading', 'heading_level', 'section_index', 'section_chunk_index', 
+                'start_page', 'end_page', 'access_roles', 'confidentiality_level', 
+                'author', 'category', 'keywords', 'summary', 'metadata']:
+        chunk_payload.setdefault(key, None)
+    return chunk_payload
 
 def main():
     log_info("🚀 Khởi tạo mô hình embedding...")
@@ -65,86 +136,137 @@ def main():
     dim = model.get_sentence_embedding_dimension()
     log_success(f"✅ Số chiều embedding: {dim}")
 
-    log_info("📦 Khởi tạo FAISS index...")
-    index = faiss.IndexFlatIP(dim)
-    index = faiss.IndexIDMap2(index)
+    index, fresh_index = load_or_create_index(dim)
 
     db = DatabaseManager()
-    files = list(Path(JSON_DIR).glob("*.json"))
+    # <doc>.jsonl + <doc>.f32 (đọc từng chunk) hoặc <doc>.json kiểu cũ
+    files = find_ingested_documents(JSON_DIR)
     if not files:
-        log_warn("⚠️ Không tìm thấy file JSON nào."); return
+        log_warn("⚠️ Không tìm thấy file JSON/JSONL nào."); return
 
-    stats = {"docs": 0, "chunks_inserted": 0, "chunks_skipped": 0}
+    stats = {"docs": 0, "docs_unchanged": 0, "chunks_inserted": 0, "chunks_updated": 0,
+             "chunks_unchanged": 0, "chunks_deleted": 0, "chunks_skipped": 0}
+    # Vector và ID mới được gom lại để add_with_ids một lần duy nhất; ID cũ bị thay thế gom để remove_ids
+    all_vectors, all_ids, removed_ids = [], [], []
+    import_start = time.perf_counter()
 
     for file in files:
-        log_info(f"📂 Xử lý file: {file.name}")
+        doc_start = time.perf_counter()
+        doc_id = None
         try:
-            with open(file, "r", encoding="utf-8") as f: data = json.load(f)
+            reader = ChunkStreamReader(file)
+            data = reader.header
             doc_id = data.get('document_id')
             if not doc_id:
                 log_warn(f"⚠️ File {file.name} thiếu 'document_id', bỏ qua."); continue
 
+            file_hash = data.get('file_hash')
+            if is_document_unchanged(db, doc_id, file_hash):
+                stats["docs_unchanged"] += 1; continue
+
+            log_info(f"📂 Xử lý file: {file.name}")
             upsert_document(db, data)
             stats["docs"] += 1
 
+            existing = get_existing_chunks(db, doc_id)
+            seen_chunk_ids = set()
             chunks_in_doc = 0
-            for chunk in data.get("chunks", []):
-                if "embedding" not in chunk or "chunk_id" not in chunk:
-                    stats["chunks_skipped"] += 1; continue
-
-                vec = np.array(chunk["embedding"], dtype="float32")
-                if vec.shape[0] != dim:
-                    stats["chunks_skipped"] += 1; continue
-
-                chunk_text = chunk.get('text', '')
-                chunk_payload = {
-                    'chunk_id': chunk['chunk_id'],
-                    'document_id': doc_id,
-                    'title': data.get('title'),
-                    'source': data.get('source'),
-                    'version': data.get('version', '1.0'),
-                    'language': data.get('language', 'vi'),
-                    'text': chunk_text,
-                    'embedding': chunk['embedding'],
-                    # FIX: Thêm key 'tokens' với giá trị là số từ trong text
-                    'tokens': len(chunk_text.split())
-                }
-
-                # Cung cấp giá trị mặc định cho các tham số khác mà DB yêu cầu
-                for key in ['heading', 'heading_level', 'section_index', 'section_chunk_index', 
-                            'start_page', 'end_page', 'access_roles', 'confidentiality_level', 
-                            'author', 'category', 'keywords', 'summary', 'metadata']:
-                    chunk_payload.setdefault(key, None)
-
-
-                inserted_id = db.insert_chunk(chunk_payload)
-
-                if inserted_id:
-                    index.add_with_ids(vec.reshape(1, -1), np.array([inserted_id], dtype="int64"))
-                    stats["chunks_inserted"] += 1
-                    chunks_in_doc += 1
-                else:
-                    stats["chunks_skipped"] += 1
-
-            update_document_status(db, doc_id, "completed", chunks_in_doc)
-            log_success(f"  ✔ Hoàn tất xử lý {doc_id} với {chunks_in_doc} chunks.")
+            # Đọc và ghi theo batch: bộ nhớ không phụ thuộc kích thước tài liệu
+            for chunks, embeddings in reader.iter_batches(BULK_BATCH_SIZE):
+                payloads, vectors = [], []
+                for chunk, vec in zip(chunks, embeddings):
+                    if vec is None or "chunk_id" not in chunk:
+                        stats["chunks_skipped"] += 1; continue
+                    if vec.shape != (dim,):
+                        stats["chunks_skipped"] += 1; continue
+
+                    seen_chunk_ids.add(chunk["chunk_id"])
+                    text_hash = chunk.pop("text_hash", None) or content_hash(chunk.get("text", ""))
+                    old = existing.get(chunk["chunk_id"])
+                    if old is not None and old[2] and old[1] == text_hash:
+                        # Text không đổi: giữ nguyên bản ghi và vector đã có
+                        stats["chunks_unchanged"] += 1; chunks_in_doc += 1; continue
+
+                    chunk["embedding"] = vec
+                    payload = build_chunk_payload(data, chunk)
+                    if old is None:
+                        payloads.append(payload)
+                        vectors.append(vec)
+                    else:
+                        # Text đổi (hoặc chunk đã bị xóa mềm): cập nhật tại chỗ, giữ nguyên ID
+                        row_id = db.update_chunk(payload, reason=f"Re-ingested {doc_id}")
+                        removed_ids.append(row_id)
+                        all_vectors.append(vec.reshape(1, -1))
+                        all_ids.append(np.asarray([row_id], dtype="int64"))
+                        stats["chunks_updated"] += 1; chunks_in_doc += 1
+
+                # Một transaction executemany cho mỗi batch thay vì một commit mỗi chunk
+                inserted_ids = db.insert_chunks_bulk(payloads, batch_size=BULK_BATCH_SIZE) if payloads else []
+                if inserted_ids:
+                    all_vectors.append(np.vstack(vectors))
+                    all_ids.append(np.asarray(inserted_ids, dtype="int64"))
+                stats["chunks_inserted"] += len(inserted_ids)
+                chunks_in_doc += len(inserted_ids)
+
+            # Chunk không còn trong phiên bản mới của tài liệu
+            for chunk_id, (row_id, _, is_active) in existing.items():
+                if is_active and chunk_id not in seen_chunk_ids:
+                    db.soft_delete_chunk(chunk_id, invalidated_by=doc_id,
+                                         reason="Chunk no longer present in re-ingested document")
+                    removed_ids.append(row_id)
+                    stats["chunks_deleted"] += 1
+
+            update_document_status(db, doc_id, "completed", chunks_in_doc, file_hash)
+            elapsed = time.perf_counter() - doc_start
+            log_success(f"  ✔ Hoàn tất xử lý {doc_id} với {chunks_in_doc} chunks "
+                        f"({chunks_in_doc / elapsed if elapsed > 0 else 0:.0f} chunks/s).")
 
         except Exception as e: 
             log_error(f"❌ Lỗi khi xử lý {file.name}: {e}")
-            if 'doc_id' in locals():
+            if doc_id:
                 update_document_status(db, doc_id, "failed", 0)
 
-    if stats["chunks_inserted"] > 0:
-        os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
-        faiss.write_index(index, INDEX_PATH)
+    index_changed = fresh_index or all_ids or removed_ids
+    if index_changed:
+        faiss_start = time.perf_counter()
+        if not fresh_index and removed_ids and not supports_remove(index):
+            log_warn("⚠️ Index hiện có (HNSW) không xóa được vector, dựng lại từ DB.")
+            fresh_index = True
+        if fresh_index:
+            # Không có index cũ: dựng (và train) từ mọi chunk active trong DB (gồm cả tài liệu không đổi)
+            ids, vectors_matrix = load_active_embeddings(db, dim)
+            index = build_index(vectors_matrix, ids, INDEX_TYPE, dimension=dim, **INDEX_OPTIONS)
+        else:
+            if removed_ids:
+                index.remove_ids(np.asarray(removed_ids, dtype="int64"))
+            ids = np.concatenate(all_ids) if all_ids else np.zeros(0, dtype="int64")
+            if all_vectors:
+                vectors_matrix = np.ascontiguousarray(np.concatenate(all_vectors), dtype="float32")
+                index.add_with_ids(vectors_matrix, ids)
+        log_info(f"  ⏱ FAISS: +{len(ids)} / -{0 if fresh_index else len(removed_ids)} vectors "
+                 f"trong {time.perf_counter() - faiss_start:.2f}s (tổng {index.ntotal})")
+        # Ghi ra file tạm rồi rename: API đang chạy không bao giờ đọc phải index ghi dở
+        write_index_atomic(index, INDEX_PATH)
         log_success(f"💾 Đã lưu FAISS index vào {INDEX_PATH}")
+        # FAISS ID = chunks.id: index phải chứa đúng các chunk active trong DB
+        report = check_index_ids(index, db)
+        if not report['consistent']:
+            log_warn(f"⚠️ Index lệch với database: thiếu {report['missing']}, thừa {report['stale']}, "
+                     f"trùng {report['duplicates']}. Chạy scripts/rebuild_index.py.")
 
     db.close_connections()
+    total_elapsed = time.perf_counter() - import_start
+    written = stats["chunks_inserted"] + stats["chunks_updated"]
 
     log_info("\n📊 **BÁO CÁO TỔNG KẾT**")
-    log_success(f"  ✔ Documents xử lý: {stats['docs']}")
+    log_success(f"  ✔ Documents xử lý: {stats['docs']} (không đổi, bỏ qua: {stats['docs_unchanged']})")
     log_success(f"  ✔ Chunks thêm mới: {stats['chunks_inserted']}")
+    log_success(f"  ✔ Chunks cập nhật: {stats['chunks_updated']}")
+    log_success(f"  ✔ Chunks không đổi: {stats['chunks_unchanged']}")
+    log_success(f"  ✔ Chunks xóa mềm: {stats['chunks_deleted']}")
     log_warn(f"  ⚠️ Chunks bỏ qua: {stats['chunks_skipped']}")
+    log_success(f"  ⏱ Thời gian: {total_elapsed:.2f}s "
+                f"({written / total_elapsed if total_elapsed > 0 else 0:.0f} chunks/s)")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
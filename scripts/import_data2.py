@@ -11,6 +11,8 @@ import numpy as np
 from sentence_transformers import SentenceTransformer
 from colorama import Fore, Style, init as colorama_init
 
+from rag_system.api_service.utils.database import encode_embedding
+
 # ==== CONFIG ====
 DB_PATH = "rag_system/data/metadata.db"
 INDEX_PATH = "rag_system/data/indexes/index.faiss"
@@ -40,8 +42,8 @@ class DBManager:
         Trả về None nếu chunk đã tồn tại hoặc có lỗi.
         """
         try:
-            # Sửa lỗi Bug 1: Chuyển embedding sang chuỗi JSON
-            embedding_json = json.dumps(chunk["embedding"].tolist())
+            # Lưu embedding dạng BLOB float32 nhị phân (thay cho chuỗi JSON)
+            embedding_blob = encode_embedding(chunk["embedding"])
             cursor = self.conn.cursor()
             
             # Sử dụng INSERT OR IGNORE để tránh lỗi nếu chunk_id đã tồn tại
@@ -53,7 +55,7 @@ class DBManager:
                 chunk["chunk_id"],
                 chunk["document_id"],
                 chunk["text"],
-                embedding_json
+                embedding_blob
             ))
             
             self.conn.commit()
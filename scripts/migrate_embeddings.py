@@ -0,0 +1,40 @@
+# migrate_embeddings.py
+import argparse
+import logging
+
+from colorama import Fore, Style, init as colorama_init
+
+from rag_system.api_service.utils.database import DatabaseManager
+
+# ==== CONFIG ====
+DB_PATH = "rag_system/data/metadata.db"
+
+# ==== INIT COLOR LOG ====
+colorama_init(autoreset=True)
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+def log_info(msg): logging.info(Fore.CYAN + msg + Style.RESET_ALL)
+def log_success(msg): logging.info(Fore.GREEN + msg + Style.RESET_ALL)
+
+def main():
+    """
+    Chuyển cột 'embedding' từ chuỗi JSON sang BLOB float32 nhị phân (tại chỗ).
+    """
+    parser = argparse.ArgumentParser(description="Migrate JSON embeddings to binary float32 blobs")
+    parser.add_argument("--db", default=DB_PATH, help="Đường dẫn tới metadata.db")
+    parser.add_argument("--batch-size", type=int, default=500, help="Số dòng mỗi transaction")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM sau khi migrate để thu hồi dung lượng")
+    args = parser.parse_args()
+
+    db = DatabaseManager(args.db)
+    log_info(f"🔁 Bắt đầu migrate embeddings trong '{args.db}'...")
+    migrated = db.migrate_embeddings_to_blob(batch_size=args.batch_size)
+    log_success(f"✅ Đã chuyển {migrated} embeddings sang định dạng nhị phân.")
+
+    if args.vacuum and migrated:
+        db.vacuum_database()
+        log_success("🧹 Đã VACUUM database.")
+
+    db.close_connections()
+
+if __name__ == "__main__":
+    main()
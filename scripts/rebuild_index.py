@@ -1,19 +1,28 @@
 # rebuild_index.py
-import os
-import sqlite3
-import json
 import logging
 from pathlib import Path
 
-import faiss
-import numpy as np
 from colorama import Fore, Style, init as colorama_init
 
+from rag_system.api_service.utils.database import DatabaseManager
+from rag_system.api_service.utils.faiss_ids import check_index_ids, load_active_embeddings
+from rag_system.api_service.utils.index_factory import build_index
+from rag_system.api_service.utils.indexing import write_index_atomic
+from rag_system.config import settings
+
 # ==== CONFIG ====
 DB_PATH = "rag_system/data/metadata.db"
 INDEX_PATH = "rag_system/data/indexes/index.faiss"
-# Lấy từ file readme.json hoặc từ model.get_sentence_embedding_dimension()
-EMBEDDING_DIM = 1024 
+# None = lấy theo embedding của chunk đầu tiên; chunk khác số chiều sẽ bị bỏ qua
+EMBEDDING_DIM = None
+# flat / ivf_flat / ivf_pq / hnsw / sq8 (xem INDEX_* trong rag_system/config)
+INDEX_TYPE = settings.INDEX_TYPE
+INDEX_OPTIONS = {
+    "nlist": settings.INDEX_NLIST,
+    "pq_m": settings.INDEX_PQ_M,
+    "hnsw_m": settings.INDEX_HNSW_M,
+    "ef_construction": settings.INDEX_HNSW_EF_CONSTRUCTION,
+}
 
 # ==== INIT COLOR LOG ====
 colorama_init(autoreset=True)
@@ -33,7 +42,7 @@ def log_error(msg):
 
 def rebuild_faiss_index():
     """
-    Đọc tất cả các chunk từ SQLite và xây dựng lại FAISS index.
+    Đọc các chunk active từ SQLite và xây dựng lại FAISS index (ID = chunks.id).
     """
     log_info(f"🔍 Bắt đầu quá trình xây dựng lại FAISS index từ '{DB_PATH}'...")
 
@@ -42,70 +51,36 @@ def rebuild_faiss_index():
         log_error(f"❌ Không tìm thấy file database tại: {DB_PATH}")
         return
 
+    db = DatabaseManager(DB_PATH)
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT chunk_id, embedding FROM chunks")
-        rows = cursor.fetchall()
+        # Chỉ chunk active có embedding; FAISS ID = chunks.id (xem utils/faiss_ids.py)
+        ids_np, vectors_np = load_active_embeddings(db, EMBEDDING_DIM)
     except Exception as e:
         log_error(f"❌ Lỗi khi đọc dữ liệu từ database: {e}")
+        db.close_connections()
         return
-    finally:
-        if 'conn' in locals() and conn:
-            conn.close()
 
-    if not rows:
-        log_warn("⚠️ Không có dữ liệu trong database để xây dựng index.")
+    if not len(ids_np):
+        log_warn("⚠️ Không có chunk active nào có embedding để xây dựng index.")
+        db.close_connections()
         return
 
-    log_info(f"📚 Tìm thấy {len(rows)} chunks trong database.")
-
-    # Khởi tạo FAISS index
-    log_info(f"📦 Khởi tạo FAISS index với dimension: {EMBEDDING_DIM}")
-    index = faiss.IndexFlatIP(EMBEDDING_DIM)
-    index = faiss.IndexIDMap2(index)
-
-    vectors = []
-    ids = []
-
-    for row in rows:
-        try:
-            # FIX: Đọc chuỗi JSON từ DB, chuyển thành list, rồi thành numpy array
-            embedding_list = json.loads(row['embedding'])
-            vector = np.array(embedding_list, dtype="float32")
-            
-            # Kiểm tra số chiều
-            if vector.shape[0] != EMBEDDING_DIM:
-                log_warn(f"⚠️ Chunk {row['chunk_id']} có dimension không hợp lệ ({vector.shape[0]}), bỏ qua.")
-                continue
-
-            # Tạo FAISS ID từ hash của chunk_id, đồng bộ với logic của import_data2.py
-            faiss_id = hash(row['chunk_id']) % (2**63 - 1)
-
-            vectors.append(vector)
-            ids.append(faiss_id)
-
-        except (json.JSONDecodeError, TypeError) as e:
-            log_warn(f"⚠️ Lỗi khi xử lý embedding cho chunk {row['chunk_id']}: {e}. Bỏ qua.")
-            continue
-    
-    if not vectors:
-        log_error("❌ Không có vector hợp lệ nào để thêm vào index.")
-        return
+    dim = vectors_np.shape[1]
+    log_info(f"📚 Tìm thấy {len(ids_np)} chunks active trong database.")
 
-    log_info(f"➕ Thêm {len(vectors)} vectors vào index...")
-    
-    # Chuyển đổi list thành numpy array 2D
-    vectors_np = np.array(vectors, dtype="float32")
-    ids_np = np.array(ids, dtype="int64")
+    # Khởi tạo, train (IVF/PQ/SQ) và thêm vectors vào index
+    log_info(f"📦 Dựng FAISS index '{INDEX_TYPE}' (dimension {dim}) với {len(ids_np)} vectors...")
+    index = build_index(vectors_np, ids_np, INDEX_TYPE, dimension=dim, **INDEX_OPTIONS)
 
-    # Thêm vào index
-    index.add_with_ids(vectors_np, ids_np)
+    # Chunk bị bỏ qua (sai số chiều) hoặc được ghi trong lúc build sẽ hiện là missing/stale
+    report = check_index_ids(index, db)
+    db.close_connections()
+    if not report['consistent']:
+        log_warn(f"⚠️ Index lệch với database: thiếu {report['missing']}, thừa {report['stale']}, "
+                 f"trùng {report['duplicates']} (ví dụ thiếu: {report['missing_sample']}).")
 
-    # Lưu FAISS index
-    os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
-    faiss.write_index(index, INDEX_PATH)
+    # Lưu FAISS index: ghi file tạm rồi rename để API đang chạy (IndexFileWatcher) không đọc phải file dở
+    write_index_atomic(index, INDEX_PATH)
     log_success(f"💾 Đã lưu FAISS index mới vào '{INDEX_PATH}' thành công!")
     log_info(f"✨ Index chứa tổng cộng {index.ntotal} vectors.")
 
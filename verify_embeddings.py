@@ -1,10 +1,11 @@
 # verify_embeddings.py
 import sqlite3
-import json
 import logging
 from pathlib import Path
 from colorama import Fore, Style, init as colorama_init
 
+from rag_system.api_service.utils.database import decode_embedding
+
 # ==== CONFIG ====
 DB_PATH = "rag_system/data/metadata.db"
 
@@ -27,7 +28,7 @@ def log_error(msg):
 def verify_embedding_format():
     """
     Kiểm tra cột 'embedding' trong bảng 'chunks' để xác thực rằng
-    tất cả dữ liệu được lưu dưới dạng chuỗi JSON hợp lệ.
+    tất cả dữ liệu được lưu dưới dạng BLOB float32 hợp lệ.
     """
     log_info(f"🔍 Bắt đầu kiểm tra định dạng embedding trong '{DB_PATH}'...")
 
@@ -56,6 +57,7 @@ def verify_embedding_format():
 
     total_chunks = len(rows)
     invalid_embeddings = 0
+    legacy_embeddings = 0
     
     log_info(f"🔬 Đang kiểm tra {total_chunks} chunks...")
 
@@ -63,18 +65,15 @@ def verify_embedding_format():
         chunk_id = row['chunk_id']
         embedding_data = row['embedding']
         
-        # Thử phân tích chuỗi JSON
         try:
-            # Kiểm tra xem có phải là chuỗi không
-            if not isinstance(embedding_data, str):
-                raise TypeError("Dữ liệu không phải là chuỗi (string).")
-            # Thử parse JSON
-            parsed_embedding = json.loads(embedding_data)
-            # Kiểm tra xem kết quả có phải là list không
-            if not isinstance(parsed_embedding, list):
-                 raise TypeError("Dữ liệu JSON sau khi parse không phải là list.")
-
-        except (json.JSONDecodeError, TypeError) as e:
+            if embedding_data is None:
+                raise TypeError("Chunk không có embedding.")
+            # Dữ liệu JSON cũ vẫn đọc được nhưng cần chạy scripts/migrate_embeddings.py
+            if isinstance(embedding_data, str):
+                legacy_embeddings += 1
+            decode_embedding(embedding_data)
+
+        except (ValueError, TypeError) as e:
             invalid_embeddings += 1
             log_warn(f"  - Lỗi chunk '{chunk_id}': Định dạng embedding không hợp lệ. Lỗi: {e}")
 
@@ -82,8 +81,11 @@ def verify_embedding_format():
     log_info("📊 **KẾT QUẢ KIỂM TRA**")
     log_info(f"  - Tổng số chunks đã kiểm tra: {total_chunks}")
     
+    if legacy_embeddings:
+        log_warn(f"  ⚠️ {legacy_embeddings} embeddings vẫn ở dạng JSON. Chạy scripts/migrate_embeddings.py để chuyển đổi.")
+
     if invalid_embeddings == 0:
-        log_success(f"  ✔ Tất cả {total_chunks} embeddings đều hợp lệ và được lưu dưới dạng JSON.")
+        log_success(f"  ✔ Tất cả {total_chunks} embeddings đều hợp lệ.")
         log_success("✅ Bug đã được khắc phục hoàn toàn!")
     else:
         log_error(f"  ✖ Tìm thấy {invalid_embeddings} embedding không hợp lệ.")